@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+def get_wait_time(message):
+    """
+    Returns the number of seconds to wait before queueing again, as given by an ATLAS 429 throttling message such as
+    ``'Request was throttled. Expected available in 30 seconds.'``. Defaults to 10 seconds.
+    """
+    t_sec = re.findall(r"available in (\d+) seconds", message)
+    t_min = re.findall(r"available in (\d+) minutes", message)
+    if t_sec:
+        return int(t_sec[0])
+    elif t_min:
+        return int(t_min[0]) * 60
+    return 10
+
+
+TOKEN_CACHE_KEY = 'atlas_app.api_token'
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the ``requests.Session`` shared by every ATLAS request in this process, so TCP and TLS connections to the
+    server are kept alive and reused. Its pool size is ``POOL_SIZE`` in ``settings.BROKERS['atlas']`` (default 20).
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session(settings.BROKERS['atlas'].get('POOL_SIZE', 20))
+        return _session
+
+
+def get_token(base_url=None, refresh=False):
+    """
+    Returns an ATLAS API token. The ``ATLASFORCED_SECRET_KEY`` environment variable is used if it is set; otherwise the
+    token is read from the Django cache, and only if it is not cached do we log in with the credentials in
+    ``settings.BROKERS['atlas']`` and cache the new token.
+
+    :param refresh: ignore the environment and the cache and log in again, e.g. after a 401 response
+    :type refresh: bool
+    """
+    if not refresh:
+        token = os.environ.get("ATLASFORCED_SECRET_KEY") or cache.get(TOKEN_CACHE_KEY)
+        if token:
+            return token
+
+    base_url = base_url or settings.BROKERS['atlas']['BASEURL']
+    data = {"username": settings.BROKERS['atlas']['USER'],
+            "password": settings.BROKERS['atlas']['PASS']}
+    resp = get_session().post(url=f"{base_url}/api-token-auth/", data=data)
+    if resp.status_code == 200:
+        token = resp.json()["token"]
+        cache.set(TOKEN_CACHE_KEY, token, None)
+        return token
+    raise Exception(f"ERROR {resp.status_code}. {resp.text}")
+
+
+def make_session(pool_size):
+    """
+    Returns a ``requests.Session`` whose connection pool can hold ``pool_size`` keep-alive connections to ATLAS.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class AtlasClient:
+    """
+    Asyncio client for the ATLAS forced-photometry server.
+
+    It follows the same protocol as ``main_func``: POST a position to ``/queue/``, poll the returned task URL until it
+    has a ``finishtimestamp`` and then download ``result_url``. Any number of positions can be in flight at once; all
+    outstanding tasks are polled together in one round, and the interval between rounds backs off while nothing
+    finishes. Requests go through the process-wide pooled ``requests.Session`` from ``get_session`` and run in worker
+    threads, so no extra HTTP library is needed.
+
+    :param token: ATLAS API token. Defaults to ``get_token()``; a 401 response fetches a new one and retries.
+    :type token: str
+
+    :param max_in_flight: Maximum number of tasks queued on the ATLAS server at the same time
+    :type max_in_flight: int
+
+    :param on_progress: Called as ``on_progress(task_url, task)`` with the task JSON whenever a task is seen to start
+        or finish on the server
+    :type on_progress: callable
+    """
+
+    POLL_INTERVAL = 2.0
+    MAX_POLL_INTERVAL = 30.0
+    POLL_BACKOFF = 1.5
+
+    def __init__(self, token=None, base_url=None, max_in_flight=10, session=None, on_progress=None):
+        self.base_url = base_url or settings.BROKERS['atlas']['BASEURL']
+        self.token = token or get_token(self.base_url)
+        self.max_in_flight = max_in_flight
+        self.session = session or get_session()
+        self.on_progress = on_progress
+        self._task_states = {}
+        self._waiting = {}
+        self._poller = None
+        self._throttled_until = 0.0
+        self._token_lock = asyncio.Lock()
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Token {self.token}", "Accept": "application/json"}
+
+    async def _request(self, method, url, **kwargs):
+        token = self.token
+        resp = await asyncio.to_thread(self.session.request, method, url, headers=self.headers, **kwargs)
+        if resp.status_code == 401:
+            async with self._token_lock:
+                if self.token == token:   # concurrent requests that got a 401 only log in again once
+                    self.token = await asyncio.to_thread(get_token, self.base_url, True)
+            resp = await asyncio.to_thread(self.session.request, method, url, headers=self.headers, **kwargs)
+        return resp
+
+    async def submit(self, ra, dec, mjd_min):
+        """
+        Queues a forced-photometry task and returns its task URL. A 429 response pauses every submission made by this
+        client for the time given in the throttling message, then the position is queued again.
+        """
+        while True:
+            delay = self._throttled_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            resp = await self._request('POST', f"{self.base_url}/queue/",
+                                       data={"ra": ra, "dec": dec, "mjd_min": mjd_min, "send_email": False})
+            if resp.status_code == 201:
+                return resp.json()["url"]
+            elif resp.status_code == 429:
+                message = resp.json()["detail"]
+                waittime = get_wait_time(message)
+                logger.info('%s %s -- waiting %s seconds', resp.status_code, message, waittime)
+                self._throttled_until = max(self._throttled_until, time.monotonic() + waittime)
+            else:
+                raise Exception(f"ERROR {resp.status_code}. {resp.text}")
+
+    async def wait_for_result_url(self, task_url):
+        """
+        Waits until the task at ``task_url`` has finished and returns its ``result_url``.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[task_url] = future
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        return await future
+
+    async def _poll(self):
+        interval = self.POLL_INTERVAL
+        while self._waiting:
+            await asyncio.sleep(interval)
+            task_urls = list(self._waiting)
+            responses = await asyncio.gather(*(self._request('GET', url) for url in task_urls),
+                                             return_exceptions=True)
+            finished = False
+            for task_url, resp in zip(task_urls, responses):
+                future = self._waiting[task_url]
+                if isinstance(resp, Exception):
+                    future.set_exception(resp)
+                elif resp.status_code != 200:
+                    future.set_exception(Exception(f"ERROR {resp.status_code}. {resp.text}"))
+                else:
+                    task = resp.json()
+                    self._report(task_url, task)
+                    if not task["finishtimestamp"]:
+                        continue
+                    if task["result_url"]:
+                        future.set_result(task["result_url"])
+                    else:
+                        future.set_exception(Exception(f"ERROR {task.get('error_msg', 'no result')}"))
+                del self._waiting[task_url]
+                finished = True
+            interval = self.POLL_INTERVAL if finished else min(interval * self.POLL_BACKOFF, self.MAX_POLL_INTERVAL)
+
+    def _report(self, task_url, task):
+        state = 'finished' if task["finishtimestamp"] else 'running' if task["starttimestamp"] else 'queued'
+        if self.on_progress and self._task_states.get(task_url) != state:
+            self.on_progress(task_url, task)
+        self._task_states[task_url] = state
+
+    async def get_result(self, result_url):
+        resp = await self._request('GET', result_url)
+        if resp.status_code != 200:
+            raise Exception(f"ERROR {resp.status_code}. {resp.text}")
+        return resp.text
+
+    async def query(self, ra, dec, mjd_min):
+        """
+        Runs one forced-photometry task from submission to download and returns the result text.
+        """
+        task_url = await self.submit(ra, dec, mjd_min)
+        logger.info('The task url is %s', task_url)
+        result_url = await self.wait_for_result_url(task_url)
+        logger.info('Task is complete with results available at %s', result_url)
+        return await self.get_result(result_url)
+
+    async def forced_photometry(self, positions, mjd_min):
+        """
+        Queries every position and yields ``(key, textdata, error)`` as soon as each result has been downloaded, so
+        the total time is about that of the slowest task rather than the sum of all of them. At most
+        ``max_in_flight`` tasks are on the server at once. ``error`` is None on success; a failing position does not
+        stop the others.
+
+        :param positions: iterable of ``(key, ra, dec)`` tuples, where ``key`` identifies the position to the caller
+        :type positions: iterable
+
+        :param mjd_min: earliest MJD to return, either one value for every position or a dict keyed like
+            ``positions``. None queries the whole light curve.
+        :type mjd_min: float or dict
+        """
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        results = asyncio.Queue()
+
+        async def run_one(key, ra, dec):
+            async with semaphore:
+                mjd = mjd_min.get(key) if isinstance(mjd_min, dict) else mjd_min
+                try:
+                    await results.put((key, await self.query(ra, dec, mjd), None))
+                except Exception as e:
+                    await results.put((key, None, e))
+
+        tasks = [asyncio.create_task(run_one(key, ra, dec)) for key, ra, dec in positions]
+        for _ in range(len(tasks)):
+            yield await results.get()
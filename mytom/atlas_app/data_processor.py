@@ -1,6 +1,7 @@
 import mimetypes
 
 from django.conf import settings
+from django.db.models import Max
 from importlib import import_module
 
 from tom_dataproducts.models import ReducedDatum
@@ -9,15 +10,137 @@ from tom_targets.models import Target
 from astropy import units
 from astropy.io import ascii
 from astropy.time import Time, TimezoneInfo
-from datetime import datetime
+from datetime import datetime, timezone
+from io import StringIO
 import numpy as np
 
 from tom_dataproducts.data_processor import DataProcessor
 from tom_dataproducts.exceptions import InvalidFileFormatException
 
+from mytom.ingestion import bulk_ingest, times_to_datetimes
+
 DEFAULT_DATA_PROCESSOR_CLASS = 'atlas_app.data_processor.MyDataProcessor'
 
+
+# dtypes of the columns of an ATLAS forced-photometry result, keyed by their header names
+ATLAS_COLUMN_DTYPES = {
+    'MJD': 'f8', 'm': 'f8', 'dm': 'f8', 'uJy': 'f8', 'duJy': 'f8', 'F': 'U1', 'err': 'i4', 'chi/N': 'f8',
+    'RA': 'f8', 'Dec': 'f8', 'x': 'f8', 'y': 'f8', 'maj': 'f8', 'min': 'f8', 'phi': 'f8', 'apfit': 'f8',
+    'mag5sig': 'f8', 'Sky': 'f8', 'Obs': 'U32',
+}
+
+
+def parse_atlas_result(textdata):
+    """
+    Parses the text returned by the ATLAS forced-photometry server into a NumPy structured array with one field per
+    column of the ``###MJD m dm uJy duJy F ...`` header, typed as in ``ATLAS_COLUMN_DTYPES``. Columns that are not
+    known there are read as strings. The rows are read by ``np.loadtxt`` in one call.
+
+    :param textdata: contents of the ATLAS ``result_url``
+    :type textdata: str
+
+    :returns: structured array, e.g. ``data['MJD']``, ``data['uJy']``, ``data['F']``
+    :rtype: numpy.ndarray
+    """
+    header, _, body = textdata.partition('\n')
+    names = header.lstrip('#').split()
+    dtype = np.dtype([(name, ATLAS_COLUMN_DTYPES.get(name, 'U32')) for name in names])
+
+    if not body.strip():
+        return np.empty(0, dtype=dtype)
+
+    return np.loadtxt(StringIO(body), dtype=dtype, comments='#', ndmin=1)
+
+
+def get_latest_mjd(target, source_name='ATLAS'):
+    """
+    Returns the MJD of the newest photometry ``ReducedDatum`` from ``source_name`` for the target, or None if there is
+    none. Incremental queries use it as ``mjd_min`` so only new epochs are downloaded.
+    """
+    latest = ReducedDatum.objects.filter(
+        target=target, data_type='photometry', source_name=source_name
+    ).aggregate(Max('timestamp'))['timestamp__max']
+    return Time(latest).mjd if latest else None
+
+
+def dedup_key(timestamp, filter):
+    """
+    Key that identifies an epoch of a target's photometry from one source: the timestamp, to the millisecond ATLAS
+    timestamps are stored with, and the filter.
+    """
+    return round(timestamp.timestamp(), 3), filter
+
+
+def get_stored_keys(target, source_name='ATLAS'):
+    """
+    Returns the ``dedup_key`` of every photometry ``ReducedDatum`` already stored for the target from ``source_name``.
+    """
+    stored = ReducedDatum.objects.filter(
+        target=target, data_type='photometry', source_name=source_name
+    ).values_list('timestamp', 'value__filter')
+    return {dedup_key(timestamp, filter) for timestamp, filter in stored}
+
+
+def flux_to_magnitudes(flux, flux_error, mag5sig, snr_limit=None):
+    """
+    Converts ATLAS fluxes in microJanskys to AB magnitudes. Epochs with a signal-to-noise ratio below ``snr_limit``
+    (including every zero or negative flux) are non-detections: their magnitude and error are NaN and their limit is
+    the 5-sigma limiting magnitude ``mag5sig``. Detections have a NaN limit.
+
+    :param snr_limit: Minimum ``flux / flux_error`` of a detection. Defaults to ``SNR_LIMIT`` in
+        ``settings.BROKERS['atlas']``, or 3.
+    :type snr_limit: float
+
+    :returns: magnitude, magnitude error and limit arrays
+    :rtype: tuple
+    """
+    if snr_limit is None:
+        snr_limit = settings.BROKERS['atlas'].get('SNR_LIMIT', 3.0)
+    flux = np.asarray(flux, dtype=float)
+    flux_error = np.asarray(flux_error, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        detected = (flux > 0) & (flux > snr_limit * flux_error)
+        magnitude = np.where(detected, 23.9 - 2.5 * np.log10(flux), np.nan)
+        magnitude_error = np.where(detected, (2.5 / np.log(10.0)) * flux_error / flux, np.nan)
+    limit = np.where(detected, np.nan, np.asarray(mag5sig, dtype=float))
+
+    return magnitude, magnitude_error, limit
+
+
+def atlas_photometry(data):
+    """
+    Turns the rows of a parsed ATLAS result (see ``parse_atlas_result``) into the timestamps and values of their
+    photometry ``ReducedDatum`` objects. Every value keeps the filter and the flux and flux error in microJanskys;
+    detections also get a magnitude and error computed from the flux, while non-detections get their ``mag5sig`` as
+    a ``limit`` (see ``flux_to_magnitudes``).
+
+    :returns: list of UTC datetimes and list of value dicts, one of each per row
+    :rtype: tuple
+    """
+    magnitude, magnitude_error, limit = flux_to_magnitudes(data['uJy'], data['duJy'], data['mag5sig'])
+    detected = ~np.isnan(magnitude)
+    timestamps = times_to_datetimes(data['MJD'], format='mjd')
+
+    values = []
+    for is_detection, mag, mag_error, filter, flux, flux_error, lim in zip(
+            detected.tolist(), magnitude.tolist(), magnitude_error.tolist(), data['F'].tolist(),
+            data['uJy'].tolist(), data['duJy'].tolist(), limit.tolist()):
+        if is_detection:
+            value = {'magnitude': mag, 'magnitude_error': mag_error}
+        else:   # non-detection, stored as an upper limit
+            value = {'limit': lim}
+        value.update({'filter': filter, 'flux': flux, 'flux_error': flux_error})
+        values.append(value)
+
+    return timestamps, values
+
+
 def run_data_processor(dp, target):
+    """
+    Stores the rows of a parsed ATLAS result (see ``parse_atlas_result``) as photometry ``ReducedDatum`` objects of
+    the target (see ``atlas_photometry``), skipping epochs that are already stored.
+    """
     try:
         processor_class = settings.DATA_PROCESSORS[dp.data_product_type]   # custom data processor is accepted
     except Exception:
@@ -33,21 +156,19 @@ def run_data_processor(dp, target):
 
     # use a try/except wrap around this entire section for true/false values for test_dataprocessor
     try:
-        reduced_datums = []
-
-        for item in dp[1:]:
-            t = Time(item[0], format='mjd', scale='utc')
-            mjd = {'timestamp': t.iso}
-            values = {'magnitude': item[1],
-                      'magnitude_error': item[2],
-                      'filter': item[3]}
-
-            datum = ReducedDatum(target = target, data_type = 'photometry',
-                                      timestamp = mjd['timestamp'], value = values, source_name='ATLAS')
-
-            reduced_datums.append(datum)
-
-        ReducedDatum.objects.bulk_create(reduced_datums)
+        stored = get_stored_keys(target)
+
+        new_timestamps = []
+        new_values = []
+        for timestamp, value in zip(*atlas_photometry(dp)):
+            key = dedup_key(timestamp, value['filter'])
+            if key in stored:   # epoch is already in the database (or repeated in this file)
+                continue
+            stored.add(key)
+            new_timestamps.append(timestamp)
+            new_values.append(value)
+
+        bulk_ingest(target, new_timestamps, new_values, source_name='ATLAS')
 
         return True
 
@@ -7,4 +7,11 @@ from crispy_forms.helper import FormHelper
 from crispy_forms.layout import ButtonHolder, Column, Layout, Row, Submit
 
 class QueryForm(forms.Form):
-	mjd = forms.FloatField(label='MJD')
\ No newline at end of file
+	mjd = forms.FloatField(label='MJD', required=False)
+	incremental = forms.BooleanField(label='Only query epochs newer than the stored ATLAS photometry', required=False)
+
+	def clean(self):
+		cleaned_data = super().clean()
+		if cleaned_data.get('mjd') is None and not cleaned_data.get('incremental'):
+			raise forms.ValidationError('Enter an MJD or choose to only query new epochs.')
+		return cleaned_data
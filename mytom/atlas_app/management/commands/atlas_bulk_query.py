@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tom_targets.models import Target, TargetList
+
+from atlas_app.tasks import bulk_forced_photometry
+
+
+class Command(BaseCommand):
+
+    help = 'Queries ATLAS forced photometry for every target in a TargetList, or for the given targets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-list', help='Name or id of the TargetList to query.')
+        parser.add_argument('--target-id', type=int, nargs='+', help='Ids of individual targets to query.')
+        parser.add_argument('--mjd-min', type=float, help='Earliest MJD to query.')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Query each target from its newest stored ATLAS epoch. Targets without ATLAS '
+                                 'photometry are queried from --mjd-min.')
+        parser.add_argument('--max-in-flight', type=int, default=10,
+                            help='Maximum number of tasks queued on the ATLAS server at once.')
+
+    def handle(self, *args, **options):
+        if options['target_list']:
+            name = options['target_list']
+            lists = TargetList.objects.filter(pk=name) if name.isdigit() else TargetList.objects.filter(name=name)
+            if not lists.exists():
+                raise CommandError(f'TargetList {name} does not exist')
+            targets = lists.first().targets.all()
+        elif options['target_id']:
+            targets = Target.objects.filter(pk__in=options['target_id'])
+        else:
+            raise CommandError('Either --target-list or --target-id is required')
+        if options['mjd_min'] is None and not options['incremental']:
+            raise CommandError('Either --mjd-min or --incremental is required')
+
+        ingested, failed = bulk_forced_photometry(targets, options['mjd_min'],
+                                                  max_in_flight=options['max_in_flight'],
+                                                  incremental=options['incremental'])
+
+        self.stdout.write(f'ATLAS photometry ingested for {len(ingested)} targets')
+        for name, error in failed.items():
+            self.stderr.write(f'{name}: {error}')
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+
+from tom_targets.models import TargetList
+
+from jobs_app.progress import publish_progress
+
+from .atlas_client import AtlasClient
+from .data_processor import get_latest_mjd, parse_atlas_result, run_data_processor
+from .views import main_func
+
+logger = logging.getLogger(__name__)
+
+
+def get_mjd_min(target, mjd, incremental):
+    """
+    Returns the ``mjd_min`` to query for the target. Incremental queries start from the newest stored ATLAS epoch,
+    falling back to ``mjd`` for targets without ATLAS photometry.
+    """
+    if incremental:
+        latest = get_latest_mjd(target)
+        if latest is not None:
+            return latest
+    return mjd
+
+
+def atlas_forced_photometry(job):
+    """
+    ``QueryJob`` task that runs the ATLAS forced-photometry query for ``job.target`` from the ``mjd`` parameter, or
+    from the newest stored epoch if ``incremental`` is set.
+    """
+    mjd = get_mjd_min(job.target, job.parameters.get('mjd'), job.parameters.get('incremental', False))
+
+    def report(task_url, task):
+        stage = 'Downloading and ingesting ATLAS photometry' if task['finishtimestamp'] else 'ATLAS task running'
+        publish_progress(job, stage=stage,
+                         atlas_queued=task['timestamp'], atlas_started=task['starttimestamp'],
+                         atlas_finished=task['finishtimestamp'])
+
+    publish_progress(job, stage='Queueing ATLAS task', mjd_min=mjd)
+    main_func(None, job.target, MJD=mjd, on_progress=report)
+    return f'ATLAS photometry ingested for {job.target.name}'
+
+
+def bulk_forced_photometry(targets, mjd_min, max_in_flight=10, incremental=False, on_progress=None):
+    """
+    Queries ATLAS forced photometry for many targets at once and ingests each light curve as soon as it arrives.
+
+    At most ``max_in_flight`` tasks are queued on the ATLAS server at a time, and a 429 throttling response pauses
+    every submission for the time the server asks for.
+
+    :param targets: ``Target`` objects (a list or a queryset) to query
+    :type targets: iterable
+
+    :param mjd_min: earliest MJD to query
+    :type mjd_min: float
+
+    :param incremental: query each target from its newest stored ATLAS epoch instead, see ``get_mjd_min``
+    :type incremental: bool
+
+    :param on_progress: called as ``on_progress(ingested, failed)`` after each target has been handled
+    :type on_progress: callable
+
+    :returns: the names of the targets that were ingested and a dict of target name to error for those that failed
+    :rtype: tuple
+    """
+    targets = {target.pk: target for target in targets}
+    mjd_min = {pk: get_mjd_min(target, mjd_min, incremental) for pk, target in targets.items()}
+    client = AtlasClient(max_in_flight=max_in_flight)
+    ingest = sync_to_async(run_data_processor)
+
+    async def query_all():
+        ingested, failed = [], {}
+        positions = [(pk, target.ra, target.dec) for pk, target in targets.items()]
+        async for pk, textdata, error in client.forced_photometry(positions, mjd_min):
+            target = targets[pk]
+            if error is None:
+                try:
+                    await ingest(parse_atlas_result(textdata), target)
+                except Exception as e:
+                    error = e
+            if error is None:
+                ingested.append(target.name)
+            else:
+                logger.warning('ATLAS query for %s failed: %s', target.name, error)
+                failed[target.name] = str(error)
+            if on_progress:
+                on_progress(ingested, failed)
+        return ingested, failed
+
+    return asyncio.run(query_all())
+
+
+def atlas_target_list_query(job):
+    """
+    ``QueryJob`` task that runs ``bulk_forced_photometry`` for every target in the ``target_list`` parameter.
+    """
+    target_list = TargetList.objects.get(pk=job.parameters['target_list'])
+    targets = list(target_list.targets.all())
+
+    def report(ingested, failed):
+        publish_progress(job, stage=f'{len(ingested) + len(failed)} of {len(targets)} targets done',
+                         ingested=len(ingested), failed=len(failed), total=len(targets))
+
+    publish_progress(job, stage='Queueing ATLAS tasks', ingested=0, failed=0, total=len(targets))
+    ingested, failed = bulk_forced_photometry(targets, job.parameters.get('mjd'),
+                                              max_in_flight=job.parameters.get('max_in_flight', 10),
+                                              incremental=job.parameters.get('incremental', False),
+                                              on_progress=report)
+    message = f'ATLAS photometry ingested for {len(ingested)} of {len(ingested) + len(failed)} targets'
+    if failed:
+        message += '\n' + '\n'.join(f'{name}: {error}' for name, error in failed.items())
+    return message
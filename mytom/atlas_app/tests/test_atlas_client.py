@@ -0,0 +1,111 @@
+import asyncio
+import os
+import threading
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from atlas_app.atlas_client import AtlasClient, get_token, get_wait_time
+
+
+class FakeResponse:
+    def __init__(self, status_code, json=None, text=''):
+        self.status_code = status_code
+        self._json = json
+        self.text = text
+
+    def json(self):
+        return self._json
+
+
+class FakeAtlasSession:
+    """
+    Stands in for ``requests.Session``: every task finishes after ``polls_to_finish`` polls and the first queue request
+    is throttled.
+    """
+
+    def __init__(self, polls_to_finish=2):
+        self.polls_to_finish = polls_to_finish
+        self.polls = {}
+        self.queued = 0
+        self.throttled = False
+        self.lock = threading.Lock()
+        self.logins = 0
+
+    def post(self, url, data=None):
+        self.logins += 1
+        return FakeResponse(200, {'token': f'token{self.logins}'})
+
+    def request(self, method, url, headers=None, data=None):
+        with self.lock:
+            if headers['Authorization'] == 'Token expired':
+                return FakeResponse(401, {'detail': 'Invalid token.'})
+            if url.endswith('/queue/'):
+                if not self.throttled:
+                    self.throttled = True
+                    return FakeResponse(429, {'detail': 'Request was throttled. Expected available in 0 seconds.'})
+                self.queued += 1
+                return FakeResponse(201, {'url': f"https://atlas/queue/{data['ra']}/"})
+            if url.startswith('https://atlas/queue/'):
+                self.polls[url] = self.polls.get(url, 0) + 1
+                finished = self.polls[url] >= self.polls_to_finish
+                return FakeResponse(200, {'finishtimestamp': 'now' if finished else None,
+                                          'starttimestamp': 'earlier',
+                                          'timestamp': 'earlier',
+                                          'result_url': url.replace('queue', 'result') if finished else None})
+            return FakeResponse(200, text=f'result for {url}')
+
+
+class TestAtlasClient(SimpleTestCase):
+    def setUp(self):
+        self.session = FakeAtlasSession()
+        self.client = AtlasClient('token', base_url='https://atlas', max_in_flight=3, session=self.session)
+        self.client.POLL_INTERVAL = 0.01
+
+    def test_get_wait_time(self):
+        self.assertEqual(get_wait_time('Expected available in 12 seconds.'), 12)
+        self.assertEqual(get_wait_time('Expected available in 2 minutes.'), 120)
+        self.assertEqual(get_wait_time('Try later.'), 10)
+
+    def test_forced_photometry_returns_every_position(self):
+        positions = [(i, float(i), 10.0) for i in range(7)]
+
+        async def collect():
+            return [result async for result in self.client.forced_photometry(positions, 59000)]
+
+        results = asyncio.run(collect())
+
+        self.assertEqual(sorted(key for key, _, _ in results), list(range(7)))
+        self.assertTrue(all(error is None for _, _, error in results))
+        self.assertEqual(self.session.queued, 7)
+        self.assertIn('result', results[0][1])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestAtlasToken(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = FakeAtlasSession()
+        patcher = patch('atlas_app.atlas_client.get_session', return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        environ = patch.dict(os.environ)
+        environ.start()
+        os.environ.pop('ATLASFORCED_SECRET_KEY', None)
+        self.addCleanup(environ.stop)
+
+    def test_token_is_cached(self):
+        self.assertEqual(get_token('https://atlas'), 'token1')
+        self.assertEqual(get_token('https://atlas'), 'token1')
+        self.assertEqual(self.session.logins, 1)
+
+    def test_expired_token_is_refreshed(self):
+        client = AtlasClient('expired', base_url='https://atlas', session=self.session)
+        client.POLL_INTERVAL = 0.01
+
+        result = asyncio.run(client.query(1.0, 2.0, 59000))
+
+        self.assertIn('result', result)
+        self.assertEqual(client.token, 'token1')
+        self.assertEqual(cache.get('atlas_app.api_token'), 'token1')
@@ -1,62 +1,32 @@
-import os
-from http import HTTPStatus
-import tempfile
+import random
 
-from astropy import units
-from astropy.io import fits
-from astropy.table import Table
-from datetime import date, time
+from django.test import TestCase
 
-from django.test import TestCase, override_settings
-from django.conf import settings
-from django.contrib.auth.models import Group, User
-from django.core.files.uploadedfile import SimpleUploadedFile
-from django.urls import reverse
-
-from guardian.shortcuts import assign_perm
-
-import numpy as np
 from faker import Faker
 
-from specutils import Spectrum1D
-
-from unittest.mock import patch
+from tom_dataproducts.models import ReducedDatum
+from tom_observations.tests.factories import SiderealTargetFactory
 
-from tom_dataproducts.exceptions import InvalidFileFormatException
-from tom_dataproducts.forms import DataProductUploadForm
-from tom_dataproducts.models import DataProduct, is_fits_image_file
-from tom_dataproducts.processors.data_serializers import SpectrumSerializer
-from tom_dataproducts.processors.photometry_processor import PhotometryProcessor
-from tom_dataproducts.processors.spectroscopy_processor import SpectroscopyProcessor
-from tom_dataproducts.utils import create_image_dataproduct
-from tom_observations.tests.utils import FakeRoboticFacility
-from tom_targets.models import Target
-from tom_observations.tests.factories import SiderealTargetFactory, ObservingRecordFactory
-
-from atlas_app.data_processor import run_data_processor
+from atlas_app.data_processor import parse_atlas_result, run_data_processor
 
+ATLAS_HEADER = '###MJD m dm uJy duJy F err chi/N RA Dec x y maj min phi apfit mag5sig Sky Obs'
 
 
 class TestDataProcessor(TestCase):
     def setUp(self):
         fake = Faker()
 
-        self.fake_data = []
-
-        self.fake_data.append(['MJD', 'm', 'dm', 'F'])
-
-        # setting up a fake list of list of MJD, mag, mag_err, and filter_codes
-        for i in range(len(rand.int(500,1000))):
-
-            mjd = str(fake.pyfloat(min_value = 56000, max_value = 59000))
-            mag = fake.pyfloat(min_value = 0, max_value = 25)
-            mag_err = fake.pyfloat(min_value = 0, max_value = 10)
-
-            filter_ltr = ['c', 'o']
-            filter = filter_ltr[random.randint(0,1)]
-
-            self.fake_data.append([mjd, mag, mag_err, filter])
-
+        # setting up a fake ATLAS result of MJD, mag, mag_err, flux, flux_err and filter code rows
+        self.rows = random.randint(500, 1000)
+        lines = [ATLAS_HEADER]
+        for i in range(self.rows):
+            mjd = 56000 + i + fake.pyfloat(min_value=0, max_value=0.9)
+            flux = fake.pyint(min_value=-50, max_value=500)
+            flux_err = fake.pyint(min_value=5, max_value=20)
+            filter = random.choice(['c', 'o'])
+            lines.append(f'{mjd:.6f} 18.000 0.100 {flux} {flux_err} {filter} 0 1.00 44.00000 22.00000 100.00 100.00 '
+                         f'2.50 2.30 -50.0 -0.400 19.50 21.20 02a59251o0135c')
+        self.fake_data = parse_atlas_result('\n'.join(lines))
 
         self.target = SiderealTargetFactory.create()
 
@@ -65,11 +35,11 @@ class TestDataProcessor(TestCase):
 
         message = 'Data processor test was a success!'
 
-        self.assertEqual(firstval,True,message)   # check if first val returned a data frame (i.e. True)
-
-    #def test_dataprocessor_fail(self):
-    #   firstval = run_data_processor(self.fake_data, self.target)
+        self.assertEqual(firstval, True, message)
+        self.assertEqual(ReducedDatum.objects.filter(target=self.target, source_name='ATLAS').count(), self.rows)
 
-    #    message = 'Data processor test was not sucessful.'
+    def test_dataprocessor_skips_stored_epochs(self):
+        run_data_processor(self.fake_data, self.target)
+        run_data_processor(self.fake_data, self.target)
 
-    #    self.assertEqual(firstval, False, message)
+        self.assertEqual(ReducedDatum.objects.filter(target=self.target, source_name='ATLAS').count(), self.rows)
@@ -0,0 +1,60 @@
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+from django.test import SimpleTestCase
+
+from atlas_app.data_processor import flux_to_magnitudes, parse_atlas_result
+from mytom.ingestion import times_to_datetimes
+
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sample_atlas_data.txt')
+
+
+class TestParseAtlasResult(SimpleTestCase):
+    def setUp(self):
+        with open(SAMPLE_DATA) as f:
+            self.textdata = f.read()
+
+    def test_all_columns_are_typed(self):
+        data = parse_atlas_result(self.textdata)
+
+        self.assertEqual(len(data), 887)
+        self.assertEqual(data.dtype.names[:6], ('MJD', 'm', 'dm', 'uJy', 'duJy', 'F'))
+        self.assertIn('mag5sig', data.dtype.names)
+        self.assertAlmostEqual(data['MJD'][1], 59251.308849)
+        self.assertAlmostEqual(data['m'][1], -21.809)
+        self.assertEqual(data['uJy'][1], -7)
+        self.assertEqual(data['F'][1], 'c')
+        self.assertEqual(data['Obs'][1], '02a59251o0143c')
+
+    def test_header_only_result(self):
+        data = parse_atlas_result(self.textdata.splitlines(keepends=True)[0])
+
+        self.assertEqual(len(data), 0)
+        self.assertIn('uJy', data.dtype.names)
+
+
+class TestFluxToMagnitudes(SimpleTestCase):
+    def test_non_detections_become_limits(self):
+        flux = np.array([3631.0, -7.0, 13.0, 2.0])
+        flux_error = np.array([10.0, 10.0, 10.0, 12.0])
+        mag5sig = np.array([19.5, 19.54, 19.51, 19.50])
+
+        magnitude, magnitude_error, limit = flux_to_magnitudes(flux, flux_error, mag5sig, snr_limit=3)
+
+        self.assertAlmostEqual(magnitude[0], 15.0, places=3)
+        self.assertAlmostEqual(magnitude_error[0], 2.5 / np.log(10) * 10 / 3631)
+        self.assertTrue(np.isnan(limit[0]))
+        np.testing.assert_array_equal(np.isnan(magnitude), [False, True, True, True])
+        np.testing.assert_array_equal(limit[1:], mag5sig[1:])
+
+
+class TestTimesToDatetimes(SimpleTestCase):
+    def test_mjds_are_converted_in_order(self):
+        timestamps = times_to_datetimes(np.array([59000.0, 59000.5]), format='mjd')
+
+        self.assertEqual(timestamps, [datetime(2020, 5, 31, tzinfo=timezone.utc),
+                                      datetime(2020, 5, 31, 12, tzinfo=timezone.utc)])
+        self.assertEqual(times_to_datetimes(np.array([2459000.5]), format='jd'), timestamps[:1])
+        self.assertEqual(times_to_datetimes([]), [])
@@ -0,0 +1,66 @@
+import os
+from unittest.mock import patch
+
+from django.test import TransactionTestCase
+
+from tom_dataproducts.models import ReducedDatum
+from tom_observations.tests.factories import SiderealTargetFactory
+
+from atlas_app.atlas_client import AtlasClient
+from atlas_app.data_processor import get_latest_mjd
+from atlas_app.tasks import bulk_forced_photometry
+from atlas_app.tests.test_atlas_client import FakeAtlasSession, FakeResponse
+
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sample_atlas_data.txt')
+
+
+class SampleResultSession(FakeAtlasSession):
+    """
+    Serves the ATLAS sample light curve as the result of every task.
+    """
+
+    def request(self, method, url, headers=None, data=None):
+        if url.endswith('/queue/'):
+            self.queued_mjd_min = data['mjd_min']
+        if 'result' in url:
+            with open(SAMPLE_DATA) as f:
+                return FakeResponse(200, text=''.join(f.readlines()[:11]))
+        return super().request(method, url, headers=headers, data=data)
+
+
+class TestBulkForcedPhotometry(TransactionTestCase):
+    def setUp(self):
+        self.targets = [SiderealTargetFactory.create(ra=10.0 + i) for i in range(3)]
+
+    def fake_client(self, max_in_flight=10):
+        self.session = SampleResultSession(polls_to_finish=1)
+        client = AtlasClient('token', base_url='https://atlas', max_in_flight=max_in_flight, session=self.session)
+        client.POLL_INTERVAL = 0.01
+        return client
+
+    def query(self, targets, incremental=False):
+        with patch('atlas_app.tasks.AtlasClient', side_effect=self.fake_client):
+            return bulk_forced_photometry(targets, 59000, max_in_flight=2, incremental=incremental)
+
+    def test_every_target_is_ingested(self):
+        ingested, failed = self.query(self.targets)
+
+        self.assertEqual(sorted(ingested), sorted(target.name for target in self.targets))
+        self.assertEqual(failed, {})
+        for target in self.targets:
+            self.assertEqual(ReducedDatum.objects.filter(target=target, source_name='ATLAS').count(), 10)
+
+        negative_flux = ReducedDatum.objects.get(target=self.targets[0], value__flux=-7)
+        self.assertEqual(negative_flux.value['limit'], 19.54)
+        self.assertNotIn('magnitude', negative_flux.value)
+
+    def test_incremental_query_skips_stored_epochs(self):
+        target = self.targets[0]
+        self.query([target])
+        self.assertEqual(self.session.queued_mjd_min, 59000)
+
+        self.query([target], incremental=True)
+
+        self.assertAlmostEqual(self.session.queued_mjd_min, get_latest_mjd(target), places=6)
+        self.assertAlmostEqual(get_latest_mjd(target), 59255.236905, places=6)
+        self.assertEqual(ReducedDatum.objects.filter(target=target, source_name='ATLAS').count(), 10)
@@ -8,5 +8,6 @@ app_name = 'atlas_app'
 
 urlpatterns = [
 	path("<int:pk>/query/",views.QueryView.as_view(),name='query'),
+	path("targetlist/<int:pk>/query/",views.TargetListQueryView.as_view(),name='targetlist-query'),
 	path('<int:pk>/', views.TargetDetailView.as_view(),name='detail'),
 ]
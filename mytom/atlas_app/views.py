@@ -1,7 +1,10 @@
 # PREAMBLE with necessary libraries
 
+import asyncio
 import io
+import logging
 import os
+import re
 import subprocess
 import time
 import csv
@@ -13,6 +16,7 @@ from django.shortcuts import render,redirect
 from django.http import HttpResponse, HttpResponseRedirect
 
 from django.forms import HiddenInput
+from django.contrib import messages
 from django.template import loader
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.conf import settings
@@ -32,9 +36,14 @@ from guardian.mixins import PermissionRequiredMixin
 from tom_targets.models import Target, TargetList
 from tom_common.mixins import Raise403PermissionRequiredMixin
 
+from jobs_app.jobs import enqueue
+
 from .models import QueryModel
 from .forms import QueryForm
-from .data_processor import run_data_processor
+from .data_processor import parse_atlas_result, run_data_processor
+from .atlas_client import AtlasClient
+
+logger = logging.getLogger(__name__)
 
 # Create your views here.
 
@@ -99,119 +108,54 @@ class QueryView(View):
 		target = Target.objects.get(pk=pk)
 
 		if form.is_valid():
-			print(form.cleaned_data['mjd'])
-			main_func(self, target , MJD=form.cleaned_data['mjd'])
+			# the query itself runs in the `runqueryjobs` worker so this request returns straight away
+			job = enqueue('atlas_app.tasks.atlas_forced_photometry', target=target, user=request.user,
+						  mjd=form.cleaned_data['mjd'], incremental=form.cleaned_data['incremental'])
+			messages.info(request, f"ATLAS query for {target.name} was queued as job {job.pk}. "
+								   f"The photometry will appear once the job has finished.")
 			return HttpResponseRedirect(reverse('tom_targets:detail',args=[pk]))
-		else:
-			form = QueryForm()
 
-		return render('query.html', {
+		return render(request, 'query.html', {
+			'target': target,
 			'form': form,
 		})
 
-def main_func(self, target, MJD):
-
-	print('This is the RA:', target.ra)
-	print('This is the Dec:', target.dec)
-
-	BASEURL = settings.BROKERS['atlas']['BASEURL']
-
-	print(BASEURL)
-
-	if os.environ.get("ATLASFORCED_SECRET_KEY"):
-		token = os.environ.get("ATLASFORCED_SECRET_KEY")
-		print("Using stored token")
-
-	else:
-		data = {"username": settings.BROKERS['atlas']['USER'],
-				"password": settings.BROKERS['atlas']['PASS']}
-
-		resp = requests.post(url=f"{BASEURL}/api-token-auth/", data=data)
-		print('this is the resp code: ', resp.status_code)
-
-		if resp.status_code == 200:
-			token = resp.json()["token"]
-			print(f"Your token is {token}")
-			print("Store this by running/adding to your .zshrc file:")
-			print(f'export ATLASFORCED_SECRET_KEY="{token}"')
-		else:
-			raise Exception(f"ERROR {resp.status_code}. {resp.text}") #################
-			#sys.exit()   #send error messag to test-dataprocessor
-
-	headers = {"Authorization": f"Token {token}", "Accept": "application/json"}
-
-	task_url = None
-	while not task_url:
-		with requests.Session() as s:
-			resp = s.post(
-				f"{BASEURL}/queue/", headers=headers,
-				data={"ra":target.ra, "dec": target.dec, "mjd_min": MJD, "send_email": False})
-
-			if resp.status_code == 201:
-				task_url = resp.json()["url"]
-				print(f"The task url is {task_url}")
-			elif resp.status_code == 429:
-				message = resp.json()["detail"]
-				print(f"{resp.status_code} {message}")
-				t_sec = re.findall(r"available in (\d+) seconds", message)
-				t_min = re.findall(r"available in (\d+) minutes", message)
-				if t_sec:
-					waittime = int(t_sec[0])
-				elif t_min:
-					waittime = int(t_min[0]) * 60
-				else:
-					waittime = 10
-				print(f"Waiting {waittime} seconds")
-				time.sleep(waittime)
-			else:
-				raise Exception(f"ERROR {resp.status_code}. {resp.text}")   ##############
-				#sys.exit()
-
-	result_url = None
-	taskstarted_printed = False
-	while not result_url:
-		with requests.Session() as s:
-			resp = s.get(task_url, headers=headers)
-
-			if resp.status_code == 200:
-				if resp.json()["finishtimestamp"]:
-					result_url = resp.json()["result_url"]  # PART WHEN QUERY IS COMPLETE
-					print(f"Task is complete with results available at {result_url}")
-				elif resp.json()["starttimestamp"]:
-					if not taskstarted_printed:
-						print(f"Task is running (started at {resp.json()['starttimestamp']})")
-						taskstarted_printed = True
-					time.sleep(2)
-				else:
-					print(f"Waiting for job to start (queued at {resp.json()['timestamp']})")
-					time.sleep(4)
-			else:
-				raise Exception(f"ERROR {resp.status_code}. {resp.text}") ###################
-				#sys.exit()
-
-	with requests.Session() as s:
-		textdata = s.get(result_url, headers=headers).text
-
-	file = StringIO(textdata)   # this is KEY for it 'textdata' to be read as a file
-
-	data = []
-
-	for index, line in enumerate(file):
-		entries = line.replace("\n", "").split()
-
-		line_data = []
-
-		for idx, x in enumerate(entries):
-			if index == 0:  # only for the first line of file (i.e. headers)
-				if idx == 0:
-					x = x.replace("###", "")
-				if idx == 0 or idx == 1 or idx == 2 or idx == 5:   # calls for only MJD, m, dm, F headers
-					line_data.append(str(x))
-			elif idx == 0 or idx == 5:
-				line_data.append(str(x))   # mjd & filter code = str
-			elif idx == 1 or idx == 2:
-				line_data.append(float(x))   # m & dm = float
-		data.append(line_data)
+class TargetListQueryView(View):
+
+	def get(self, request, pk, *args, **kwargs):
+		target_list = get_object_or_404(TargetList, pk=pk)
+		context = {
+			'target_list': target_list,
+			'form': QueryForm,
+		}
+		return render(request, 'targetlist_query.html', context)
+
+	def post(self, request, pk, *args, **kwargs):
+
+		form = QueryForm(request.POST)
+		target_list = get_object_or_404(TargetList, pk=pk)
+
+		if form.is_valid():
+			job = enqueue('atlas_app.tasks.atlas_target_list_query', user=request.user,
+						  target_list=target_list.pk, mjd=form.cleaned_data['mjd'],
+						  incremental=form.cleaned_data['incremental'])
+			messages.info(request, f"ATLAS query for the {target_list.targets.count()} targets in {target_list.name} "
+								   f"was queued as job {job.pk}.")
+			return HttpResponseRedirect(reverse('tom_targets:targetgrouping'))
+
+		return render(request, 'targetlist_query.html', {
+			'target_list': target_list,
+			'form': form,
+		})
+
+def main_func(self, target, MJD, on_progress=None):
+
+	logger.debug('Querying ATLAS forced photometry at RA %s, Dec %s', target.ra, target.dec)
+
+	client = AtlasClient(max_in_flight=1, on_progress=on_progress)   # on_progress gets the ATLAS task status
+	textdata = asyncio.run(client.query(target.ra, target.dec, MJD))
+
+	data = parse_atlas_result(textdata)
 
 	run_data_processor(data, target)   # custom data processor for ATLAS photometry
 
@@ -0,0 +1,11 @@
+"""
+Benchmarks of the TOM's survey ingestion. Importing the package sets up Django with the project settings.
+"""
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mytom.settings')
+for variable in ('ATLAS_USER', 'ATLAS_PWD', 'ZTF_USER', 'ZTF_PWD'):   # no survey is queried
+    os.environ.setdefault(variable, '')
+django.setup()
@@ -0,0 +1,160 @@
+"""
+Ingestion benchmarks for the ATLAS, ZTF and PanSTARRS data processors.
+
+Run from the directory holding ``manage.py``::
+
+    python -m benchmarks.ingestion --sizes 1000 10000 --output ingestion.json
+
+For every survey and size, synthetic data is generated (see ``benchmarks.synthetic``) and the parse, transform and
+``bulk_create`` stages of the survey's processor are timed separately. Rows are stored in a throwaway test database,
+never in ``db.sqlite3``. The timings are printed and written to ``--output`` as JSON, so runs can be compared to catch
+throughput regressions.
+
+Reading the stamp around the target of a PanSTARRS cutout takes several milliseconds, so the PanSTARRS benchmark at a
+million rows runs for hours; leave it out with ``--surveys atlas ztf`` for quick runs.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+
+import astropy
+import django
+import numpy as np
+from astropy.io import fits
+from django.db import connection
+
+from tom_targets.models import Target
+
+from atlas_app.data_processor import atlas_photometry, parse_atlas_result
+from mytom.ingestion import bulk_ingest, chunked
+from panSTARRS_app.panstarrs_data_processor import (PHOTOMETRY_BATCH_SIZE, celestial_wcs, cutout_stamp,
+                                                     measure_stamps)
+from ztf_app.ztf_data_processor import parse_ztf_result, ztf_photometry
+
+from . import synthetic
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+# the cutouts are large enough for the default sky annulus of the PanSTARRS photometry
+CUTOUT_SIZE = 96
+CUTOUT_APERTURE = 2.0
+CUTOUT_ANNULUS = (5.0, 8.0)
+
+
+def atlas_stages(rows):
+    text = synthetic.atlas_text(rows)
+    return {
+        'parse': lambda: parse_atlas_result(text),
+        'transform': atlas_photometry,
+        'bulk_create': lambda target, photometry: bulk_ingest(target, *photometry, source_name='ATLAS'),
+    }
+
+
+def ztf_stages(rows):
+    text = synthetic.ztf_text(rows)
+    return {
+        'parse': lambda: parse_ztf_result(text),
+        'transform': ztf_photometry,
+        'bulk_create': lambda target, photometry: bulk_ingest(target, *photometry, source_name='ZTF'),
+    }
+
+
+def read_cutout_stamps(cutouts, ra, dec):
+    stamps = []
+    for cutout in cutouts:
+        with fits.open(BytesIO(cutout)) as hdul:
+            stamps.append(cutout_stamp(hdul[0], ra, dec, CUTOUT_ANNULUS[1]))
+    return stamps
+
+
+def stamp_photometry(stamps):
+    # measured in the batches the processor uses, which bound the memory of the stacked stamps
+    measured = [(timestamp, value) for batch in chunked(stamps, PHOTOMETRY_BATCH_SIZE) for timestamp, value in
+                measure_stamps(batch, CUTOUT_APERTURE, CUTOUT_ANNULUS, snr_limit=3) if value is not None]
+    return [timestamp for timestamp, _ in measured], [value for _, value in measured]
+
+
+def panstarrs_stages(rows):
+    # every row is one cutout; they share their bytes, which does not change the cost of reading them
+    cutout = synthetic.panstarrs_cutout(size=CUTOUT_SIZE)
+    # the source is at the centre of the cutout
+    with fits.open(BytesIO(cutout)) as hdul:
+        ra, dec = celestial_wcs(hdul[0].header).all_pix2world(CUTOUT_SIZE / 2, CUTOUT_SIZE / 2, 0)
+    return {
+        'parse': lambda: read_cutout_stamps([cutout] * rows, ra, dec),
+        'transform': stamp_photometry,
+        'bulk_create': lambda target, photometry: bulk_ingest(target, *photometry, source_name='PanSTARRS'),
+    }
+
+
+SURVEYS = {
+    'atlas': atlas_stages,
+    'ztf': ztf_stages,
+    'panstarrs': panstarrs_stages,
+}
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run_benchmark(survey, rows):
+    """
+    Times the stages of one survey's ingestion of ``rows`` synthetic rows into a new target.
+
+    :returns: one result dict per stage, with the stage's wall-clock ``seconds`` and ``rows_per_second``
+    :rtype: list
+    """
+    stages = SURVEYS[survey](rows)
+    target = Target.objects.create(name=f'benchmark-{survey}-{rows}', type=Target.SIDEREAL, ra=44.0, dec=22.0)
+
+    results = []
+    data, seconds = timed(stages['parse'])
+    results.append(('parse', seconds))
+    if stages['transform'] is not None:
+        data, seconds = timed(stages['transform'], data)
+        results.append(('transform', seconds))
+    _, seconds = timed(stages['bulk_create'], target, data)
+    results.append(('bulk_create', seconds))
+
+    return [{'survey': survey, 'rows': rows, 'stage': stage, 'seconds': round(seconds, 6),
+             'rows_per_second': round(rows / seconds, 1) if seconds else None} for stage, seconds in results]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--surveys', nargs='+', choices=list(SURVEYS), default=list(SURVEYS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES, help='Rows per benchmark')
+    parser.add_argument('--output', default='ingestion_benchmark.json', help='JSON file the results are written to')
+    options = parser.parse_args(argv)
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    results = []
+    try:
+        for survey in options.surveys:
+            for rows in options.sizes:
+                for result in run_benchmark(survey, rows):
+                    print('{survey:>10} {rows:>8} {stage:>12} {seconds:>10.3f} s {rows_per_second:>12} rows/s'
+                          .format(**result))
+                    results.append(result)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    with open(options.output, 'w') as f:
+        json.dump({
+            'created': datetime.now(timezone.utc).isoformat(),
+            'environment': {'python': platform.python_version(), 'django': django.get_version(),
+                            'numpy': np.__version__, 'astropy': astropy.__version__,
+                            'database': connection.vendor},
+            'results': results,
+        }, f, indent=2)
+    print(f'Results written to {options.output}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+Regression benchmark for the scaling of the survey photometry build step.
+
+Run from the directory holding ``manage.py``::
+
+    python -m benchmarks.scaling --surveys ztf --sizes 2500 5000 10000 20000
+
+Times the transform stage of ``benchmarks.ingestion`` (parsed rows to ``ReducedDatum`` timestamps and values) at each
+size and fits the exponent ``k`` of ``seconds ~ rows ** k``. The build step must be linear in the number of epochs, so
+the run exits with status 1 if ``k`` exceeds ``--max-exponent`` for any survey. A quadratic loop gives ``k`` near 2.
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from .ingestion import SURVEYS
+
+DEFAULT_SIZES = [2500, 5000, 10000, 20000]
+
+
+def scaling_exponent(sizes, seconds):
+    """
+    Returns the slope of ``log(seconds)`` against ``log(sizes)``, i.e. ``k`` in ``seconds ~ sizes ** k``.
+    """
+    return float(np.polyfit(np.log(sizes), np.log(seconds), 1)[0])
+
+
+def time_transform(survey, rows, repeats):
+    stages = SURVEYS[survey](rows)
+    data = stages['parse']()
+    best = float('inf')
+    for _ in range(repeats):   # the fastest run is the least disturbed by the rest of the machine
+        start = time.perf_counter()
+        stages['transform'](data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--surveys', nargs='+', choices=list(SURVEYS), default=['atlas', 'ztf'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES, help='Epochs per run')
+    parser.add_argument('--repeats', type=int, default=3, help='Runs per size; the fastest is kept')
+    parser.add_argument('--max-exponent', type=float, default=1.2, help='Largest accepted scaling exponent')
+    parser.add_argument('--output', default='scaling_benchmark.json', help='JSON file the results are written to')
+    options = parser.parse_args(argv)
+
+    results = []
+    for survey in options.surveys:
+        seconds = [time_transform(survey, rows, options.repeats) for rows in options.sizes]
+        exponent = scaling_exponent(options.sizes, seconds)
+        results.append({'survey': survey, 'sizes': options.sizes, 'seconds': [round(s, 6) for s in seconds],
+                        'exponent': round(exponent, 3), 'linear': exponent <= options.max_exponent})
+        print('{:>10}  {}  exponent {:.2f}'.format(
+            survey, '  '.join(f'{rows}: {s:.3f} s' for rows, s in zip(options.sizes, seconds)), exponent))
+
+    with open(options.output, 'w') as f:
+        json.dump({'max_exponent': options.max_exponent, 'results': results}, f, indent=2)
+
+    failed = [result['survey'] for result in results if not result['linear']]
+    if failed:
+        print('Photometry build scales worse than linearly for: {}'.format(', '.join(failed)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
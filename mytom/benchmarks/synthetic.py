@@ -0,0 +1,147 @@
+"""
+Synthetic survey data for the ingestion benchmarks, laid out like the real ATLAS, ZTF and PanSTARRS products.
+"""
+import os
+from io import BytesIO, StringIO
+
+import numpy as np
+from astropy.io import fits
+from django.conf import settings
+
+ZTF_SAMPLE = os.path.join(settings.BASE_DIR, 'data', 'BD+222716b', 'none', 'sample_ztf_data.txt')
+PANSTARRS_SAMPLE = os.path.join(settings.BASE_DIR, 'data', 'Target', 'none', 't360.000089.4000.r.fits')
+
+ATLAS_HEADER = '###MJD m dm uJy duJy F err chi/N RA Dec x y maj min phi apfit mag5sig Sky Obs'
+
+# (name, dtype, format) of every column of a ZTF forced-photometry file, in file order
+ZTF_COLUMNS = [
+    ('index', 'i8', ' %d'), ('field', 'i8', '%d'), ('ccdid', 'i8', '%d'), ('qid', 'i8', '%d'),
+    ('filter', 'U5', '%s'), ('pid', 'i8', '%d'), ('infobitssci', 'i8', '%d'), ('sciinpseeing', 'f8', '%.4f'),
+    ('scibckgnd', 'f8', '%.3f'), ('scisigpix', 'f8', '%.4f'), ('zpmaginpsci', 'f8', '%.4f'),
+    ('zpmaginpsciunc', 'f8', '%.6g'), ('zpmaginpscirms', 'f8', '%.6g'), ('clrcoeff', 'f8', '%.6g'),
+    ('clrcoeffunc', 'f8', '%.6g'), ('ncalmatches', 'i8', '%d'), ('exptime', 'f8', '%.0f.'),
+    ('adpctdif1', 'f8', '%.6g'), ('adpctdif2', 'f8', '%.6g'), ('diffmaglim', 'f8', '%.4f'), ('zpdiff', 'f8', '%.4f'),
+    ('programid', 'i8', '%d'), ('jd', 'f8', '%.7f'), ('rfid', 'i8', '%d'), ('forcediffimflux', 'f8', '%.15g'),
+    ('forcediffimfluxunc', 'f8', '%.15g'), ('forcediffimsnr', 'f8', '%.15g'), ('forcediffimchisq', 'f8', '%.15g'),
+    ('forcediffimfluxap', 'f8', '%.15g'), ('forcediffimfluxuncap', 'f8', '%.15g'), ('forcediffimsnrap', 'f8', '%.15g'),
+    ('aperturecorr', 'f8', '%.15g'), ('dnearestrefsrc', 'f8', '%.15g'), ('nearestrefmag', 'f8', '%.15g'),
+    ('nearestrefmagunc', 'f8', '%.15g'), ('nearestrefchi', 'f8', '%.15g'), ('nearestrefsharp', 'f8', '%.15g'),
+    ('refjdstart', 'f8', '%.6f'), ('refjdend', 'f8', '%.6f'), ('procstatus', 'i8', '%d'),
+]
+
+
+def atlas_text(rows, seed=0):
+    """
+    Returns the text of an ATLAS forced-photometry result with ``rows`` epochs, in the format of ``result_url``.
+    About a third of the epochs have a signal-to-noise ratio below 3.
+    """
+    rng = np.random.default_rng(seed)
+    flux_error = rng.integers(5, 50, rows)
+    flux = (flux_error * rng.normal(5, 4, rows)).astype(int)
+    data = np.empty(rows, dtype=[('MJD', 'f8'), ('m', 'f8'), ('dm', 'f8'), ('uJy', 'i8'), ('duJy', 'i8'),
+                                 ('F', 'U1'), ('err', 'i8'), ('chi/N', 'f8'), ('RA', 'f8'), ('Dec', 'f8'),
+                                 ('x', 'f8'), ('y', 'f8'), ('maj', 'f8'), ('min', 'f8'), ('phi', 'f8'),
+                                 ('apfit', 'f8'), ('mag5sig', 'f8'), ('Sky', 'f8'), ('Obs', 'U14')])
+    data['MJD'] = np.sort(rng.uniform(57200, 60200, rows))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        data['m'] = np.where(flux > 0, 23.9 - 2.5 * np.log10(np.abs(flux)), -(23.9 - 2.5 * np.log10(np.abs(flux) + 1)))
+    data['dm'] = np.abs(1.0857 * flux_error / np.maximum(np.abs(flux), 1))
+    data['uJy'] = flux
+    data['duJy'] = flux_error
+    data['F'] = rng.choice(['c', 'o'], rows)
+    data['err'] = 0
+    data['chi/N'] = rng.uniform(0.5, 3, rows)
+    data['RA'] = 44.0
+    data['Dec'] = 22.0
+    data['x'] = rng.uniform(0, 10560, rows)
+    data['y'] = rng.uniform(0, 10560, rows)
+    data['maj'] = rng.uniform(1.8, 3.5, rows)
+    data['min'] = rng.uniform(1.6, 3.2, rows)
+    data['phi'] = rng.uniform(-90, 90, rows)
+    data['apfit'] = rng.uniform(-0.5, -0.3, rows)
+    data['mag5sig'] = rng.uniform(18.5, 20.5, rows)
+    data['Sky'] = rng.uniform(19, 22, rows)
+    data['Obs'] = '02a59251o0135c'
+
+    text = StringIO()
+    np.savetxt(text, data, header=ATLAS_HEADER[1:], comments='#',
+               fmt=['%.6f', '%.3f', '%.3f', '%d', '%d', '%s', '%d', '%.2f', '%.5f', '%.5f', '%.2f', '%.2f', '%.2f',
+                    '%.2f', '%.1f', '%.3f', '%.2f', '%.2f', '%s'])
+    return text.getvalue()
+
+
+def ztf_text(rows, seed=0):
+    """
+    Returns the text of a ZTF forced-photometry file with ``rows`` epochs, with the comment header and column list of
+    ``data/BD+222716b/none/sample_ztf_data.txt``. A few percent of the epochs have a non-zero ``procstatus``.
+    """
+    rng = np.random.default_rng(seed)
+    data = np.zeros(rows, dtype=[(name, dtype) for name, dtype, _ in ZTF_COLUMNS])
+    data['index'] = np.arange(rows)
+    data['field'] = 281
+    data['ccdid'] = rng.integers(1, 17, rows)
+    data['qid'] = rng.integers(0, 4, rows)
+    data['filter'] = rng.choice(['ZTF_g', 'ZTF_r', 'ZTF_i'], rows, p=[0.45, 0.45, 0.1])
+    data['pid'] = rng.integers(10 ** 11, 10 ** 12, rows)
+    data['infobitssci'] = np.where(rng.random(rows) < 0.05, 8, 0)
+    data['sciinpseeing'] = rng.uniform(1.5, 5, rows)
+    data['scibckgnd'] = rng.uniform(150, 200, rows)
+    data['scisigpix'] = rng.uniform(10, 25, rows)
+    data['zpmaginpsci'] = data['zpdiff'] = rng.uniform(25.8, 26.3, rows)
+    data['zpmaginpsciunc'] = rng.uniform(5e-5, 5e-4, rows)
+    data['zpmaginpscirms'] = rng.uniform(0.02, 0.08, rows)
+    data['clrcoeff'] = rng.uniform(0.05, 0.15, rows)
+    data['clrcoeffunc'] = rng.uniform(2e-5, 2e-4, rows)
+    data['ncalmatches'] = rng.integers(500, 700, rows)
+    data['exptime'] = 30
+    data['adpctdif1'] = rng.uniform(0.15, 0.35, rows)
+    data['adpctdif2'] = rng.uniform(0.15, 0.35, rows)
+    data['diffmaglim'] = rng.uniform(19, 21, rows)
+    data['programid'] = 1
+    data['jd'] = np.sort(rng.uniform(2458200, 2460200, rows))
+    data['rfid'] = 281120263
+    data['forcediffimfluxunc'] = rng.uniform(40, 90, rows)
+    data['forcediffimflux'] = data['forcediffimfluxunc'] * rng.normal(3, 4, rows)
+    data['forcediffimsnr'] = data['forcediffimflux'] / data['forcediffimfluxunc']
+    data['forcediffimchisq'] = rng.uniform(0.5, 3, rows)
+    data['forcediffimfluxuncap'] = data['forcediffimfluxunc'] * 1.1
+    data['forcediffimfluxap'] = data['forcediffimflux'] * 1.05
+    data['forcediffimsnrap'] = data['forcediffimfluxap'] / data['forcediffimfluxuncap']
+    data['aperturecorr'] = 1.07
+    data['dnearestrefsrc'] = rng.uniform(0, 5, rows)
+    data['nearestrefmag'] = rng.uniform(17, 20, rows)
+    data['nearestrefmagunc'] = 0.07
+    data['nearestrefchi'] = rng.uniform(0.8, 2, rows)
+    data['nearestrefsharp'] = rng.uniform(-0.3, 0.3, rows)
+    data['refjdstart'] = 2458338.689444
+    data['refjdend'] = 2458636.898634
+    data['procstatus'] = np.where(rng.random(rows) < 0.03, 56, 0)
+
+    with open(ZTF_SAMPLE) as f:
+        header = []
+        for line in f:
+            header.append(line)
+            if line.startswith(' index,'):
+                header.append(next(f))   # the '#' line closing the header
+                break
+
+    text = StringIO()
+    text.write(''.join(header))
+    np.savetxt(text, data, fmt=[fmt for _, _, fmt in ZTF_COLUMNS])
+    text.write('# ------------------------------END---------------------------------\n')
+    return text.getvalue()
+
+
+def panstarrs_cutout(size=32, seed=0):
+    """
+    Returns the bytes of a ``size`` x ``size`` pixel PanSTARRS stack cutout, with the header of
+    ``data/Target/none/t360.000089.4000.r.fits`` and a point source on a noisy sky.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[:size, :size]
+    image = rng.normal(0, 5, (size, size)) + 500 * np.exp(-((x - size / 2) ** 2 + (y - size / 2) ** 2) / 8)
+
+    header = fits.getheader(PANSTARRS_SAMPLE)
+    cutout = BytesIO()
+    fits.PrimaryHDU(image.astype(np.float32), header=header).writeto(cutout)
+    return cutout.getvalue()
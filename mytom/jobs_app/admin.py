@@ -0,0 +1,9 @@
+from django.contrib import admin
+
+from .models import QueryJob
+
+
+@admin.register(QueryJob)
+class QueryJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'target', 'status', 'created', 'started', 'finished')
+    list_filter = ('status', 'task')
@@ -0,0 +1,112 @@
+import logging
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import QueryJob
+from .progress import publish_claimed, publish_progress
+
+logger = logging.getLogger(__name__)
+
+# seconds a job may run before it is taken to have been abandoned by a worker that stopped
+JOB_TIMEOUT = getattr(settings, 'JOB_TIMEOUT', 6 * 60 * 60)
+
+
+def enqueue(task, target=None, user=None, **parameters):
+    """
+    Stores a ``QueryJob`` for the worker to pick up and returns it without running it.
+
+    :param task: Dotted path of the callable to run, e.g. ``'atlas_app.tasks.atlas_forced_photometry'``
+    :type task: str
+
+    :param target: ``Target`` the query is for
+    :type target: Target
+
+    :param user: User who requested the query; anonymous users are not recorded
+    :type user: User
+
+    :returns: the queued job
+    :rtype: QueryJob
+    """
+    if user is not None and not user.is_authenticated:
+        user = None
+    job = QueryJob.objects.create(task=task, target=target, user=user, parameters=parameters)
+    publish_progress(job, **job.as_dict())
+    return job
+
+
+def claim_next_job():
+    """
+    Marks the oldest pending job as running and returns it, or returns None if the queue is empty. The claim is a
+    conditional update, so several workers can share one queue without running a job twice.
+    """
+    pending = QueryJob.objects.filter(status=QueryJob.PENDING).order_by('pk').values_list('pk', flat=True)
+    for pk in pending[:10]:
+        claimed = QueryJob.objects.filter(pk=pk, status=QueryJob.PENDING).update(
+            status=QueryJob.RUNNING, started=timezone.now())
+        if claimed:
+            job = QueryJob.objects.get(pk=pk)
+            publish_claimed(job)
+            publish_progress(job, **job.as_dict())
+            return job
+    return None
+
+
+def fail_stale_jobs(timeout=None):
+    """
+    Fails the jobs that have been running for longer than ``timeout`` seconds. A worker that crashes or is killed
+    leaves its job running for ever; run this when a worker starts so such jobs are finished. They are failed rather
+    than queued again, as a job that brought its worker down would likely do it again.
+
+    :param timeout: defaults to ``JOB_TIMEOUT``, which can be set in settings
+    :type timeout: float
+
+    :returns: the jobs that were failed
+    :rtype: list
+    """
+    cutoff = timezone.now() - timedelta(seconds=timeout or JOB_TIMEOUT)
+    failed = []
+    for job in QueryJob.objects.filter(status=QueryJob.RUNNING, started__lt=cutoff):
+        job.status = QueryJob.FAILED
+        job.message = f'The worker stopped before the job finished (started {job.started:%Y-%m-%d %H:%M:%S} UTC)'
+        job.finished = timezone.now()
+        # a conditional update, so a job another worker has just finished is left alone
+        if QueryJob.objects.filter(pk=job.pk, status=QueryJob.RUNNING).update(
+                status=job.status, message=job.message, finished=job.finished):
+            logger.warning('%s was still running after %s s; marked as failed', job, timeout or JOB_TIMEOUT)
+            publish_progress(job, **job.as_dict())
+            failed.append(job)
+    return failed
+
+
+def get_task(task):
+    try:
+        mod_name, func_name = task.rsplit('.', 1)
+        mod = import_module(mod_name)
+        return getattr(mod, func_name)
+    except (ImportError, AttributeError, ValueError):
+        raise ImportError('Could not import {}. Did you provide the correct path?'.format(task))
+
+
+def run_job(job):
+    """
+    Runs a claimed job and records its outcome. Errors raised by the task are stored on the job rather than
+    propagated, so one failing query does not stop the worker. Only the error's type and text are stored, as the
+    job's message is shown to its user; the traceback goes to the log.
+    """
+    try:
+        result = get_task(job.task)(job)
+    except Exception as e:
+        logger.exception('%s failed', job)
+        job.status = QueryJob.FAILED
+        job.message = f'{type(e).__name__}: {e}'
+    else:
+        job.status = QueryJob.COMPLETED
+        if isinstance(result, str):
+            job.message = result
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'message', 'finished'])
+    publish_progress(job, **job.as_dict())
+    return job
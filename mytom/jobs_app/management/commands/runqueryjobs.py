@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from jobs_app.jobs import claim_next_job, fail_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+
+    help = 'Runs queued survey query jobs (ATLAS, ZTF, PanSTARRS) outside of the web server.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run every pending job, then exit.')
+        parser.add_argument('--sleep', type=float, default=2.0,
+                            help='Seconds to wait before checking an empty queue again.')
+
+    def handle(self, *args, **options):
+        for job in fail_stale_jobs():
+            self.stdout.write(f'{job} was abandoned by a stopped worker; marked as failed')
+        while True:
+            close_old_connections()
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+                continue
+            self.stdout.write(f'Running {job}')
+            run_job(job)
+            self.stdout.write(f'{job} finished with status {job.status}')
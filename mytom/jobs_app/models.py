@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.db import models
+
+from tom_targets.models import Target
+
+
+class QueryJobQuerySet(models.QuerySet):
+
+    def visible_to(self, user):
+        """
+        Jobs a user may see: their own, or every job for staff.
+        """
+        if user.is_staff:
+            return self
+        return self.filter(user_id=user.pk)
+
+
+class QueryJob(models.Model):
+    """
+    Class representing a survey query that is run by the ``runqueryjobs`` worker instead of inside a web request.
+
+    :param task: Dotted path of the callable that performs the query. It is called with the job as its only argument.
+    :type task: str
+
+    :param target: The ``Target`` the query is for, if any.
+
+    :param parameters: Keyword parameters of the query, e.g. ``{'mjd': 59000.0}`` for an ATLAS query.
+    :type parameters: dict
+
+    :param status: One of PENDING, RUNNING, COMPLETED or FAILED.
+    :type status: str
+
+    :param message: Result summary, or the type and text of the error raised when the job failed. The traceback is
+        only logged by the worker.
+    :type message: str
+    """
+
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    COMPLETED = 'COMPLETED'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    )
+
+    task = models.CharField(max_length=200)
+    target = models.ForeignKey(Target, null=True, blank=True, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    parameters = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    message = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    objects = QueryJobQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('created',)
+
+    def __str__(self):
+        return f'Job {self.pk} ({self.task})'
+
+    def as_dict(self, parameters=False):
+        """
+        Returns the job status in a JSON serializable form for the status endpoints.
+
+        :param parameters: Whether to include the job's parameters, which hold the ids of data products, groups and
+            upload batches; only the job's user should get them.
+        :type parameters: bool
+        """
+        status = {
+            'id': self.pk,
+            'task': self.task,
+            'target': self.target_id,
+            'user': self.user_id,
+            'status': self.status,
+            'message': self.message,
+            'created': self.created.isoformat() if self.created else None,
+            'started': self.started.isoformat() if self.started else None,
+            'finished': self.finished.isoformat() if self.finished else None,
+        }
+        if parameters:
+            status['parameters'] = self.parameters
+        return status
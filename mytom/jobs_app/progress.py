@@ -0,0 +1,50 @@
+from django.core.cache import cache
+
+PROGRESS_KEY = 'jobs_app.progress.{}'
+LAST_CLAIMED_KEY = 'jobs_app.last_claimed'
+PROGRESS_TIMEOUT = 60 * 60 * 24
+
+
+def publish_progress(job, **fields):
+    """
+    Merges ``fields`` into the cached progress of a job and bumps its version. The status endpoints only read this
+    cache entry, so watching a job costs no database queries.
+
+    Tasks call it to report what they are doing, e.g. ``publish_progress(job, stage='Downloading result')``.
+    """
+    key = PROGRESS_KEY.format(job.pk)
+    progress = cache.get(key) or {'id': job.pk, 'task': job.task, 'target': job.target_id}
+    progress.update(fields)
+    progress['version'] = progress.get('version', 0) + 1
+    cache.set(key, progress, PROGRESS_TIMEOUT)
+    return progress
+
+
+def publish_claimed(job):
+    """
+    Records the newest job claimed by a worker, from which the queue position of pending jobs is worked out.
+    """
+    cache.set(LAST_CLAIMED_KEY, job.pk, PROGRESS_TIMEOUT)
+
+
+def get_progress(job_id):
+    """
+    Returns the cached progress of a job, or None if nothing has been published for it. Pending jobs get a
+    ``queue_position``: jobs are claimed in id order, so it is the number of ids between the newest claimed job and
+    this one.
+    """
+    progress = cache.get(PROGRESS_KEY.format(job_id))
+    if progress and progress.get('status') == 'PENDING':
+        progress['queue_position'] = max(job_id - cache.get(LAST_CLAIMED_KEY, 0) - 1, 0)
+    return progress
+
+
+async def aget_progress(job_id):
+    """
+    Asynchronous ``get_progress``.
+    """
+    progress = await cache.aget(PROGRESS_KEY.format(job_id))
+    if progress and progress.get('status') == 'PENDING':
+        last_claimed = await cache.aget(LAST_CLAIMED_KEY, 0)
+        progress['queue_position'] = max(job_id - last_claimed - 1, 0)
+    return progress
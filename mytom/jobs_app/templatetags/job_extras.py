@@ -0,0 +1,15 @@
+from django import template
+
+from jobs_app.models import QueryJob
+
+register = template.Library()
+
+
+@register.inclusion_tag('jobs_app/partials/active_jobs.html')
+def active_jobs_for_target(target):
+    """
+    Lists the pending and running survey queries of a target. The page follows each one through its server-sent
+    events stream, so it updates without reloading.
+    """
+    jobs = QueryJob.objects.filter(target=target, status__in=[QueryJob.PENDING, QueryJob.RUNNING])
+    return {'target': target, 'jobs': jobs}
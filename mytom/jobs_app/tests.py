@@ -0,0 +1,223 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from tom_observations.tests.factories import SiderealTargetFactory
+
+from .jobs import claim_next_job, enqueue, run_job
+from .models import QueryJob
+from .progress import get_progress, publish_progress
+from .views import JobEventsView
+
+
+def succeeding_task(job):
+    return f"ran with {job.parameters['value']}"
+
+
+def progress_task(job):
+    publish_progress(job, stage='Ingesting photometry', ingested=5)
+
+
+def failing_task(job):
+    raise RuntimeError('ATLAS is down')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestQueryJobs(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.target = SiderealTargetFactory.create()
+
+    def test_enqueue_does_not_run_task(self):
+        job = enqueue('jobs_app.tests.failing_task', target=self.target)
+
+        self.assertEqual(job.status, QueryJob.PENDING)
+        self.assertIsNone(job.started)
+
+    def test_claim_and_run_job(self):
+        enqueue('jobs_app.tests.succeeding_task', target=self.target, value=3)
+
+        job = claim_next_job()
+        self.assertEqual(job.status, QueryJob.RUNNING)
+        self.assertIsNone(claim_next_job())
+
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, QueryJob.COMPLETED)
+        self.assertEqual(job.message, 'ran with 3')
+        self.assertIsNotNone(job.finished)
+
+    def test_failed_job_records_error(self):
+        enqueue('jobs_app.tests.failing_task', target=self.target)
+
+        job = run_job(claim_next_job())
+
+        self.assertEqual(job.status, QueryJob.FAILED)
+        self.assertEqual(job.message, 'RuntimeError: ATLAS is down')   # no traceback
+
+    def test_stale_running_jobs_are_failed_when_the_worker_starts(self):
+        stale = enqueue('jobs_app.tests.succeeding_task', target=self.target, value=1)
+        running = enqueue('jobs_app.tests.succeeding_task', target=self.target, value=2)
+        QueryJob.objects.filter(pk=stale.pk).update(status=QueryJob.RUNNING,
+                                                    started=timezone.now() - timedelta(days=1))
+        QueryJob.objects.filter(pk=running.pk).update(status=QueryJob.RUNNING, started=timezone.now())
+
+        call_command('runqueryjobs', once=True, stdout=StringIO())
+
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stale.status, QueryJob.FAILED)
+        self.assertIsNotNone(stale.finished)
+        self.assertEqual(running.status, QueryJob.RUNNING)
+        self.assertEqual(get_progress(stale.pk)['status'], QueryJob.FAILED)
+
+    def test_status_endpoint(self):
+        user = User.objects.create(username='observer')
+        job = enqueue('jobs_app.tests.succeeding_task', target=self.target, user=user, value=1)
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('jobs_app:status', args=[job.pk]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], QueryJob.PENDING)
+        self.assertEqual(response.json()['target'], self.target.pk)
+        self.assertEqual(response.json()['parameters'], {'value': 1})
+
+    def test_jobs_of_other_users_are_hidden(self):
+        owner = User.objects.create(username='observer')
+        job = enqueue('jobs_app.tests.succeeding_task', target=self.target, user=owner, value=1, batch='uploads')
+
+        for url in (reverse('jobs_app:status', args=[job.pk]), reverse('jobs_app:list')):
+            self.assertRedirects(self.client.get(url), f"{reverse('login')}?next={url}", fetch_redirect_response=False)
+
+        self.client.force_login(User.objects.create(username='someone else'))
+        self.assertEqual(self.client.get(reverse('jobs_app:status', args=[job.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('jobs_app:list')).json()['jobs'], [])
+        self.assertEqual(self.client.get(reverse('jobs_app:list'), {'batch': 'uploads'}).json()['jobs'], [])
+
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+        jobs = self.client.get(reverse('jobs_app:list')).json()['jobs']
+        self.assertEqual([job['id'] for job in jobs], [job.pk])
+        self.assertNotIn('parameters', jobs[0])   # only the job's user gets them
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestJobProgress(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.target = SiderealTargetFactory.create()
+        self.user = User.objects.create(username='observer')
+        self.client.force_login(self.user)
+
+    def test_queue_position(self):
+        first = enqueue('jobs_app.tests.succeeding_task', target=self.target, user=self.user, value=1)
+        second = enqueue('jobs_app.tests.succeeding_task', target=self.target, user=self.user, value=2)
+        claim_next_job()
+
+        with self.assertNumQueries(2):   # the session and the user; the progress comes from the cache
+            response = self.client.get(reverse('jobs_app:progress', args=[second.pk]), {'timeout': 0})
+
+        self.assertEqual(response.json()['status'], QueryJob.PENDING)
+        self.assertEqual(response.json()['queue_position'], 0)
+        self.assertEqual(self.client.get(reverse('jobs_app:progress', args=[first.pk])).json()['status'],
+                         QueryJob.RUNNING)
+
+    def test_progress_published_by_task(self):
+        enqueue('jobs_app.tests.progress_task', target=self.target, user=self.user)
+        job = run_job(claim_next_job())
+
+        response = self.client.get(reverse('jobs_app:progress', args=[job.pk]))
+
+        self.assertEqual(response.json()['status'], QueryJob.COMPLETED)
+        self.assertEqual(response.json()['stage'], 'Ingesting photometry')
+        self.assertEqual(response.json()['ingested'], 5)
+
+    def test_long_poll_times_out_without_change(self):
+        job = enqueue('jobs_app.tests.succeeding_task', target=self.target, user=self.user, value=1)
+        version = self.client.get(reverse('jobs_app:progress', args=[job.pk])).json()['version']
+
+        response = self.client.get(reverse('jobs_app:progress', args=[job.pk]), {'since': version, 'timeout': 0.1})
+
+        self.assertEqual(response.json()['version'], version)
+
+    def test_unknown_job(self):
+        response = self.client.get(reverse('jobs_app:progress', args=[1234]))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_bad_parameters(self):
+        job = enqueue('jobs_app.tests.succeeding_task', target=self.target, user=self.user, value=1)
+        url = reverse('jobs_app:progress', args=[job.pk])
+
+        for parameters in ({'since': 'x'}, {'timeout': 'soon'}, {'timeout': 'nan'}, {'timeout': 'inf'}):
+            self.assertEqual(self.client.get(url, parameters).status_code, 400)
+        # a negative timeout answers at once
+        self.assertEqual(self.client.get(url, {'since': 10, 'timeout': -5}).json()['status'], QueryJob.PENDING)
+
+    def test_jobs_of_other_users_are_hidden(self):
+        job = enqueue('jobs_app.tests.succeeding_task', target=self.target, user=self.user, value=1)
+
+        self.client.force_login(User.objects.create(username='someone else'))
+        for name in ('progress', 'events'):
+            self.assertEqual(self.client.get(reverse(f'jobs_app:{name}', args=[job.pk])).status_code, 404)
+
+        self.client.logout()
+        url = reverse('jobs_app:progress', args=[job.pk])
+        self.assertRedirects(self.client.get(url), f"{reverse('login')}?next={url}", fetch_redirect_response=False)
+
+
+def read_events(response):
+    return [json.loads(line[len('data: '):]) for line in b''.join(response.streaming_content).decode().splitlines()
+            if line.startswith('data: ')]
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestJobEvents(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='observer')
+        self.client.force_login(self.user)
+        self.job = enqueue('jobs_app.tests.progress_task', target=SiderealTargetFactory.create(), user=self.user)
+        self.url = reverse('jobs_app:events', args=[self.job.pk])
+
+    def test_stream_follows_the_job_until_it_finishes(self):
+        steps = [claim_next_job, lambda: run_job(QueryJob.objects.get())]
+
+        def worker(seconds):
+            # stands in for the worker while the stream waits for a change
+            if steps:
+                steps.pop(0)()
+
+        with mock.patch('jobs_app.views.time.sleep', side_effect=worker):
+            response = self.client.get(self.url)
+            events = read_events(response)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(events[0]['status'], QueryJob.PENDING)
+        self.assertEqual(events[-1]['status'], QueryJob.COMPLETED)
+        self.assertEqual(events[-1]['stage'], 'Ingesting photometry')
+        versions = [event['version'] for event in events]
+        self.assertEqual(versions, sorted(set(versions)))
+
+    def test_stream_is_closed_after_max_duration(self):
+        with mock.patch.object(JobEventsView, 'TICK', 0.01), mock.patch.object(JobEventsView, 'MAX_DURATION', 0.05):
+            events = read_events(self.client.get(self.url))
+
+        self.assertEqual([event['status'] for event in events], [QueryJob.PENDING])
+
+    async def test_asgi_stream_does_not_wait(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+
+        response = await self.async_client.get(self.url)
+
+        self.assertEqual([event['status'] for event in read_events(response)], [QueryJob.PENDING])
@@ -0,0 +1,12 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'jobs_app'
+
+urlpatterns = [
+    path('jobs/', views.JobListView.as_view(), name='list'),
+    path('jobs/<int:pk>/', views.JobStatusView.as_view(), name='status'),
+    path('jobs/<int:pk>/progress/', views.JobProgressView.as_view(), name='progress'),
+    path('jobs/<int:pk>/events/', views.JobEventsView.as_view(), name='events'),
+]
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.generic import View
+
+from .models import QueryJob
+from .progress import aget_progress, get_progress, publish_progress
+
+FINISHED = (QueryJob.COMPLETED, QueryJob.FAILED)
+
+
+def can_view(user, progress):
+    """
+    Whether a user may follow the progress of a job: their own job, or any job for staff.
+    """
+    return user.is_staff or progress.get('user') == user.pk
+
+
+def authenticated_user(request):
+    return request.user if request.user.is_authenticated else None
+
+
+def get_job_progress(pk):
+    """
+    Returns the cached progress of a job. Only if nothing is cached yet (e.g. the job predates the cache entry, or
+    its entry predates the job's user being published) is the job read from the database, once, and its progress
+    cached.
+    """
+    progress = get_progress(pk)
+    if progress is None or 'user' not in progress:
+        job = get_object_or_404(QueryJob, pk=pk)
+        publish_progress(job, **job.as_dict())
+        progress = get_progress(pk)
+    return progress
+
+
+async def aget_job_progress(pk):
+    """
+    Asynchronous ``get_job_progress``.
+    """
+    progress = await aget_progress(pk)
+    if progress is None or 'user' not in progress:
+        try:
+            job = await QueryJob.objects.aget(pk=pk)
+        except QueryJob.DoesNotExist:
+            raise Http404(f'Job {pk} does not exist')
+        await sync_to_async(publish_progress)(job, **job.as_dict())
+        progress = await aget_progress(pk)
+    return progress
+
+
+class JobStatusView(LoginRequiredMixin, View):
+    """
+    Returns the status of a single ``QueryJob`` of the user as JSON; staff can see every job.
+    """
+
+    def get(self, request, pk, *args, **kwargs):
+        job = get_object_or_404(QueryJob.objects.visible_to(request.user), pk=pk)
+        return JsonResponse(job.as_dict(parameters=job.user_id == request.user.pk))
+
+
+class JobListView(LoginRequiredMixin, View):
+    """
+    Returns the statuses of the user's most recent ``QueryJob`` objects as JSON, or of everyone's for staff,
+    optionally filtered by ``?target=<pk>``, ``?status=<status>`` and ``?batch=<id>``, the batch id of jobs queued
+    together, e.g. by a multi-file upload. Only the user's own jobs include their parameters.
+    """
+
+    def get(self, request, *args, **kwargs):
+        jobs = QueryJob.objects.visible_to(request.user).order_by('-created')
+        if request.GET.get('target'):
+            jobs = jobs.filter(target_id=request.GET['target'])
+        if request.GET.get('status'):
+            jobs = jobs.filter(status=request.GET['status'].upper())
+        if request.GET.get('batch'):
+            jobs = jobs.filter(parameters__batch=request.GET['batch'])
+        return JsonResponse({'jobs': [job.as_dict(parameters=job.user_id == request.user.pk) for job in jobs[:100]]})
+
+
+class JobProgressView(View):
+    """
+    Long-poll endpoint for the progress of a job of the user (any job for staff): queue position, start and finish
+    timestamps and whatever the task has published (see ``publish_progress``). Responds as soon as the progress
+    version is newer than ``?since=``, the job has finished, or after ``?timeout=`` seconds (default 25, at most 60).
+    Progress is read from the cache, so an open poll costs no database queries beyond loading the user.
+    """
+
+    TICK = 1.0
+    MAX_TIMEOUT = 60
+
+    async def get(self, request, pk, *args, **kwargs):
+        # the session and user are loaded from the database, which cannot be done from the event loop
+        user = await sync_to_async(authenticated_user)(request)
+        if user is None:
+            return redirect_to_login(request.get_full_path())
+        try:
+            since = int(request.GET.get('since', 0))
+            timeout = float(request.GET.get('timeout', 25))
+        except ValueError:
+            timeout = math.nan
+        if not math.isfinite(timeout):
+            return JsonResponse({'error': '?since= must be a whole number and ?timeout= a number of seconds'},
+                                status=400)
+        deadline = asyncio.get_running_loop().time() + min(max(timeout, 0), self.MAX_TIMEOUT)
+
+        progress = await aget_job_progress(pk)
+        if not can_view(user, progress):
+            raise Http404(f'Job {pk} does not exist')
+        while progress['version'] <= since and progress['status'] not in FINISHED:
+            if asyncio.get_running_loop().time() >= deadline:
+                break
+            await asyncio.sleep(self.TICK)
+            progress = await aget_job_progress(pk)
+        return JsonResponse(progress)
+
+
+class JobEventsView(LoginRequiredMixin, View):
+    """
+    Server-sent events stream of the progress of a job of the user (any job for staff). An event is sent whenever the
+    cached progress changes, and the stream ends when the job has finished.
+
+    Django 4.1 cannot stream from an asynchronous generator, and iterates a synchronous one on the event loop when
+    served through ASGI, where waiting for a change would stall every other request. There the stream sends the
+    current progress and ends, and the browser's ``EventSource`` reconnects ``TICK`` seconds later. Otherwise the
+    stream waits for changes, holding a worker thread, for up to ``MAX_DURATION`` seconds before the browser
+    reconnects.
+    """
+
+    TICK = 1.0
+    MAX_DURATION = 5 * 60
+
+    def get(self, request, pk, *args, **kwargs):
+        progress = get_job_progress(pk)
+        if not can_view(request.user, progress):
+            raise Http404(f'Job {pk} does not exist')
+        duration = 0 if isinstance(request, ASGIRequest) else self.MAX_DURATION
+        response = StreamingHttpResponse(self.events(pk, progress, duration), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def events(self, pk, progress, duration):
+        deadline = time.monotonic() + duration
+        yield f'retry: {int(self.TICK * 1000)}\n\n'
+        while True:
+            yield f'id: {progress["version"]}\ndata: {json.dumps(progress)}\n\n'
+            if progress['status'] in FINISHED:
+                return
+            version = progress['version']
+            while progress['version'] == version:
+                if time.monotonic() >= deadline:
+                    return
+                time.sleep(self.TICK)
+                progress = get_progress(pk)
+                if progress is None:   # the cache entry expired or was evicted
+                    return
@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+
+
+class MyTOMConfig(AppConfig):
+    """
+    The project package as an app, so site-wide signal receivers are connected whatever survey apps are installed.
+    """
+
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'mytom'
+
+    def ready(self):
+        from django.db.models.signals import post_delete
+        from tom_dataproducts.models import DataProduct
+
+        from .hooks import data_product_post_delete
+
+        post_delete.connect(data_product_post_delete, sender=DataProduct, dispatch_uid='mytom_delete_previews')
@@ -3,6 +3,9 @@ ASGI config for mytom project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serving the TOM through it (e.g. ``uvicorn mytom.asgi:application``) lets the job progress long-poll endpoint in
+``jobs_app`` wait without holding a worker thread per open browser tab.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -0,0 +1,101 @@
+"""
+Helpers that read FITS ``DataProduct`` files through memory maps, so only the parts of an image that are used are read
+from disk, and that cache the parsed headers of each data product.
+"""
+import hashlib
+import os
+
+import numpy as np
+from astropy.io import fits
+from django.core.cache import cache
+
+HEADER_KEY = 'mytom.fits_access.header.{}.{}.{}'
+HEADER_TIMEOUT = 60 * 60 * 24
+
+
+def fits_path(data_product):
+    """
+    Returns the path of the file of a ``DataProduct``, or the path itself if one is given.
+    """
+    return data_product.data.path if hasattr(data_product, 'data') else os.fspath(data_product)
+
+
+def open_fits(data_product):
+    """
+    Opens the file of a ``DataProduct`` memory-mapped, loading each HDU only when it is used. Use it as a context
+    manager, and copy any data that is needed after the file is closed.
+
+    :rtype: astropy.io.fits.HDUList
+    """
+    return fits.open(fits_path(data_product), memmap=True, lazy_load_hdus=True)
+
+
+def header_key(data_product, ext):
+    path = fits_path(data_product)
+    stat = os.stat(path)
+    # the path is hashed, as memcached rejects keys with spaces or of more than 250 characters; the size and
+    # modification time make a replaced file miss the cache
+    digest = hashlib.sha1(path.encode()).hexdigest()
+    return HEADER_KEY.format(digest, ext, f'{stat.st_size}-{stat.st_mtime_ns}')
+
+
+def get_header(data_product, ext=0):
+    """
+    Returns the header of an HDU of a ``DataProduct``'s file. Headers are parsed once and kept in the cache, so
+    reading one again does not open the file.
+
+    :param ext: index of the HDU
+    :type ext: int
+
+    :rtype: astropy.io.fits.Header
+    """
+    key = header_key(data_product, ext)
+    text = cache.get(key)
+    if text is None:
+        with open_fits(data_product) as hdul:
+            text = hdul[ext].header.tostring()
+        cache.set(key, text, HEADER_TIMEOUT)
+    return fits.Header.fromstring(text)
+
+
+def data_shape(header):
+    """
+    Returns the shape of the data of an HDU, in numpy order, from its header.
+    """
+    return tuple(header[f'NAXIS{axis}'] for axis in range(header.get('NAXIS', 0), 0, -1))
+
+
+def read_section(data_product, section=(), ext=0):
+    """
+    Reads part of the data of an HDU through a memory map, e.g. ``read_section(dp, (0, 0, slice(None)))`` for the
+    first spectrum of a cube. Only the pages holding the section are read from disk.
+
+    :param section: index of the part to read, in numpy order; the whole array by default
+    :type section: tuple
+
+    :returns: a copy of the section, scaled by ``BSCALE`` and ``BZERO``
+    :rtype: numpy.ndarray
+    """
+    with open_fits(data_product) as hdul:
+        return np.array(hdul[ext].section[section])
+
+
+def read_header_and_section(data_product, section=(), ext=0):
+    """
+    Reads the header of an HDU and part of its data through one open of the file, caching the header as
+    ``get_header`` does.
+
+    :param section: index of the part to read, in numpy order, or a callable that returns it from the header, e.g.
+        to read the first spectrum of whatever shape the data has
+    :type section: tuple or callable
+
+    :returns: the header, and a copy of the section scaled by ``BSCALE`` and ``BZERO``
+    :rtype: tuple
+    """
+    key = header_key(data_product, ext)
+    with open_fits(data_product) as hdul:
+        hdu = hdul[ext]
+        if cache.get(key) is None:
+            cache.set(key, hdu.header.tostring(), HEADER_TIMEOUT)
+        index = section(hdu.header) if callable(section) else section
+        return hdu.header, np.array(hdu.section[index])
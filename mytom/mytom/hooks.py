@@ -0,0 +1,26 @@
+"""
+Hooks of this TOM, configured in ``settings.HOOKS``.
+"""
+from tom_dataproducts import hooks
+
+from jobs_app.jobs import enqueue
+
+from .previews import delete_previews, is_fits_image
+
+
+def data_product_post_upload(dp):
+    """
+    Runs after a data product is uploaded or downloaded: runs the TOM Toolkit's hook, then queues the rendering of
+    the previews of a FITS image.
+    """
+    hooks.data_product_post_upload(dp)
+    if is_fits_image(dp):
+        enqueue('mytom.tasks.render_previews', target=dp.target, data_product=dp.pk)
+
+
+def data_product_post_delete(sender, instance, **kwargs):
+    """
+    ``post_delete`` receiver of ``DataProduct``, connected in ``MyTOMConfig.ready``: removes the previews of the
+    deleted data product.
+    """
+    delete_previews(instance)
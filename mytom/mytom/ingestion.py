@@ -0,0 +1,81 @@
+"""
+Shared helpers the survey data processors use to store ``ReducedDatum`` objects in bulk.
+"""
+from datetime import timezone
+from itertools import islice
+
+import numpy as np
+from astropy.time import Time
+from django.conf import settings
+from django.db import transaction
+
+from tom_dataproducts.models import ReducedDatum
+
+# number of rows sent to the database per INSERT, and built in memory at a time
+INGEST_BATCH_SIZE = getattr(settings, 'INGEST_BATCH_SIZE', 2000)
+
+
+def times_to_datetimes(times, format='mjd', scale='utc'):
+    """
+    Converts an array of times to timezone-aware UTC datetimes with a single ``astropy.time.Time``, which is far
+    cheaper than building one ``Time`` per row.
+
+    :param times: MJDs, JDs or anything else ``Time`` accepts in ``format``
+    :type times: array-like
+
+    :param format: ``Time`` format of ``times``, e.g. ``'mjd'`` or ``'jd'``
+    :type format: str
+
+    :param scale: time scale of ``times``
+    :type scale: str
+
+    :returns: one ``datetime`` per time, in the order of ``times``
+    :rtype: list
+    """
+    times = np.atleast_1d(np.asarray(times, dtype=float))
+    if not len(times):
+        return []
+    # to_datetime(timezone=...) converts every element separately, so the naive datetimes are labelled as UTC instead
+    return [timestamp.replace(tzinfo=timezone.utc)
+            for timestamp in Time(times, format=format, scale=scale).utc.to_datetime()]
+
+
+def chunked(iterable, size):
+    """
+    Yields lists of at most ``size`` items of ``iterable``.
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def bulk_ingest(target, timestamps, values, source_name, data_type='photometry', data_product=None,
+                batch_size=None):
+    """
+    Stores one ``ReducedDatum`` per ``(timestamp, value)`` pair for the target. The datums are built and inserted
+    ``batch_size`` at a time inside a single transaction, so a failed ingest stores nothing and memory use does not
+    grow with the number of rows.
+
+    :param timestamps: datetime of each datum, e.g. from ``times_to_datetimes``
+    :type timestamps: iterable
+
+    :param values: ``value`` dict of each datum
+    :type values: iterable
+
+    :param batch_size: rows per INSERT, defaults to ``INGEST_BATCH_SIZE``
+    :type batch_size: int
+
+    :returns: number of datums stored
+    :rtype: int
+    """
+    batch_size = batch_size or INGEST_BATCH_SIZE
+    datums = (ReducedDatum(target=target, data_product=data_product, data_type=data_type,
+                           timestamp=timestamp, value=value, source_name=source_name)
+              for timestamp, value in zip(timestamps, values))
+
+    stored = 0
+    with transaction.atomic():
+        for chunk in chunked(datums, batch_size):
+            ReducedDatum.objects.bulk_create(chunk, batch_size=batch_size)
+            stored += len(chunk)
+    return stored
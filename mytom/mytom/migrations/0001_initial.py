@@ -0,0 +1,25 @@
+# Generated by Django 4.1.7 on 2026-10-18 00:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('tom_dataproducts', '0011_reduceddatum_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderedPreviews',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('names', models.JSONField(default=list)),
+                ('rendered', models.DateTimeField(auto_now=True)),
+                ('data_product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rendered_previews', to='tom_dataproducts.dataproduct')),
+            ],
+        ),
+    ]
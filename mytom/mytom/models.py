@@ -0,0 +1,22 @@
+from django.db import models
+
+from tom_dataproducts.models import DataProduct
+
+
+class RenderedPreviews(models.Model):
+    """
+    Class recording the previews rendered for a ``DataProduct`` by ``mytom.previews.render_previews``, so pages can
+    link to them without asking the storage whether each file exists.
+
+    :param data_product: The ``DataProduct`` the previews are of.
+
+    :param names: Storage names of the rendered previews.
+    :type names: list
+    """
+
+    data_product = models.OneToOneField(DataProduct, on_delete=models.CASCADE, related_name='rendered_previews')
+    names = models.JSONField(default=list)
+    rendered = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Previews of {self.data_product}'
@@ -0,0 +1,95 @@
+"""
+Helpers that grant django-guardian object permissions to groups in bulk.
+"""
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import QuerySet
+from guardian.models import GroupObjectPermission
+
+from tom_dataproducts.models import DataProduct, ReducedDatum
+
+from .ingestion import INGEST_BATCH_SIZE, chunked
+
+DATA_PRODUCT_PERMISSIONS = ('tom_dataproducts.view_dataproduct', 'tom_dataproducts.delete_dataproduct')
+REDUCED_DATUM_PERMISSIONS = ('tom_dataproducts.view_reduceddatum',)
+
+
+def object_pks(objects):
+    """
+    Returns the model and the primary keys, as strings, of a queryset or list of instances of one model. A queryset is
+    read with ``values_list`` so the objects themselves are never built.
+    """
+    if isinstance(objects, QuerySet):
+        return objects.model, [str(pk) for pk in objects.values_list('pk', flat=True)]
+    objects = list(objects)
+    model = type(objects[0]) if objects else None
+    return model, [str(obj.pk) for obj in objects]
+
+
+def bulk_assign_perms(groups, grants, batch_size=None):
+    """
+    Gives every group every permission of ``grants`` on its objects. All the rows are written with ``bulk_create``
+    inside a single transaction, rather than with one query per group, permission and object as ``assign_perm`` does.
+    Rows that already exist are left as they are.
+
+    :param groups: groups the permissions are given to
+    :type groups: iterable
+
+    :param grants: ``(permissions, objects)`` pairs, where ``permissions`` are ``'app_label.codename'`` strings and
+        ``objects`` a queryset or list of instances of the model the permissions belong to
+    :type grants: iterable
+
+    :param batch_size: rows per INSERT, defaults to ``INGEST_BATCH_SIZE``
+    :type batch_size: int
+
+    :returns: number of rows sent to the database, including ones that already existed
+    :rtype: int
+    """
+    batch_size = batch_size or INGEST_BATCH_SIZE
+    groups = list(groups)
+    if not groups:
+        return 0
+
+    with transaction.atomic():
+        resolved = []
+        for perms, objects in grants:
+            model, pks = object_pks(objects)
+            if not pks:
+                continue
+            content_type = ContentType.objects.get_for_model(model)
+            codenames = [perm.split('.', 1)[-1] for perm in perms]
+            permissions = list(Permission.objects.filter(content_type=content_type, codename__in=codenames))
+            if len(permissions) != len(set(codenames)):
+                missing = set(codenames) - {permission.codename for permission in permissions}
+                raise Permission.DoesNotExist(f'No permissions {", ".join(sorted(missing))} for {model.__name__}')
+            resolved.append((content_type, permissions, pks))
+
+        rows = (GroupObjectPermission(group=group, permission=permission, content_type=content_type, object_pk=pk)
+                for content_type, permissions, pks in resolved
+                for permission in permissions
+                for group in groups
+                for pk in pks)
+        written = 0
+        for chunk in chunked(rows, batch_size):
+            GroupObjectPermission.objects.bulk_create(chunk, batch_size=batch_size, ignore_conflicts=True)
+            written += len(chunk)
+    return written
+
+
+def assign_data_product_perms(groups, data_products, batch_size=None):
+    """
+    Gives the groups view and delete access to the data products and view access to the ``ReducedDatum`` objects
+    ingested from them, in one transaction (see ``bulk_assign_perms``).
+
+    :param data_products: a queryset or list of ``DataProduct`` objects
+    :type data_products: iterable
+
+    :returns: number of rows sent to the database
+    :rtype: int
+    """
+    _, pks = object_pks(data_products)
+    return bulk_assign_perms(groups, [
+        (DATA_PRODUCT_PERMISSIONS, DataProduct.objects.filter(pk__in=pks)),
+        (REDUCED_DATUM_PERMISSIONS, ReducedDatum.objects.filter(data_product__in=pks)),
+    ], batch_size=batch_size)
@@ -0,0 +1,176 @@
+"""
+Preview images of FITS ``DataProduct`` files: zscale-stretched JPEG and PNG images at a few sizes and a downsampled
+FITS file, which pages show instead of the full images.
+"""
+import math
+import posixpath
+import warnings
+from io import BytesIO
+
+import numpy as np
+from astropy.io import fits
+from astropy.visualization import ZScaleInterval
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from .fits_access import open_fits
+from .models import RenderedPreviews
+
+# longest side, in pixels, of the preview images of each data product
+PREVIEW_SIZES = getattr(settings, 'PREVIEW_SIZES', (128, 256, 512))
+PREVIEW_FORMATS = getattr(settings, 'PREVIEW_FORMATS', ('jpg', 'png'))
+# longest side, in pixels, of the downsampled FITS file
+PREVIEW_FITS_SIZE = getattr(settings, 'PREVIEW_FITS_SIZE', 512)
+PREVIEW_DIRECTORY = 'previews'
+FITS_TYPES = ('fits_file', 'image_file')
+PIL_FORMATS = {'jpg': 'JPEG', 'png': 'PNG'}
+
+
+def is_fits_image(data_product):
+    """
+    Whether previews can be made of a data product: an image data product whose file is FITS.
+    """
+    name = data_product.data.name or ''
+    return data_product.data_product_type in FITS_TYPES and name.lower().endswith(('.fits', '.fit', '.fts', '.fz'))
+
+
+def preview_directory(data_product):
+    return posixpath.join(PREVIEW_DIRECTORY, str(data_product.pk))
+
+
+def preview_name(data_product, size=None, format='jpg'):
+    """
+    Returns the storage name of a preview of a data product: the ``size`` pixel image in ``format``, or the
+    downsampled FITS file if ``format`` is ``'fits'``.
+    """
+    if format == 'fits':
+        return posixpath.join(preview_directory(data_product), 'preview.fits')
+    return posixpath.join(preview_directory(data_product), f'{size}.{format}')
+
+
+def rendered_previews(data_product):
+    """
+    Returns the storage names of the rendered previews of a data product, as recorded by ``render_previews``. They are
+    read from the database once per data product instance, however many of its previews a page links to.
+
+    :rtype: set
+    """
+    if not hasattr(data_product, '_rendered_previews'):
+        names = RenderedPreviews.objects.filter(data_product=data_product).values_list('names', flat=True).first()
+        data_product._rendered_previews = set(names or ())
+    return data_product._rendered_previews
+
+
+def preview_url(data_product, size=None, format='jpg'):
+    """
+    Returns the URL of a preview of a data product, or None if it has not been rendered. The storage is not asked
+    whether the file exists, which would be a round trip per preview with remote storage.
+    """
+    name = preview_name(data_product, size, format)
+    return default_storage.url(name) if name in rendered_previews(data_product) else None
+
+
+def block_mean(data, factor):
+    """
+    Averages ``factor`` x ``factor`` blocks of a 2-D image, ignoring NaNs. Rows and columns left over at the edges are
+    dropped.
+    """
+    if factor == 1:
+        return np.asarray(data, dtype=np.float32)
+    ny, nx = data.shape[0] // factor, data.shape[1] // factor
+    blocks = np.asarray(data[:ny * factor, :nx * factor], dtype=np.float32).reshape(ny, factor, nx, factor)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)   # all-NaN blocks stay NaN
+        return np.nanmean(blocks, axis=(1, 3))
+
+
+def downsampled_header(header, factor):
+    """
+    Returns a copy of an image header, without the keywords that describe the data array, whose WCS is adjusted to the
+    image averaged in ``factor`` x ``factor`` blocks.
+    """
+    header = header.copy(strip=True)
+    header.remove('BLANK', ignore_missing=True)   # the averaged image is floating point
+    for axis in (1, 2):
+        if f'CRPIX{axis}' in header:
+            header[f'CRPIX{axis}'] = (header[f'CRPIX{axis}'] - 0.5) / factor + 0.5
+        if f'CDELT{axis}' in header:
+            header[f'CDELT{axis}'] *= factor
+        for other in (1, 2):
+            if f'CD{axis}_{other}' in header:
+                header[f'CD{axis}_{other}'] *= factor
+    header['HISTORY'] = f'Averaged in {factor}x{factor} pixel blocks for a preview'
+    return header
+
+
+def zscale_image(data):
+    """
+    Stretches an image to 8 bits between its zscale limits, with north up as FITS images are stored bottom row first.
+
+    :rtype: PIL.Image.Image
+    """
+    finite = np.isfinite(data)
+    if not finite.any():
+        return Image.fromarray(np.zeros(data.shape, dtype=np.uint8))
+    low, high = ZScaleInterval().get_limits(data[finite])
+    scaled = np.clip((np.where(finite, data, low) - low) / ((high - low) or 1), 0, 1)
+    return Image.fromarray(np.flipud((scaled * 255).astype(np.uint8)))
+
+
+def save_preview(name, content):
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, ContentFile(content))
+
+
+def render_previews(data_product):
+    """
+    Renders the previews of a FITS image data product: a downsampled FITS file no larger than
+    ``PREVIEW_FITS_SIZE`` pixels a side, and a zscale-stretched image in every ``PREVIEW_FORMATS`` at every
+    ``PREVIEW_SIZES``. The image is read through a memory map and averaged down in one pass, and the smaller previews
+    are made from the averaged image. The names of the previews are recorded in ``RenderedPreviews``.
+
+    :returns: storage names of the previews, or an empty list if the file holds no image
+    :rtype: list
+    """
+    with open_fits(data_product) as hdul:
+        hdu = next((hdu for hdu in hdul if hdu.is_image and hdu.header.get('NAXIS', 0) >= 2), None)
+        if hdu is None:
+            return []
+        data = hdu.data
+        data = data[(0,) * (data.ndim - 2)]   # first plane of a cube
+        factor = max(1, math.ceil(max(data.shape) / PREVIEW_FITS_SIZE))
+        reduced = block_mean(data, factor)
+        header = downsampled_header(hdu.header, factor)
+
+    names = []
+    preview = BytesIO()
+    fits.PrimaryHDU(reduced, header=header).writeto(preview, output_verify='silentfix')
+    names.append(preview_name(data_product, format='fits'))
+    save_preview(names[-1], preview.getvalue())
+
+    image = zscale_image(reduced)
+    for size in PREVIEW_SIZES:
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        for format in PREVIEW_FORMATS:
+            content = BytesIO()
+            resized.save(content, PIL_FORMATS[format])
+            names.append(preview_name(data_product, size, format))
+            save_preview(names[-1], content.getvalue())
+    RenderedPreviews.objects.update_or_create(data_product=data_product, defaults={'names': names})
+    data_product._rendered_previews = set(names)
+    return names
+
+
+def delete_previews(data_product):
+    """
+    Removes the previews of a data product from storage.
+    """
+    directory = preview_directory(data_product)
+    if default_storage.exists(directory):
+        _, files = default_storage.listdir(directory)
+        for name in files:
+            default_storage.delete(posixpath.join(directory, name))
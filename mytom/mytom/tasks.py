@@ -0,0 +1,19 @@
+from tom_dataproducts.models import DataProduct
+
+from jobs_app.progress import publish_progress
+
+from . import previews
+
+
+def render_previews(job):
+    """
+    ``QueryJob`` task that renders the previews of the FITS image ``DataProduct`` in the ``data_product`` parameter.
+    A data product deleted before the job runs needs no previews.
+    """
+    try:
+        dp = DataProduct.objects.get(pk=job.parameters['data_product'])
+    except DataProduct.DoesNotExist:
+        return f"Data product {job.parameters['data_product']} was deleted before its previews were rendered"
+    publish_progress(job, stage=f'Rendering previews of {dp}')
+    names = previews.render_previews(dp)
+    return f'{len(names)} previews rendered for {dp}'
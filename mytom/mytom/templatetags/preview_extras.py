@@ -0,0 +1,14 @@
+from django import template
+
+from mytom import previews
+
+register = template.Library()
+
+
+@register.simple_tag
+def preview_url(data_product, size=128, format='jpg'):
+    """
+    Returns the URL of a preview of a FITS ``DataProduct``, or an empty string if it has not been rendered, e.g.
+    ``{% preview_url product 256 'png' %}`` or ``{% preview_url product format='fits' %}``.
+    """
+    return previews.preview_url(data_product, size, format) or ''
@@ -20,4 +20,5 @@ urlpatterns = [
     path('', include('atlas_app.urls')),
     path('', include('ztf_app.urls')),
     path('', include('panSTARRS_app.urls')),
+    path('', include('jobs_app.urls')),
 ]
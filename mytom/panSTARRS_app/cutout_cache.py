@@ -0,0 +1,152 @@
+"""
+On-disk cache of PanSTARRS cutouts, so the same image is not downloaded from STScI again.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from urllib.parse import parse_qsl, urlparse
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# cutouts of these image types never change once they are published, so they can be kept
+CACHEABLE_TYPES = ('stack', 'stack.wt', 'stack.mask', 'stack.exp', 'stack.num')
+# bytes the cache may hold, unless CACHE_SIZE is set in settings.BROKERS['panstarrs']
+CACHE_SIZE = 2 * 1024 ** 3
+# FITS files are made of blocks of this many bytes
+FITS_BLOCK = 2880
+
+
+def get_setting(key, default):
+    return settings.BROKERS.get('panstarrs', {}).get(key, default)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CutoutCache:
+    """
+    Cache of cutout files keyed by the parameters of their ``fitscut.cgi`` request (position, size, format and image
+    file, which names the filter and image type).
+
+    Each cutout is stored under the SHA-256 of its parameters with a ``.sha256`` file holding the digest of its
+    contents, which is checked before the cutout is used. Reading a cutout marks it as recently used, and ``evict``
+    removes the least recently used cutouts once the cache holds more than ``max_bytes``.
+
+    :param directory: where the cutouts are stored, defaults to ``CACHE_DIR`` in ``settings.BROKERS['panstarrs']``
+        or a ``panstarrs_cutouts`` directory in the system's temporary directory
+    :type directory: str
+
+    :param max_bytes: size the cache is kept under, defaults to ``CACHE_SIZE``
+    :type max_bytes: int
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or get_setting('CACHE_DIR',
+                                                  os.path.join(tempfile.gettempdir(), 'panstarrs_cutouts'))
+        self.max_bytes = max_bytes or get_setting('CACHE_SIZE', CACHE_SIZE)
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def is_cacheable(row):
+        """
+        Whether the cutout of a ``getimages`` table row is a FITS file of an image type that never changes.
+        """
+        return row['type'] in CACHEABLE_TYPES and dict(parse_qsl(urlparse(row['url']).query)).get('format') == 'fits'
+
+    @staticmethod
+    def key(url):
+        """
+        Returns the cache key of a cutout URL: the SHA-256 of its sorted query parameters, so the host and the order
+        of the parameters do not matter.
+        """
+        parameters = '&'.join(f'{name}={value}' for name, value in sorted(parse_qsl(urlparse(url).query)))
+        return hashlib.sha256(parameters.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.fits')
+
+    def is_valid(self, path):
+        """
+        Checks that a cached file is whole: it is made of FITS blocks and its contents match the stored digest.
+        """
+        try:
+            if os.path.getsize(path) % FITS_BLOCK:
+                return False
+            with open(f'{path}.sha256') as f:
+                return f.read().strip() == file_digest(path)
+        except OSError:
+            return False
+
+    def get(self, url, destination):
+        """
+        Copies the cached cutout of ``url`` to ``destination``. A cached file that fails the integrity check is
+        removed.
+
+        :returns: whether the cutout was in the cache
+        :rtype: bool
+        """
+        path = self.path(self.key(url))
+        if not os.path.exists(path):
+            return False
+        if not self.is_valid(path):
+            logger.warning('Removing corrupt cached PanSTARRS cutout %s', path)
+            self.remove(path)
+            return False
+        shutil.copyfile(path, destination)
+        os.utime(path)   # the modification time orders the cutouts for eviction
+        return True
+
+    def put(self, url, source):
+        """
+        Stores a copy of the downloaded cutout ``source`` as the cutout of ``url``. Call ``evict`` once a batch of
+        cutouts has been stored to bring the cache back under ``max_bytes``.
+        """
+        path = self.path(self.key(url))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f'{path}.{threading.get_ident()}.part'
+        shutil.copyfile(source, partial)
+        with open(f'{path}.sha256', 'w') as f:
+            f.write(file_digest(partial))
+        os.replace(partial, path)
+
+    def remove(self, path):
+        for name in (path, f'{path}.sha256'):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """
+        Removes the least recently used cutouts until the cache holds at most ``max_bytes``.
+
+        :returns: number of cutouts removed
+        :rtype: int
+        """
+        with self.lock:
+            entries = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith('.fits'):
+                        stat = os.stat(os.path.join(root, name))
+                        entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self.remove(path)
+                total -= size
+                removed += 1
+            return removed
@@ -0,0 +1,80 @@
+"""
+Registry of the TOM's facilities indexed by the FITS header keywords that identify their data, so the facility of a
+file is found without instantiating every facility class for it.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from tom_observations.facility import BaseObservationFacility, get_service_classes
+
+# header keywords facilities are identified by
+INDEXED_KEYWORDS = ('TELESCOP', 'INSTRUME', 'ORIGIN')
+
+
+def header_rule(facility):
+    """
+    Returns the ``(keyword, value)`` a facility's ``is_fits_facility`` compares the header with, if it is one of the
+    ``INDEXED_KEYWORDS`` (as for the OCS facilities, e.g. ``('ORIGIN', 'LCOGT')``), otherwise None.
+    """
+    facility_settings = getattr(facility, 'facility_settings', None)
+    try:
+        keyword = facility_settings.get_fits_facility_header_keyword()
+        value = facility_settings.get_fits_facility_header_value()
+    except AttributeError:
+        return None
+    return (keyword, value) if keyword in INDEXED_KEYWORDS else None
+
+
+class FacilityRegistry:
+    """
+    Instances of the facilities of ``get_service_classes()``, built once. Facilities that identify their data by one
+    of the ``INDEXED_KEYWORDS`` are indexed by its value; the others are asked with ``is_fits_facility``, unless they
+    keep the default one, which matches no header.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.unindexed = []
+        for order, clazz in enumerate(get_service_classes().values()):
+            facility = clazz()
+            if type(facility).is_fits_facility is BaseObservationFacility.is_fits_facility:
+                continue
+            rule = header_rule(facility)
+            if rule is None:
+                self.unindexed.append((order, facility))
+            else:
+                self.index.setdefault(rule, []).append((order, facility))
+
+    def get_facility(self, header):
+        """
+        Returns the facility a FITS header is from, or None. As when every facility is asked in turn, the first
+        facility in ``TOM_FACILITY_CLASSES`` whose ``is_fits_facility`` matches the header is returned.
+        """
+        candidates = list(self.unindexed)
+        for keyword in INDEXED_KEYWORDS:
+            if keyword in header:
+                candidates += self.index.get((keyword, header[keyword]), [])
+        for _, facility in sorted(candidates, key=lambda candidate: candidate[0]):
+            if facility.is_fits_facility(header):
+                return facility
+        return None
+
+
+@lru_cache(maxsize=1)
+def build_registry(facility_classes):
+    return FacilityRegistry()
+
+
+def get_registry():
+    """
+    Returns the ``FacilityRegistry`` of the facilities in ``settings.TOM_FACILITY_CLASSES``, built on first use.
+    """
+    return build_registry(tuple(getattr(settings, 'TOM_FACILITY_CLASSES', ())))
+
+
+@receiver(setting_changed)
+def clear_registry(setting, **kwargs):
+    if setting in ('TOM_FACILITY_CLASSES', 'FACILITIES'):
+        build_registry.cache_clear()
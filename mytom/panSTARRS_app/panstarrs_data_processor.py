@@ -1,7 +1,12 @@
+import logging
 import mimetypes
+import warnings
+
+import numpy as np
 
 
 from django.conf import settings
+from django.db import transaction
 from importlib import import_module
 
 from tom_dataproducts.models import ReducedDatum
@@ -11,15 +16,25 @@ from astropy import units
 from astropy.io import ascii, fits
 from astropy.time import Time, TimezoneInfo
 from astropy.wcs import WCS
+from astropy.wcs.utils import proj_plane_pixel_scales
 from specutils import Spectrum1D
 from datetime import datetime
 
 from tom_dataproducts.data_processor import DataProcessor
 from tom_dataproducts.exceptions import InvalidFileFormatException
 from tom_dataproducts.processors.data_serializers import SpectrumSerializer
-from tom_observations.facility import get_service_class, get_service_classes
+from tom_observations.facility import get_service_class
+
+from mytom.fits_access import data_shape, get_header, open_fits, read_header_and_section
+from mytom.ingestion import bulk_ingest, chunked, times_to_datetimes
+
+from .facility_registry import get_registry
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_DATA_PROCESSOR_CLASS = 'panSTARRS_app.panstarrs_data_processor.MyDataProcessor'
+# cutouts measured in one array pass
+PHOTOMETRY_BATCH_SIZE = 256
 
 def run_data_processor(dp):
 
@@ -37,14 +52,12 @@ def run_data_processor(dp):
 
     data_processor = clazz()
     data = data_processor.process_data(dp)   # calls for custom data processor
+    # images are measured into photometry, anything else is processed as a spectrum
+    data_type = getattr(data_processor, 'data_type', 'spectroscopy')
 
     try:
-
-        target = Target.objects.filter(target = dp.target)
-
-        reduced_datums = [ReducedDatum(target=target, data_product=dp, data_type='spectroscopy',
-                                       timestamp=datum[0], value=datum[1], source_name=datum[2]) for datum in data]
-        ReducedDatum.objects.bulk_create(reduced_datums)
+        bulk_ingest(dp.target, (datum[0] for datum in data), (datum[1] for datum in data),
+                    source_name='PanSTARRS', data_type=data_type, data_product=dp)
 
         return ReducedDatum.objects.filter(data_product=dp)
 
@@ -52,6 +65,245 @@ def run_data_processor(dp):
         return False
 
 
+def get_setting(key, default):
+    return settings.BROKERS.get('panstarrs', {}).get(key, default)
+
+
+def is_image(header):
+    """
+    Whether a FITS header describes a 2-D image with a celestial WCS, such as a PanSTARRS cutout.
+    """
+    return header.get('NAXIS') == 2 and str(header.get('CTYPE1', '')).startswith('RA')
+
+
+def linearize(data, header):
+    """
+    Undoes the asinh compression of PanSTARRS skycell images, whose headers hold ``BSOFTEN`` and ``BOFFSET``. Other
+    images are returned unchanged.
+    """
+    if 'BSOFTEN' not in header or 'BOFFSET' not in header:
+        return data
+    return header['BOFFSET'] + header['BSOFTEN'] * 2 * np.sinh(data / (2.5 / np.log(10)))
+
+
+def celestial_wcs(header):
+    """
+    Builds the celestial WCS of an image from its WCS keywords only. PanSTARRS headers hold hundreds of other cards
+    and the deprecated ``PC001001`` form of the ``PCi_j`` keywords, which make ``WCS(header)`` far slower.
+    """
+    cards = []
+    for axis in (1, 2):
+        cards += [(f'{key}{axis}', header[f'{key}{axis}']) for key in ('CTYPE', 'CRVAL', 'CRPIX', 'CDELT', 'CUNIT')
+                  if f'{key}{axis}' in header]
+        for other in (1, 2):
+            for key in (f'PC{axis}_{other}', f'PC{axis:03d}{other:03d}', f'CD{axis}_{other}'):
+                if key in header:
+                    cards.append((key.replace(f'{axis:03d}{other:03d}', f'{axis}_{other}'), header[key]))
+    cards += [(key, header[key]) for key in ('RADESYS', 'EQUINOX', 'LONPOLE', 'LATPOLE') if key in header]
+    return WCS(fits.Header(cards), naxis=2)
+
+
+def read_stamp(hdu, x, y, half_size):
+    """
+    Reads the ``2 * half_size + 1`` pixel square of an image HDU centred on the pixel nearest to ``(x, y)``, through
+    its section so only those rows are read from disk. Parts of the square that fall outside the image are NaN.
+
+    :returns: the linearized stamp and the offsets of ``(x, y)`` from its central pixel
+    :rtype: tuple
+    """
+    ny, nx = data_shape(hdu.header)
+    cx, cy = int(round(x)), int(round(y))
+    stamp = np.full((2 * half_size + 1, 2 * half_size + 1), np.nan, dtype=np.float32)
+    x0, x1 = max(cx - half_size, 0), min(cx + half_size + 1, nx)
+    y0, y1 = max(cy - half_size, 0), min(cy + half_size + 1, ny)
+    if x0 < x1 and y0 < y1:
+        # unscaled data is sliced straight from the memory map; the section reads scaled data row by row
+        scaled = hdu.header.get('BSCALE', 1) != 1 or hdu.header.get('BZERO', 0) != 0
+        region = hdu.section[y0:y1, x0:x1] if scaled else hdu.data[y0:y1, x0:x1]
+        stamp[y0 - cy + half_size:y1 - cy + half_size, x0 - cx + half_size:x1 - cx + half_size] = region
+    return linearize(stamp, hdu.header), x - cx, y - cy
+
+
+def aperture_photometry(stamps, dx, dy, radius, inner, outer):
+    """
+    Measures the flux in a circular aperture around a position in each of a stack of stamps at once, less the median
+    sky of an annulus around it.
+
+    :param stamps: square stamps centred on the pixel nearest to each position
+    :type stamps: numpy.ndarray of shape (n, size, size)
+
+    :param dx: offsets of the positions from the central pixels, in pixels
+    :type dx: numpy.ndarray
+
+    :param radius: aperture radius of each stamp, in pixels; ``inner`` and ``outer`` bound the sky annulus
+    :type radius: numpy.ndarray
+
+    :returns: flux, its uncertainty from the sky noise, and the number of aperture pixels of each stamp
+    :rtype: tuple
+    """
+    half_size = stamps.shape[1] // 2
+    y, x = np.mgrid[-half_size:half_size + 1, -half_size:half_size + 1]
+    distance = np.hypot(x[None] - dx[:, None, None], y[None] - dy[:, None, None])
+    finite = np.isfinite(stamps)
+
+    in_aperture = (distance <= radius[:, None, None]) & finite
+    in_annulus = (distance >= inner[:, None, None]) & (distance <= outer[:, None, None]) & finite
+    sky_pixels = np.where(in_annulus, stamps, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)   # an annulus off the image gives NaN
+        sky = np.nanmedian(sky_pixels, axis=(1, 2))
+        sky_sigma = 1.4826 * np.nanmedian(np.abs(sky_pixels - sky[:, None, None]), axis=(1, 2))
+
+    n_aperture = in_aperture.sum(axis=(1, 2))
+    n_sky = in_annulus.sum(axis=(1, 2))
+    flux = np.where(in_aperture, stamps, 0).sum(axis=(1, 2)) - n_aperture * sky
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = n_aperture * sky_sigma ** 2 * (1 + n_aperture / n_sky)
+    return flux, np.sqrt(variance), n_aperture
+
+
+def photometry_values(flux, flux_error, zeropoint, filters, snr_limit):
+    """
+    Converts fluxes to ``ReducedDatum`` values like the ZTF ones: ``{'magnitude', 'error', 'filter'}`` when the
+    flux is at least ``snr_limit`` times its uncertainty, otherwise the ``{'limit', 'filter'}`` of ``snr_limit`` times
+    the uncertainty.
+    """
+    values = []
+    for f, e, zp, band in zip(flux, flux_error, zeropoint, filters):
+        if np.isfinite(f) and e > 0 and f >= snr_limit * e:
+            values.append({'magnitude': float(zp - 2.5 * np.log10(f)),
+                           'error': float(2.5 / np.log(10) * e / f), 'filter': band})
+        elif np.isfinite(e) and e > 0:
+            values.append({'limit': float(zp - 2.5 * np.log10(snr_limit * e)), 'filter': band})
+        else:
+            values.append(None)
+    return values
+
+
+def cutout_stamp(hdu, ra, dec, outer):
+    """
+    Reads what ``measure_stamps`` needs from a cutout HDU: the stamp around ``(ra, dec)``, large enough for a sky
+    annulus of ``outer`` arcseconds, with the offsets of the position from its central pixel, the pixel scale in
+    arcseconds, and the time, zero point and filter of the image. Stack cutouts are in counts, so their zero point is
+    ``FPA.ZP`` plus ``2.5 log10(EXPTIME)``.
+
+    Everything is read from the header here, so a cutout with a missing or malformed keyword raises for itself rather
+    than for the whole batch in ``measure_stamps``.
+
+    :rtype: dict
+    """
+    header = hdu.header
+    wcs = celestial_wcs(header)
+    x, y = wcs.all_world2pix(ra, dec, 0)
+    scale = proj_plane_pixel_scales(wcs).mean() * 3600
+    stamp, dx, dy = read_stamp(hdu, float(x), float(y), int(np.ceil(outer / scale)) + 1)
+    return {'stamp': stamp, 'dx': dx, 'dy': dy, 'scale': scale, 'mjd': float(header['MJD-OBS']),
+            'zeropoint': float(header.get('FPA.ZP', 25.0)) + 2.5 * np.log10(float(header.get('EXPTIME', 1.0))),
+            'filter': 'PS1_' + str(header.get('FPA.FILTER', '')).split('.')[0]}
+
+
+def measure_stamps(stamps, aperture, annulus, snr_limit):
+    """
+    Measures the stamps of ``cutout_stamp`` in one array pass.
+
+    :returns: ``(timestamp, value)`` of each stamp, with a value of None if the stamp could not be measured
+    :rtype: list
+    """
+    if not stamps:
+        return []
+    inner, outer = annulus
+    # stamps differ in size only if the pixel scales do; pad them to one size to measure them together
+    size = max(stamp['stamp'].shape[0] for stamp in stamps)
+    stack = np.full((len(stamps), size, size), np.nan, dtype=np.float32)
+    for i, stamp in enumerate(stamps):
+        pad = (size - stamp['stamp'].shape[0]) // 2
+        stack[i, pad:size - pad, pad:size - pad] = stamp['stamp']
+    dx = np.array([stamp['dx'] for stamp in stamps])
+    dy = np.array([stamp['dy'] for stamp in stamps])
+    scales = np.array([stamp['scale'] for stamp in stamps])
+    flux, flux_error, _ = aperture_photometry(stack, dx, dy, aperture / scales, inner / scales, outer / scales)
+
+    timestamps = times_to_datetimes([stamp['mjd'] for stamp in stamps], format='mjd')
+    values = photometry_values(flux, flux_error, [stamp['zeropoint'] for stamp in stamps],
+                               [stamp['filter'] for stamp in stamps], snr_limit)
+    return list(zip(timestamps, values))
+
+
+def cutout_photometry(data_products, aperture=None, annulus=None, snr_limit=None):
+    """
+    Forced aperture photometry of the target of each PanSTARRS cutout at its position in the cutout's WCS. A small
+    stamp around each target is read through a memory map, and all the stamps are measured in one array pass.
+
+    :param aperture: aperture radius in arcseconds, defaults to ``APERTURE`` in ``settings.BROKERS['panstarrs']``
+        or 2
+    :type aperture: float
+
+    :param annulus: inner and outer radius of the sky annulus in arcseconds, defaults to ``ANNULUS`` or (5, 8)
+    :type annulus: tuple
+
+    :param snr_limit: signal-to-noise ratio below which an upper limit is stored, defaults to ``SNR_LIMIT`` or 3
+    :type snr_limit: float
+
+    :returns: ``(timestamp, value)`` of each data product, or None for a cutout that could not be measured
+    :rtype: list
+    """
+    aperture = aperture or get_setting('APERTURE', 2.0)
+    annulus = annulus or get_setting('ANNULUS', (5.0, 8.0))
+    snr_limit = snr_limit or get_setting('SNR_LIMIT', 3)
+
+    measured, stamps = [], []
+    for index, dp in enumerate(data_products):
+        try:
+            with open_fits(dp) as hdul:   # the header and the stamp are read from one open of the file
+                stamps.append(cutout_stamp(hdul[0], dp.target.ra, dp.target.dec, annulus[1]))
+            measured.append(index)
+        except Exception:
+            logger.exception('Could not read the cutout %s', dp)
+
+    results = [None] * len(data_products)
+    for index, (timestamp, value) in zip(measured, measure_stamps(stamps, aperture, annulus, snr_limit)):
+        if value is not None:
+            results[index] = (timestamp, value)
+    return results
+
+
+def run_photometry(data_products, batch_size=None):
+    """
+    Measures the PanSTARRS cutouts with ``cutout_photometry`` in batches of ``batch_size`` and stores one photometry
+    ``ReducedDatum`` per cutout in a single transaction, replacing any earlier ones.
+
+    :returns: the data products that could not be measured
+    :rtype: list
+    """
+    batch_size = batch_size or PHOTOMETRY_BATCH_SIZE
+    failed = []
+    with transaction.atomic():
+        for chunk in chunked(data_products, batch_size):
+            ReducedDatum.objects.filter(data_product__in=chunk).delete()
+            datums = []
+            for dp, result in zip(chunk, cutout_photometry(chunk)):
+                if result is None:
+                    failed.append(dp)
+                    continue
+                datums.append(ReducedDatum(target=dp.target, data_product=dp, data_type='photometry',
+                                           timestamp=result[0], value=result[1], source_name='PanSTARRS'))
+            ReducedDatum.objects.bulk_create(datums)
+    return failed
+
+
+def spectrum_section(header):
+    """
+    Returns the index of the first spectrum of an HDU: the first row of the first plane of a cube, the first row of
+    a 2-D array of two rows, or the whole array.
+    """
+    shape = data_shape(header)
+    if len(shape) == 3:
+        return 0, 0, slice(None)
+    if shape[0] == 2:
+        return 0, slice(None)
+    return ()
+
+
 class MyDataProcessor():
 
     FITS_MIMETYPES = ['image/fits', 'application/fits']
@@ -67,7 +319,9 @@ class MyDataProcessor():
 
     def process_data(self, data_product):
         """
-        Routes a spectroscopy processing call to a method specific to a file-format, then serializes the returned data.
+        Measures images of the sky, such as PanSTARRS cutouts, with ``cutout_photometry`` and sets ``data_type`` to
+        photometry. Routes a spectroscopy processing call to a method specific to a file-format, then serializes the
+        returned data.
 
         :param data_product: Spectroscopic DataProduct which will be processed into the specified format for database
         ingestion
@@ -78,6 +332,14 @@ class MyDataProcessor():
         """
 
         mimetype = 'image/fits'
+
+        if is_image(get_header(data_product)):
+            self.data_type = 'photometry'
+            photometry, = cutout_photometry([data_product])
+            if photometry is None:
+                raise InvalidFileFormatException('The target could not be measured in this image')
+            return [photometry]
+        self.data_type = 'spectroscopy'
         print(f"this is the mimetype: {mimetype}")
         print("")
         print(f"this is our dataproduct: {data_product}")
@@ -113,24 +375,17 @@ class MyDataProcessor():
         :rtype: AstroPy.Time
         """
 
-        flux = fits.getdata(data_product)
-        header = fits.getheader(data_product)
+        # only the spectrum is read from the file, not the whole array, through the same open as the header
+        header, flux = read_header_and_section(data_product, spectrum_section)
 
-        for facility_class in get_service_classes():
-            facility = get_service_class(facility_class)()
-            if facility.is_fits_facility(header):
-                flux_constant = facility.get_flux_constant()
-                date_obs = facility.get_date_obs_from_fits_header(header)
-                break
+        facility = get_registry().get_facility(header)   # the facilities are built once, not for every file
+        if facility is not None:
+            flux_constant = facility.get_flux_constant()
+            date_obs = facility.get_date_obs_from_fits_header(header)
         else:
             flux_constant = self.DEFAULT_FLUX_CONSTANT
             date_obs = datetime.now()
 
-        dim = len(flux.shape)
-        if dim == 3:
-            flux = flux[0, 0, :]
-        elif flux.shape[0] == 2:
-            flux = flux[0, :]
         flux = flux * flux_constant
 
         header['CUNIT1'] = 'Angstrom'
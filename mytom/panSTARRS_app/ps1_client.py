@@ -0,0 +1,190 @@
+"""
+Client for the PanSTARRS image cutout service (https://ps1images.stsci.edu/ps1image.html).
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import StringIO
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from astropy.table import Table
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://ps1images.stsci.edu'
+TIMEOUT = 120
+
+# cutouts downloaded at the same time, unless MAX_WORKERS is set in settings.BROKERS['panstarrs']
+MAX_WORKERS = 8
+# bytes read from a response and written to its file at a time
+CHUNK_SIZE = 64 * 1024
+
+
+def get_setting(key, default):
+    return settings.BROKERS.get('panstarrs', {}).get(key, default)
+
+
+def get_base_url():
+    return get_setting('BASEURL', DEFAULT_BASE_URL).rstrip('/')
+
+
+def make_session(max_workers=None):
+    """
+    Returns a ``requests.Session`` whose connection pool keeps a connection to the service open for each of
+    ``max_workers`` threads, so concurrent downloads reuse them instead of connecting again for every cutout.
+    """
+    max_workers = max_workers or get_setting('MAX_WORKERS', MAX_WORKERS)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def getimages(tra, tdec, size=240, filters="grizy", format="fits", imagetypes="stack", session=None):
+    """Query ps1filenames.py service for multiple positions to get a list of images
+    This adds a url column to the table to retrieve the cutout.
+
+    tra, tdec = list of positions in degrees
+    size = image size in pixels (0.25 arcsec/pixel)
+    filters = string with filters to include
+    format = data format (options are "fits", "jpg", or "png")
+    imagetypes = list of any of the acceptable image types.  Default is stack;
+        other common choices include warp (single-epoch images), stack.wt (weight image),
+        stack.mask, stack.exp (exposure time), stack.num (number of exposures),
+        warp.wt, and warp.mask.  This parameter can be a list of strings or a
+        comma-separated string.
+    session = optional requests.Session the query is sent with
+
+    Returns an astropy table with the results
+    """
+
+    if format not in ("jpg", "png", "fits"):
+        raise ValueError("format must be one of jpg, png, fits")
+    # if imagetypes is a list, convert to a comma-separated string
+    if not isinstance(imagetypes, str):
+        imagetypes = ",".join(imagetypes)
+    # put the positions in an in-memory file object
+    cbuf = StringIO()
+    cbuf.write('\n'.join(["{} {}".format(ra, dec) for (ra, dec) in zip(tra, tdec)]))
+    cbuf.seek(0)
+    # use requests.post to pass in positions as a file
+    session = session or requests
+    r = session.post(f'{get_base_url()}/cgi-bin/ps1filenames.py', data=dict(filters=filters, type=imagetypes),
+                     files=dict(file=cbuf), timeout=TIMEOUT)
+    r.raise_for_status()
+    tab = Table.read(r.text, format="ascii")
+
+    urlbase = "{}/cgi-bin/fitscut.cgi?size={}&format={}".format(get_base_url(), size, format)
+    tab["url"] = ["{}&ra={}&dec={}&red={}".format(urlbase, ra, dec, filename)
+                  for (filename, ra, dec) in zip(tab["filename"], tab["ra"], tab["dec"])]
+    return tab
+
+
+def cutout_filename(row):
+    """
+    Returns the name a cutout is stored under, e.g. ``t258.8289+4.9639.r.fits``.
+    """
+    return "t{:08.4f}{:+07.4f}.{}.fits".format(row['ra'], row['dec'], row['filter'])
+
+
+def download_cutout(url, path, session=None, chunk_size=CHUNK_SIZE):
+    """
+    Streams a cutout to ``path`` ``chunk_size`` bytes at a time, so the whole image is never held in memory. The file
+    is written under a temporary name and renamed when it is complete, so an interrupted download leaves no partial
+    cutout behind.
+
+    :returns: ``path``
+    :rtype: str
+    """
+    session = session or requests
+    partial = f'{path}.part'
+    try:
+        with session.get(url, stream=True, timeout=TIMEOUT) as response:
+            response.raise_for_status()
+            with open(partial, 'wb') as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return path
+
+
+def fetch_cutout(row, path, session=None, cache=None):
+    """
+    Copies the cutout of a ``getimages`` table row to ``path`` from the cache if it is there, otherwise downloads it
+    and adds it to the cache if its image type never changes.
+
+    :returns: ``path``
+    :rtype: str
+    """
+    cacheable = cache is not None and cache.is_cacheable(row)
+    if cacheable and cache.get(row['url'], path):
+        return path
+    download_cutout(row['url'], path, session)
+    if cacheable:
+        cache.put(row['url'], path)
+    return path
+
+
+def download_cutouts(table, directory, session=None, max_workers=None, on_progress=None, cache=None):
+    """
+    Downloads the cutouts of the rows of a ``getimages`` table into ``directory`` at the same time, over at most
+    ``max_workers`` connections of one keep-alive session. The downloads are started in the order of the table, so a
+    table sorted by skycell keeps the server's file cache warm.
+
+    :param table: rows with the ``url``, ``ra``, ``dec`` and ``filter`` of each cutout
+    :type table: astropy.table.Table
+
+    :param max_workers: concurrent downloads, defaults to ``MAX_WORKERS``
+    :type max_workers: int
+
+    :param on_progress: called with the number of cutouts downloaded so far and the total after each download
+    :type on_progress: callable
+
+    :param cache: cache the cutouts are taken from when they are in it and added to when they are not
+    :type cache: panSTARRS_app.cutout_cache.CutoutCache
+
+    :returns: path of each cutout, in the order of ``table``
+    :rtype: list
+    """
+    max_workers = max_workers or get_setting('MAX_WORKERS', MAX_WORKERS)
+    session = session or make_session(max_workers)
+    os.makedirs(directory, exist_ok=True)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_cutout, row, os.path.join(directory, cutout_filename(row)), session, cache)
+                   for row in table]
+        for done, _ in enumerate(as_completed(futures), 1):
+            if on_progress:
+                on_progress(done, len(futures))
+        paths = [future.result() for future in futures]
+    if cache is not None:
+        cache.evict()
+    logger.info('Downloaded %d PanSTARRS cutouts in %.1f s', len(paths), time.perf_counter() - start)
+    return paths
+
+
+def match_targets(table, targets):
+    """
+    Returns the index in ``targets`` of the target each row of a ``getimages`` table was listed for: the target
+    nearest to the position the service echoed in the row.
+
+    :rtype: numpy.ndarray
+    """
+    if not len(table):
+        return np.array([], dtype=int)
+    ra = np.array([target.ra for target in targets], dtype=float)
+    dec = np.array([target.dec for target in targets], dtype=float)
+    # RA differences wrap around 0 and shrink towards the poles
+    dra = (np.asarray(table['ra'], dtype=float)[:, None] - ra[None, :] + 180) % 360 - 180
+    ddec = np.asarray(table['dec'], dtype=float)[:, None] - dec[None, :]
+    cos_dec = np.cos(np.radians(np.asarray(table['dec'], dtype=float)))[:, None]
+    return np.argmin((dra * cos_dec) ** 2 + ddec ** 2, axis=1)
@@ -0,0 +1,38 @@
+from tom_targets.models import TargetList
+
+from jobs_app.progress import publish_progress
+
+from .views import panstarrs_target_list_func
+
+
+def cutouts_message(cutouts, failed, description):
+    message = f'{sum(len(dps) for dps in cutouts.values())} PanSTARRS cutouts stored for {description}'
+    if failed:
+        message += f'; {failed} could not be measured'
+    return message
+
+
+def panstarrs_cutouts(job):
+    """
+    ``QueryJob`` task that downloads and processes the PanSTARRS cutouts of ``job.target`` in the ``filters``
+    parameter.
+    """
+    publish_progress(job, stage='Downloading PanSTARRS cutouts')
+    cutouts, failed = panstarrs_target_list_func([job.target], job.parameters['filters'])
+    return cutouts_message(cutouts, failed, job.target.name)
+
+
+def panstarrs_target_list_cutouts(job):
+    """
+    ``QueryJob`` task that downloads and processes the PanSTARRS cutouts in the ``filters`` parameter of every target
+    in the ``target_list`` parameter, with one image lookup for the whole list.
+    """
+    target_list = TargetList.objects.get(pk=job.parameters['target_list'])
+
+    def report(downloaded, total):
+        publish_progress(job, stage=f'{downloaded} of {total} cutouts downloaded', downloaded=downloaded, total=total)
+
+    publish_progress(job, stage='Looking up PanSTARRS images')
+    cutouts, failed = panstarrs_target_list_func(target_list.targets.all(), job.parameters['filters'],
+                                                 on_progress=report)
+    return cutouts_message(cutouts, failed, f'{len(cutouts)} targets of {target_list.name}')
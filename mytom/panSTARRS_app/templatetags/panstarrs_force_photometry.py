@@ -9,6 +9,11 @@ register = template.Library()
 def panstarrs_photometry_buttons(target):
     return {'target': target}
 
-@register.inclusion_tag('tom_targets/partials/js9.html')
+@register.inclusion_tag('panstarrs_app/partials/panstarrs_previews.html')
 def panstarrs_js9(target):
-    return {'target': target}
\ No newline at end of file
+    """
+    Shows the previews of the PanSTARRS cutouts of a target, with the downsampled FITS files opening in JS9, so the
+    page does not load the full cutouts.
+    """
+    cutouts = target.dataproduct_set.filter(product_id__startswith=f'PanSTARRS {target.pk} ').order_by('product_id')
+    return {'target': target, 'cutouts': cutouts}
\ No newline at end of file
@@ -1,3 +1,436 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import numpy as np
+from astropy.io import fits
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.template import Context, Template
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from tom_observations.facilities.lco import LCOFacility
+from tom_observations.facilities.manual import ExampleManualFacility
+from tom_observations.tests.factories import SiderealTargetFactory
+from tom_dataproducts.models import ReducedDatum
+from tom_targets.models import TargetList
+
+from jobs_app.jobs import claim_next_job, run_job
+from jobs_app.models import QueryJob
+from mytom.fits_access import get_header, header_key, open_fits, read_section
+from mytom.previews import preview_name
+
+from .cutout_cache import CutoutCache
+from .facility_registry import get_registry
+from .panstarrs_data_processor import MyDataProcessor, celestial_wcs, run_photometry
+from .ps1_client import download_cutouts, getimages, match_targets
+
+FILENAMES_HEADER = 'projcell subcell ra dec filter mjd type filename shortname badflag'
+FILENAMES_ROW = ('2382 46 {ra} {dec} {filter} 0 stack '
+                 '/rings.v3.skycell/2382/046/rings.v3.skycell.2382.046.stk.{filter}.unconv.fits '
+                 'rings.v3.skycell.2382.046.stk.{filter}.unconv.fits 0')
+
+PANSTARRS_SAMPLE = os.path.join(settings.BASE_DIR, 'data', 'Target', 'none', 't360.000089.4000.r.fits')
+
+
+def panstarrs_cutout(size=32, seed=0):
+    """
+    Returns the bytes of a ``size`` x ``size`` pixel PanSTARRS stack cutout, with the header of a real cutout and a
+    point source at the centre of a noisy sky.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[:size, :size]
+    image = rng.normal(0, 5, (size, size)) + 500 * np.exp(-((x - size / 2) ** 2 + (y - size / 2) ** 2) / 8)
+    cutout = BytesIO()
+    fits.PrimaryHDU(image.astype(np.float32), header=fits.getheader(PANSTARRS_SAMPLE)).writeto(cutout)
+    return cutout.getvalue()
+
+
+class StubPS1Handler(BaseHTTPRequestHandler):
+    """
+    Answers like the PanSTARRS cutout service: lists one stack image per requested position and filter and serves
+    the same synthetic cutout for each, ``delay`` seconds after the request. If the server has a ``barrier``, cutouts
+    are served only once that many requests are waiting at it together.
+    """
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/cgi-bin/ps1filenames.py':
+            self.send_error(404)
+            return
+        boundary = '--' + self.headers['Content-Type'].split('boundary=')[1]
+        parts = self.rfile.read(int(self.headers['Content-Length'])).decode().split(boundary)
+        form = {part.split('name="')[1].split('"')[0]: part.split('\r\n\r\n', 1)[1].strip()
+                for part in parts if 'name="' in part}
+        positions = [line.split() for line in form['file'].splitlines()]
+        self.server.lookups.append(positions)
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write('\n'.join([FILENAMES_HEADER] + [FILENAMES_ROW.format(ra=ra, dec=dec, filter=f)
+                                                         for ra, dec in positions
+                                                         for f in form['filters']]).encode())
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/cgi-bin/fitscut.cgi':
+            self.send_error(404)
+            return
+        with self.server.lock:
+            self.server.active += 1
+            self.server.most_active = max(self.server.most_active, self.server.active)
+        if self.server.barrier is not None:
+            self.server.barrier.wait()
+        else:
+            time.sleep(self.server.delay)
+        self.server.cutouts.append(parse_qs(url.query)['red'][0])
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(self.server.cutout)
+        with self.server.lock:
+            self.server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubPS1ServiceMixin:
+    def setUp(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubPS1Handler)
+        server.lock = threading.Lock()
+        server.active = server.most_active = 0
+        server.delay = 0.2
+        server.barrier = None
+        server.cutouts = []
+        server.lookups = []
+        server.cutout = panstarrs_cutout()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.server = server
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        brokers = dict(settings.BROKERS, panstarrs={'BASEURL': f'http://127.0.0.1:{server.server_port}',
+                                                    'CACHE_DIR': os.path.join(self.directory, 'cache')})
+        overrides = override_settings(BROKERS=brokers, MEDIA_ROOT=os.path.join(self.directory, 'media'))
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+
+class TestDownloadCutouts(StubPS1ServiceMixin, SimpleTestCase):
+    def test_cutouts_are_downloaded_concurrently(self):
+        table = getimages([258.8289], [4.9639], filters='grizy')
+        # the cutouts are only served once all five requests are open at once
+        self.server.barrier = threading.Barrier(5, timeout=10)
+
+        paths = download_cutouts(table, os.path.join(self.directory, 'cutouts'), max_workers=5)
+
+        self.assertEqual([os.path.basename(path) for path in paths],
+                         [f't258.8289+4.9639.{f}.fits' for f in 'grizy'])
+        for path in paths:
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), self.server.cutout)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(paths[0]))),
+                         sorted(os.path.basename(path) for path in paths))
+
+    def test_parallelism_is_bounded(self):
+        table = getimages([258.8289], [4.9639], filters='grizy')
+
+        download_cutouts(table, self.directory, max_workers=2)
+
+        self.assertLessEqual(self.server.most_active, 2)
+        self.assertEqual(len(self.server.cutouts), 5)
+
+
+class TestCutoutCache(StubPS1ServiceMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server.delay = 0
+        cache_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_directory.cleanup)
+        self.cache = CutoutCache(cache_directory.name)
+
+    def test_cached_cutouts_are_not_downloaded_again(self):
+        table = getimages([258.8289], [4.9639], filters='gri')
+        download_cutouts(table, os.path.join(self.directory, 'first'), cache=self.cache)
+
+        paths = download_cutouts(table, os.path.join(self.directory, 'second'), cache=self.cache)
+
+        self.assertEqual(len(self.server.cutouts), 3)
+        for path in paths:
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), self.server.cutout)
+
+    def test_corrupt_cutout_is_downloaded_again(self):
+        table = getimages([258.8289], [4.9639], filters='r')
+        download_cutouts(table, self.directory, cache=self.cache)
+        cached = self.cache.path(self.cache.key(table[0]['url']))
+        with open(cached, 'r+b') as f:
+            f.write(b'X')
+
+        path, = download_cutouts(table, self.directory, cache=self.cache)
+
+        self.assertEqual(len(self.server.cutouts), 2)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.server.cutout)
+        self.assertTrue(self.cache.is_valid(cached))
+
+    def test_least_recently_used_cutouts_are_evicted(self):
+        self.cache.max_bytes = 2 * len(self.server.cutout)
+        table = getimages([258.8289], [4.9639], filters='gri')
+        paths = [self.cache.path(self.cache.key(url)) for url in table['url']]
+        for row in table:
+            download_cutouts(table[[row.index]], self.directory, cache=self.cache)
+            os.utime(self.cache.path(self.cache.key(row['url'])), (row.index, row.index))   # g is the oldest
+
+        self.assertEqual([os.path.exists(path) for path in paths], [False, True, True])
+
+    def test_only_stacks_are_cached(self):
+        table = getimages([258.8289], [4.9639], filters='r')
+        table['type'] = 'warp'
+
+        download_cutouts(table, self.directory, cache=self.cache)
+        download_cutouts(table, self.directory, cache=self.cache)
+
+        self.assertEqual(len(self.server.cutouts), 2)
+
+
+class TestTargetListCutouts(StubPS1ServiceMixin, TestCase):
+    def test_target_list_is_looked_up_at_once(self):
+        targets = [SiderealTargetFactory.create(ra=ra, dec=dec) for ra, dec in ((359.9999, 10.0), (0.0002, 10.0),
+                                                                                 (120.5, -30.25))]
+
+        table = getimages([target.ra for target in targets], [target.dec for target in targets], filters='gr')
+        table.sort(['projcell', 'subcell', 'filter'])
+
+        self.assertEqual(len(self.server.lookups), 1)
+        self.assertEqual(len(self.server.lookups[0]), 3)
+        self.assertEqual([targets[index] for index in match_targets(table, targets)],
+                         [targets[0], targets[1], targets[2]] * 2)
+
+    def test_view_queues_one_job(self):
+        user = User.objects.create_superuser(username='admin')
+        self.client.force_login(user)
+        target_list = TargetList.objects.create(name='watch list')
+        target_list.targets.add(*[SiderealTargetFactory.create() for _ in range(3)])
+
+        response = self.client.post(reverse('panSTARRS_app:targetlist-panstarrsquery', args=[target_list.pk]),
+                                    {'Filter': 'grizy'})
+
+        self.assertRedirects(response, reverse('tom_targets:targetgrouping'), fetch_redirect_response=False)
+        job = QueryJob.objects.get()
+        self.assertEqual(job.task, 'panSTARRS_app.tasks.panstarrs_target_list_cutouts')
+        self.assertEqual(job.parameters, {'target_list': target_list.pk, 'filters': 'grizy'})
+
+    def test_cutouts_are_stored_as_data_products(self):
+        self.server.delay = 0
+        target_list = TargetList.objects.create(name='watch list')
+        targets = [SiderealTargetFactory.create(ra=10.0, dec=20.0), SiderealTargetFactory.create(ra=30.0, dec=40.0)]
+        target_list.targets.add(*targets)
+        QueryJob.objects.create(task='panSTARRS_app.tasks.panstarrs_target_list_cutouts',
+                                parameters={'target_list': target_list.pk, 'filters': 'gri'})
+        files_before = os.listdir(os.getcwd())
+
+        run_job(claim_next_job())
+        run_job(QueryJob.objects.create(task='panSTARRS_app.tasks.panstarrs_cutouts', target=targets[0],
+                                        parameters={'filters': 'gri'}))
+
+        self.assertEqual(os.listdir(os.getcwd()), files_before)
+        self.assertEqual(len(self.server.cutouts), 6)   # the second query is answered from the cache
+        for target in targets:
+            dps = target.dataproduct_set.order_by('product_id')
+            self.assertEqual([os.path.basename(dp.data.name) for dp in dps],
+                             [f't{target.ra:08.4f}{target.dec:07.4f}.{f}.fits' for f in 'gir'])   # storage drops '+'
+            self.assertEqual({dp.data_product_type for dp in dps}, {'fits_file'})
+            for dp in dps:
+                with dp.data.open('rb') as f:
+                    self.assertEqual(f.read(), self.server.cutout)
+        self.assertEqual(QueryJob.objects.filter(task='mytom.tasks.render_previews').count(), 9)
+        job = QueryJob.objects.get(task='panSTARRS_app.tasks.panstarrs_target_list_cutouts')
+        self.assertEqual(job.status, QueryJob.COMPLETED)
+        self.assertTrue(job.message.startswith('6 PanSTARRS cutouts stored for 2 targets of watch list'))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestFITSAccess(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'spectrum.fits')
+        self.cube = np.arange(3 * 2 * 100, dtype=np.float32).reshape(3, 2, 100)
+        header = fits.Header({'CRVAL1': 4000.0, 'CDELT1': 2.0, 'CRPIX1': 1.0, 'CTYPE1': 'WAVE'})
+        fits.PrimaryHDU(self.cube, header=header).writeto(self.path)
+
+    def test_section_is_read(self):
+        np.testing.assert_array_equal(read_section(self.path, (0, 0, slice(None))), self.cube[0, 0])
+        np.testing.assert_array_equal(read_section(self.path, (slice(1, 3), 1, slice(10, 20))), self.cube[1:3, 1, 10:20])
+
+    def test_header_is_cached_until_the_file_changes(self):
+        self.assertEqual(get_header(self.path)['CRVAL1'], 4000.0)
+        self.assertIsNotNone(cache.get(header_key(self.path, 0)))
+        self.assertNotIn(self.path, header_key(self.path, 0))   # paths may hold characters memcached rejects
+
+        fits.PrimaryHDU(self.cube, header=fits.Header({'CRVAL1': 5000.0})).writeto(self.path, overwrite=True)
+        os.utime(self.path, ns=(0, 0))
+
+        self.assertEqual(get_header(self.path)['CRVAL1'], 5000.0)
+
+    def test_spectrum_of_a_cube(self):
+        with mock.patch('mytom.fits_access.open_fits', wraps=open_fits) as opened:
+            spectrum, _ = MyDataProcessor()._process_spectrum_from_fits(self.path)
+
+        self.assertEqual(opened.call_count, 1)   # the header and the spectrum are read together
+        self.assertIsNotNone(cache.get(header_key(self.path, 0)))
+
+        np.testing.assert_array_equal(spectrum.flux.value, self.cube[0, 0])
+        self.assertAlmostEqual(spectrum.spectral_axis[1].to_value('Angstrom'), 4002.0)
+
+
+class InstrumentFacility(ExampleManualFacility):
+    name = 'Instrument'
+
+    def is_fits_facility(self, header):
+        return header.get('INSTRUME', '').startswith('spectrograph')
+
+
+@override_settings(TOM_FACILITY_CLASSES=['tom_observations.facilities.gemini.GEMFacility',
+                                         'panSTARRS_app.tests.InstrumentFacility',
+                                         'tom_observations.facilities.lco.LCOFacility',
+                                         'tom_observations.facilities.soar.SOARFacility'])
+class TestFacilityRegistry(SimpleTestCase):
+    def test_facility_is_found_from_the_header(self):
+        registry = get_registry()
+
+        self.assertIs(type(registry.get_facility(fits.Header({'ORIGIN': 'LCOGT'}))), LCOFacility)   # listed first
+        self.assertIsInstance(registry.get_facility(fits.Header({'INSTRUME': 'spectrograph 2'})), InstrumentFacility)
+        # facilities are asked in the order of TOM_FACILITY_CLASSES
+        self.assertIsInstance(registry.get_facility(fits.Header({'ORIGIN': 'LCOGT', 'INSTRUME': 'spectrograph'})),
+                              InstrumentFacility)
+        self.assertIsNone(registry.get_facility(fits.Header({'ORIGIN': 'elsewhere', 'TELESCOP': 'LCOGT'})))
+
+    def test_facilities_are_built_once(self):
+        registry = get_registry()
+        with mock.patch.object(LCOFacility, '__init__', side_effect=AssertionError):
+            for _ in range(1000):
+                registry.get_facility(fits.Header({'ORIGIN': 'LCOGT'}))
+            self.assertIs(get_registry(), registry)
+
+
+class TestPreviews(StubPS1ServiceMixin, TestCase):
+    def test_previews_are_rendered_in_the_background(self):
+        self.server.delay = 0
+        target = SiderealTargetFactory.create(ra=10.0, dec=20.0)
+        run_job(QueryJob.objects.create(task='panSTARRS_app.tasks.panstarrs_cutouts', target=target,
+                                        parameters={'filters': 'r'}))
+        dp = target.dataproduct_set.get()
+
+        run_job(claim_next_job())
+
+        with default_storage.open(preview_name(dp, format='fits')) as f:
+            preview = fits.getdata(f)
+        self.assertEqual(preview.shape, (32, 32))   # the cutout is already small enough
+        for size in (128, 256, 512):
+            for format in ('jpg', 'png'):
+                self.assertTrue(default_storage.exists(preview_name(dp, size, format)))
+        # the links are built from the recorded previews, without asking the storage
+        with mock.patch.object(default_storage, 'exists', side_effect=AssertionError('storage was asked')):
+            html = Template('{% load panstarrs_force_photometry %}{% panstarrs_js9 target %}').render(
+                Context({'target': target}))
+        self.assertIn(default_storage.url(preview_name(dp, 256, 'jpg')), html)
+        self.assertIn(default_storage.url(preview_name(dp, format='fits')), html)
+        self.assertNotIn(dp.data.url, html)
+
+        dp.delete()
+
+        self.assertFalse(default_storage.exists(preview_name(dp, 128, 'jpg')))
+
+    def test_data_product_deleted_before_its_previews(self):
+        self.server.delay = 0
+        target = SiderealTargetFactory.create(ra=10.0, dec=20.0)
+        run_job(QueryJob.objects.create(task='panSTARRS_app.tasks.panstarrs_cutouts', target=target,
+                                        parameters={'filters': 'r'}))
+        dp = target.dataproduct_set.get()
+        dp.delete()
+
+        job = run_job(claim_next_job())
+
+        self.assertEqual(job.status, QueryJob.COMPLETED)
+        self.assertIn('deleted before its previews were rendered', job.message)
+
+
+class TestCutoutPhotometry(StubPS1ServiceMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.server.delay = 0
+        self.server.cutout = panstarrs_cutout(size=96)   # large enough for the sky annulus
+        header = fits.getheader(BytesIO(self.server.cutout))
+        ra, dec = celestial_wcs(header).all_pix2world(48, 48, 0)   # the source is at the centre
+        self.target = SiderealTargetFactory.create(ra=float(ra), dec=float(dec))
+
+    def test_target_is_measured_in_its_cutouts(self):
+        job = QueryJob.objects.create(task='panSTARRS_app.tasks.panstarrs_cutouts', target=self.target,
+                                      parameters={'filters': 'r'})
+        run_job(job)
+
+        datum = ReducedDatum.objects.get(target=self.target)
+        self.assertEqual(datum.data_type, 'photometry')
+        self.assertEqual(datum.source_name, 'PanSTARRS')
+        self.assertEqual(datum.data_product, self.target.dataproduct_set.get())
+        self.assertEqual(datum.value['filter'], 'PS1_r')
+        self.assertAlmostEqual(datum.value['magnitude'], 22.05, places=1)
+        job.refresh_from_db()
+        self.assertEqual(job.message, f'1 PanSTARRS cutouts stored for {self.target.name}')
+
+    def test_undetected_target_gives_a_limit(self):
+        self.target.dec -= 5 / 3600   # 20 pixels from the source
+        self.target.save()
+        run_job(QueryJob.objects.create(task='panSTARRS_app.tasks.panstarrs_cutouts', target=self.target,
+                                        parameters={'filters': 'r'}))
+        dp = self.target.dataproduct_set.get()
+
+        datum = ReducedDatum.objects.get(target=self.target)
+        self.assertEqual(set(datum.value), {'limit', 'filter'})
+
+        # measuring again replaces the datum
+        self.assertEqual(run_photometry([dp]), [])
+        self.assertEqual(ReducedDatum.objects.filter(data_product=dp).count(), 1)
+
+    def test_target_outside_its_cutout_is_not_measured(self):
+        self.target.dec += 1
+        self.target.save()
+        job = QueryJob.objects.create(task='panSTARRS_app.tasks.panstarrs_cutouts', target=self.target,
+                                      parameters={'filters': 'gr'})
+        run_job(job)
+
+        self.assertFalse(ReducedDatum.objects.filter(target=self.target).exists())
+        job.refresh_from_db()
+        self.assertEqual(job.message, f'2 PanSTARRS cutouts stored for {self.target.name}; 2 could not be measured')
+
+    def test_cutout_without_observation_time_fails_alone(self):
+        run_job(QueryJob.objects.create(task='panSTARRS_app.tasks.panstarrs_cutouts', target=self.target,
+                                        parameters={'filters': 'gr'}))
+        dps = list(self.target.dataproduct_set.order_by('product_id'))
+        with fits.open(dps[0].data.path, mode='update') as hdul:
+            del hdul[0].header['MJD-OBS']
+
+        self.assertEqual(run_photometry(dps), [dps[0]])
+        self.assertEqual([datum.data_product for datum in ReducedDatum.objects.filter(target=self.target)], [dps[1]])
+
+    def test_failing_hook_does_not_fail_the_job(self):
+        job = QueryJob.objects.create(task='panSTARRS_app.tasks.panstarrs_cutouts', target=self.target,
+                                      parameters={'filters': 'r'})
+        with mock.patch('panSTARRS_app.views.run_hook', side_effect=RuntimeError('queue is down')):
+            run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, QueryJob.COMPLETED)
+        self.assertTrue(ReducedDatum.objects.filter(target=self.target).exists())
@@ -8,5 +8,6 @@ app_name = 'panSTARRS_app'
 
 urlpatterns = [
 	path("<int:pk>/panstarrsquery/",views.PanStarrsQueryView.as_view(),name='panstarrsquery'),
+	path('targetlist/<int:pk>/panstarrsquery/', views.PanStarrsTargetListQueryView.as_view(), name='targetlist-panstarrsquery'),
 	path('<int:pk>/', views.TargetDetailView.as_view(),name='detail'),
 ]
\ No newline at end of file
@@ -1,5 +1,7 @@
 import io
+import logging
 import os
+import tempfile
 import subprocess
 import time
 import csv
@@ -14,6 +16,8 @@ from django.forms import HiddenInput
 from django.template import loader
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.conf import settings
+from django.core.files import File
+from django.contrib import messages
 from django.views.generic import RedirectView, TemplateView, View
 from django.views.generic.edit import CreateView, UpdateView, DeleteView, FormMixin
 from django.views.generic.detail import DetailView
@@ -27,21 +31,26 @@ from datetime import datetime
 
 from guardian.mixins import PermissionRequiredMixin
 
+from tom_dataproducts.models import DataProduct, ReducedDatum
 from tom_targets.models import Target, TargetList
+from tom_common.hooks import run_hook
 from tom_common.mixins import Raise403PermissionRequiredMixin
 
+from jobs_app.jobs import enqueue
+
 #from .models import QueryModel
 from .forms import panstarrsQueryForm
-from .panstarrs_data_processor import run_data_processor
+from .panstarrs_data_processor import run_photometry
+from .cutout_cache import CutoutCache
+from .ps1_client import download_cutouts, getimages, make_session, match_targets
 
 from astropy.table import Table
 from astropy.io import fits
 
+logger = logging.getLogger(__name__)
 
-# Create your views here.
 
-ps1filename = "https://ps1images.stsci.edu/cgi-bin/ps1filenames.py"
-fitscut = "https://ps1images.stsci.edu/cgi-bin/fitscut.cgi"
+# Create your views here.
 
 class TargetDetailView(Raise403PermissionRequiredMixin, DetailView):
     """
@@ -123,119 +132,122 @@ class PanStarrsQueryView(View):
         target = Target.objects.get(pk=pk)
 
         if form.is_valid():
-            print(f"This is the Filter: {form.cleaned_data['Filter']}")
-            panstarrs_main_func(self, target, Filter=form.cleaned_data['Filter'])
+            job = enqueue('panSTARRS_app.tasks.panstarrs_cutouts', target=target, user=request.user,
+                          filters=form.cleaned_data['Filter'])
+            messages.info(request, f"PanSTARRS query for {target.name} was queued as job {job.pk}.")
             return HttpResponseRedirect(reverse('tom_targets:detail', args=[pk]))
-        else:
-            form = panstarrsQueryForm()
 
-        return render('panstarrs_query.html', {
+        return render(request, 'panstarrs_query.html', {
+            'target': target,
             'form': form,
         })
 
-#########################################################################################
+class PanStarrsTargetListQueryView(View):
 
-def getimages(tra, tdec, size=240, filters="grizy", format="fits", imagetypes="stack"):
-    """Query ps1filenames.py service for multiple positions to get a list of images
-    This adds a url column to the table to retrieve the cutout.
-
-    tra, tdec = list of positions in degrees
-    size = image size in pixels (0.25 arcsec/pixel)
-    filters = string with filters to include
-    format = data format (options are "fits", "jpg", or "png")
-    imagetypes = list of any of the acceptable image types.  Default is stack;
-        other common choices include warp (single-epoch images), stack.wt (weight image),
-        stack.mask, stack.exp (exposure time), stack.num (number of exposures),
-        warp.wt, and warp.mask.  This parameter can be a list of strings or a
-        comma-separated string.
-
-    Returns an astropy table with the results
-    """
+    def get(self, request, pk, *args, **kwargs):
+        target_list = get_object_or_404(TargetList, pk=pk)
+        context = {
+            'target_list': target_list,
+            'form': panstarrsQueryForm,
+        }
+        return render(request, 'panstarrs_targetlist_query.html', context)
+
+    def post(self, request, pk, *args, **kwargs):
 
-    if format not in ("jpg", "png", "fits"):
-        raise ValueError("format must be one of jpg, png, fits")
-    # if imagetypes is a list, convert to a comma-separated string
-    if not isinstance(imagetypes, str):
-        imagetypes = ",".join(imagetypes)
-    # put the positions in an in-memory file object
-    cbuf = StringIO()
-    cbuf.write('\n'.join(["{} {}".format(ra, dec) for (ra, dec) in zip(tra, tdec)]))
-    cbuf.seek(0)
-    # use requests.post to pass in positions as a file
-    r = requests.post(ps1filename, data=dict(filters=filters, type=imagetypes),
-                      files=dict(file=cbuf))
-    r.raise_for_status()
-    tab = Table.read(r.text, format="ascii")
-
-    urlbase = "{}?size={}&format={}".format(fitscut, size, format)
-    tab["url"] = ["{}&ra={}&dec={}&red={}".format(urlbase, ra, dec, filename)
-                  for (filename, ra, dec) in zip(tab["filename"], tab["ra"], tab["dec"])]
-    return tab
+        form = panstarrsQueryForm(request.POST)
+        target_list = get_object_or_404(TargetList, pk=pk)
 
+        if form.is_valid():
+            job = enqueue('panSTARRS_app.tasks.panstarrs_target_list_cutouts', user=request.user,
+                          target_list=target_list.pk, filters=form.cleaned_data['Filter'])
+            messages.info(request, f"PanSTARRS query for the {target_list.targets.count()} targets in "
+                                   f"{target_list.name} was queued as job {job.pk}.")
+            return HttpResponseRedirect(reverse('tom_targets:targetgrouping'))
+
+        return render(request, 'panstarrs_targetlist_query.html', {
+            'target_list': target_list,
+            'form': form,
+        })
+
+#########################################################################################
 
 def panstarrs_main_func(self, target, Filter):
-    t0 = time.time()
+    """
+    Downloads the PanSTARRS stack cutouts of ``target`` in the filters of ``Filter`` (e.g. ``'gri'``) at the same time,
+    stores them as ``DataProduct`` objects of the target and measures the target in them.
 
-    tdec = []
-    tra = []
+    :returns: the data product of each cutout
+    :rtype: list
+    """
+    cutouts, _ = panstarrs_target_list_func([target], Filter)
+    return cutouts[target]
 
-    # create a test set of image positions
-    # currently setup for a single target
 
-    tdec = np.append(tdec, target.dec)   # collects ra and dec from TOM ORM
-    tra = np.append(tra, target.ra)
+def save_cutout(target, path):
+    """
+    Stores a downloaded cutout as a FITS ``DataProduct`` of the target, streaming it into the data product's file in
+    chunks. A cutout that was stored before is replaced.
 
-    # add filter to user input
+    :returns: the data product
+    :rtype: DataProduct
+    """
+    name = os.path.basename(path)
+    dp, _ = DataProduct.objects.get_or_create(product_id=f'PanSTARRS {target.pk} {name}',
+                                              defaults={'target': target, 'data_product_type': 'fits_file'})
+    if dp.data:
+        ReducedDatum.objects.filter(data_product=dp).delete()
+        dp.data.delete(save=False)
+    with open(path, 'rb') as f:
+        dp.data.save(name, File(f))
+    return dp
+
+
+def panstarrs_target_list_func(targets, Filter, on_progress=None):
+    """
+    Downloads the PanSTARRS stack cutouts of many targets in the filters of ``Filter``: the images of all the targets
+    are looked up with a single ``ps1filenames.py`` request, then downloaded at the same time in skycell order. Stack
+    cutouts that were downloaded before are copied from the ``CutoutCache`` instead. Each cutout is stored as a
+    ``DataProduct`` of its target, which queues the rendering of its previews, and the targets are measured in all
+    the cutouts at once with ``run_photometry``; a cutout the target cannot be measured in is kept without data.
+
+    :param on_progress: called with the number of cutouts downloaded so far and the total after each download
+    :type on_progress: callable
+
+    :returns: data products of the cutouts of each target, and the number of cutouts that could not be processed
+    :rtype: tuple
+    """
+    t0 = time.time()
+    targets = list(targets)
+    session = make_session()
 
     # get the PS1 info for those positions
-    table = getimages(tra, tdec, filters=Filter)   # inputs the user's choice of filter
-    print("{:.1f} s: got list of {} images for {} positions".format(time.time() - t0, len(table), len(tra)))
+    table = getimages([target.ra for target in targets], [target.dec for target in targets], filters=Filter,
+                      session=session)
+    logger.info('%.1f s: got list of %d images for %d positions', time.time() - t0, len(table), len(targets))
 
     # if you are extracting images that are close together on the sky,
     # sorting by skycell and filter will improve the performance because it takes
     # advantage of file system caching on the server
     table.sort(['projcell', 'subcell', 'filter'])
 
-    #####################
-
-
-
-    for row in table:
-        ra = row['ra']
-        dec = row['dec']
-        projcell = row['projcell']
-        subcell = row['subcell']
-        filter = row['filter']
-
-        # create a name for the image -- could also include the projection cell or other info
-        fname = "t{:08.4f}{:+07.4f}.{}.fits".format(ra, dec, filter)
-
-        url = row["url"]
-        print("%11.6f %10.6f skycell.%4.4d.%3.3d %s" % (ra, dec, projcell, subcell, fname))
-        r = requests.get(url)
-
-        open(fname, "wb").write(r.content)   # change this s.t. it is written to disk
-
-        #data = fits.getdata(fname)
-        #header = fits.getheader(fname)
-
-    #print(f"this is the data: {data}")
-    #print("")
-    #print(f"this is the header: {header}")
-
-    #dataproduct = fits.writeto('dataproduct.fits', data, header, overwrite=True)
-
-    #print(f"this is our dataproduct: {dataproduct}")
-
-    #hdulist = fits.open(fname)
-
-    #print(hdulist.info())
-    #print("")
-    #print(hdulist[0].data)
-    #print("")
-
-    #print(f"this is the written fits file: {fname}")
-
-    print(f"We are here right before calling the run data processor!")
-
-    run_data_processor(fname)   # call the run_data_processor
\ No newline at end of file
+    cutouts = {target: [] for target in targets}
+    # the cutouts only pass through a temporary directory on their way into the data products
+    with tempfile.TemporaryDirectory() as directory:
+        paths = download_cutouts(table, directory, session=session, on_progress=on_progress, cache=CutoutCache())
+        logger.info('%.1f s: downloaded %d images', time.time() - t0, len(paths))
+
+        data_products = []
+        for index, path in zip(match_targets(table, targets), paths):
+            dp = save_cutout(targets[index], path)
+            cutouts[targets[index]].append(dp)
+            data_products.append(dp)
+            try:
+                run_hook('data_product_post_upload', dp)
+            except Exception:
+                # the cutout is kept and measured without whatever the hook would have done with it
+                logger.exception('The post upload hook failed for %s', dp)
+
+    # every cutout is measured in one batched pass rather than one processor run per file
+    failed = run_photometry(data_products)
+    logger.info('%.1f s: measured %d images', time.time() - t0, len(data_products) - len(failed))
+    return cutouts, len(failed)
@@ -1,3 +1,9 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ZTFRequest
+
+
+@admin.register(ZTFRequest)
+class ZTFRequestAdmin(admin.ModelAdmin):
+    list_display = ('id', 'request_id', 'target', 'status', 'jd_start', 'jd_end', 'created', 'modified')
+    list_filter = ('status',)
@@ -0,0 +1,44 @@
+from astropy.time import Time
+from django.core.management.base import BaseCommand, CommandError
+
+from tom_targets.models import Target, TargetList
+
+from ztf_app.tasks import batch_forced_photometry
+
+
+class Command(BaseCommand):
+
+    help = ('Submits ZTF forced-photometry requests for every target in a TargetList, or for the given targets, in '
+            'batches. Run ztf_retrieve to ingest the light curves.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-list', help='Name or id of the TargetList to query.')
+        parser.add_argument('--target-id', type=int, nargs='+', help='Ids of individual targets to query.')
+        parser.add_argument('--jd-start', type=float, help='Earliest JD to query.')
+        parser.add_argument('--jd-end', type=float, help='Latest JD to query. Defaults to now.')
+        parser.add_argument('--days', type=float, help='Query the last DAYS days instead of from --jd-start.')
+        parser.add_argument('--batch-size', type=int, help='Positions per request, at most 1500.')
+
+    def handle(self, *args, **options):
+        if options['target_list']:
+            name = options['target_list']
+            lists = TargetList.objects.filter(pk=name) if name.isdigit() else TargetList.objects.filter(name=name)
+            if not lists.exists():
+                raise CommandError(f'TargetList {name} does not exist')
+            targets = lists.first().targets.all()
+        elif options['target_id']:
+            targets = Target.objects.filter(pk__in=options['target_id'])
+        else:
+            raise CommandError('Either --target-list or --target-id is required')
+
+        jd_end = options['jd_end'] or Time.now().jd
+        if options['days'] is not None:
+            jd_start = jd_end - options['days']
+        elif options['jd_start'] is not None:
+            jd_start = options['jd_start']
+        else:
+            raise CommandError('Either --jd-start or --days is required')
+
+        ztf_requests = batch_forced_photometry(targets, jd_start, jd_end, batch_size=options['batch_size'])
+
+        self.stdout.write(f'ZTF forced photometry requested for {len(ztf_requests)} targets')
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ztf_app.retrieval import retrieve_results
+
+
+class Command(BaseCommand):
+
+    help = 'Downloads and ingests the light curves of finished ZTF forced-photometry requests.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Check the outstanding requests once, then exit.')
+        parser.add_argument('--sleep', type=float, default=600.0,
+                            help='Seconds to wait between checks of the ZTF status page.')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            for ztf_request in retrieve_results():
+                self.stdout.write(f'{ztf_request} finished with status {ztf_request.status}')
+            if options['once']:
+                return
+            time.sleep(options['sleep'])
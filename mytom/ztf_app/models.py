@@ -1,3 +1,51 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+from tom_dataproducts.models import DataProduct
+from tom_targets.models import Target
+
+
+class ZTFRequest(models.Model):
+    """
+    Class representing a request submitted to the ZTF forced-photometry service, which the ``ztf_retrieve`` worker
+    follows until its light curve has been downloaded and ingested.
+
+    :param request_id: ``reqId`` the service gave the request, known once it appears in the status table.
+    :type request_id: int
+
+    :param status: One of SUBMITTED, COMPLETED or FAILED.
+    :type status: str
+
+    :param data_product: The ``DataProduct`` the light curve was stored in, once it is ingested.
+
+    :param message: Why the request failed, if it did.
+    :type message: str
+    """
+
+    SUBMITTED = 'SUBMITTED'
+    COMPLETED = 'COMPLETED'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = (
+        (SUBMITTED, 'Submitted'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    )
+
+    target = models.ForeignKey(Target, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    ra = models.FloatField()
+    dec = models.FloatField()
+    jd_start = models.FloatField()
+    jd_end = models.FloatField()
+    request_id = models.IntegerField(null=True, blank=True, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=SUBMITTED, db_index=True)
+    data_product = models.ForeignKey(DataProduct, null=True, blank=True, on_delete=models.SET_NULL)
+    message = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ('created',)
+
+    def __str__(self):
+        return f'ZTF request {self.request_id or self.pk} for {self.target}'
@@ -0,0 +1,106 @@
+import logging
+
+import requests
+from django.core.files.base import ContentFile
+
+from tom_common.hooks import run_hook
+from tom_dataproducts.models import DataProduct, ReducedDatum
+
+from .models import ZTFRequest
+from .ztf_client import download_lightcurve, get_recent_requests
+from .ztf_data_processor import run_data_processor
+
+logger = logging.getLogger(__name__)
+
+# largest difference between a request's position (degrees) or JD range and a row of the status table it matches
+MATCH_TOLERANCE = 1e-5
+
+
+def find_request_row(ztf_request, rows, claimed_ids):
+    """
+    Returns the row of the status table for a request: the row with its ``reqId`` if it is known, otherwise the
+    newest row with the same position and JD range that no other request has claimed.
+    """
+    if ztf_request.request_id is not None:
+        return next((row for row in rows if int(row['reqId']) == ztf_request.request_id), None)
+
+    def matches(row):
+        try:
+            return all(abs(float(row[column]) - value) < MATCH_TOLERANCE for column, value in (
+                ('ra', ztf_request.ra), ('dec', ztf_request.dec),
+                ('startJD', ztf_request.jd_start), ('endJD', ztf_request.jd_end)))
+        except (KeyError, ValueError):
+            return False
+
+    candidates = [row for row in rows if int(row['reqId']) not in claimed_ids and matches(row)]
+    return max(candidates, key=lambda row: int(row['reqId']), default=None)
+
+
+def ingest_lightcurve(ztf_request, text):
+    """
+    Stores a downloaded light curve as a text ``DataProduct`` of the request's target and ingests its photometry
+    with ``run_data_processor``. The data product is removed again if the file cannot be processed.
+    """
+    dp = DataProduct(target=ztf_request.target, product_id=None, data_product_type='text_file')
+    dp.data.save(f'forcedphotometry_req{ztf_request.request_id:08d}_lc.txt', ContentFile(text.encode()))
+    try:
+        run_hook('data_product_post_upload', dp)
+        run_data_processor(dp)
+    except Exception:
+        ReducedDatum.objects.filter(data_product=dp).delete()
+        dp.delete()
+        raise
+    return dp
+
+
+def retrieve_results(session=None):
+    """
+    Checks the status of every outstanding ``ZTFRequest`` on the ZTF service, and downloads and ingests the light
+    curves of the ones that have finished. Requests whose download fails stay outstanding and are retried on the next
+    call.
+
+    :returns: the requests that completed or failed during this call
+    :rtype: list
+    """
+    outstanding = list(ZTFRequest.objects.filter(status=ZTFRequest.SUBMITTED).select_related('target'))
+    if not outstanding:
+        return []
+
+    rows = get_recent_requests(session)
+    claimed_ids = set(ZTFRequest.objects.exclude(request_id=None).values_list('request_id', flat=True))
+
+    finished = []
+    for ztf_request in outstanding:
+        row = find_request_row(ztf_request, rows, claimed_ids)
+        if row is None:
+            continue
+        if ztf_request.request_id is None:
+            ztf_request.request_id = int(row['reqId'])
+            claimed_ids.add(ztf_request.request_id)
+
+        if row.get('ended', '') in ('', 'None'):   # still queued or running
+            ztf_request.save(update_fields=['request_id', 'modified'])
+            continue
+
+        if row.get('exitcode') != '0' or row.get('lightcurve', '') in ('', 'None'):
+            ztf_request.status = ZTFRequest.FAILED
+            ztf_request.message = f"ZTF request {ztf_request.request_id} ended with exit code {row.get('exitcode')}"
+        else:
+            try:
+                text = download_lightcurve(row['lightcurve'], session)
+            except requests.RequestException:
+                logger.exception('Could not download the light curve of %s', ztf_request)
+                ztf_request.save(update_fields=['request_id', 'modified'])
+                continue
+            try:
+                ztf_request.data_product = ingest_lightcurve(ztf_request, text)
+                ztf_request.status = ZTFRequest.COMPLETED
+            except Exception as e:
+                logger.exception('Could not ingest the light curve of %s', ztf_request)
+                ztf_request.status = ZTFRequest.FAILED
+                ztf_request.message = f'Could not ingest the light curve: {e}'
+
+        ztf_request.save()
+        finished.append(ztf_request)
+
+    return finished
@@ -0,0 +1,140 @@
+import time
+
+import requests
+from django.conf import settings
+from django.contrib.auth.models import Group
+
+from tom_common.hooks import run_hook
+from tom_dataproducts.models import DataProduct, ReducedDatum
+from tom_targets.models import TargetList
+
+from jobs_app.jobs import JOB_TIMEOUT
+from jobs_app.models import QueryJob
+from jobs_app.progress import publish_progress
+from mytom.ingestion import chunked
+from mytom.permissions import assign_data_product_perms
+
+from .models import ZTFRequest
+from .views import ztf_main_func
+from .ztf_client import BATCH_SIZE, submit_batch
+from .ztf_data_processor import run_data_processor
+
+# seconds between the starts of two batch submissions, unless BATCH_INTERVAL is set in settings.BROKERS['ztf']
+BATCH_INTERVAL = 5.0
+
+# seconds between two checks of whether the files of an upload batch have been processed
+UPLOAD_POLL_INTERVAL = 1.0
+
+
+def ztf_forced_photometry(job):
+    """
+    ``QueryJob`` task that submits a ZTF forced-photometry request for ``job.target`` between the ``start_jd`` and
+    ``end_jd`` parameters.
+    """
+    publish_progress(job, stage='Submitting ZTF forced-photometry request')
+    ztf_main_func(None, job.target, StartJD=job.parameters['start_jd'], EndJD=job.parameters['end_jd'], user=job.user)
+    return f'ZTF forced photometry requested for {job.target.name}; its light curve is ingested when it is ready'
+
+
+def batch_forced_photometry(targets, jd_start, jd_end, user=None, batch_size=None, interval=None, on_progress=None):
+    """
+    Submits ZTF forced-photometry requests for many targets, packing up to ``batch_size`` positions into each request
+    to the service, and records a ``ZTFRequest`` per target for the ``ztf_retrieve`` worker. Batches are submitted
+    over one HTTP session, at most one every ``interval`` seconds.
+
+    :param batch_size: positions per request, defaults to ``BATCH_SIZE`` in ``settings.BROKERS['ztf']``, or the
+        service's limit of 1500
+    :type batch_size: int
+
+    :param interval: seconds between the starts of two batch submissions, defaults to ``BATCH_INTERVAL`` in
+        ``settings.BROKERS['ztf']``, or 5
+    :type interval: float
+
+    :param on_progress: called as ``on_progress(submitted, total)`` after each batch
+    :type on_progress: callable
+
+    :returns: the ``ZTFRequest`` of each target
+    :rtype: list
+    """
+    broker = settings.BROKERS['ztf']
+    batch_size = batch_size or broker.get('BATCH_SIZE', BATCH_SIZE)
+    interval = broker.get('BATCH_INTERVAL', BATCH_INTERVAL) if interval is None else interval
+    targets = list(targets)
+
+    ztf_requests = []
+    last_submitted = None
+    with requests.Session() as session:
+        for batch in chunked(targets, batch_size):
+            if last_submitted is not None:
+                time.sleep(max(0.0, interval - (time.monotonic() - last_submitted)))
+            last_submitted = time.monotonic()
+
+            request_ids = submit_batch([(target.ra, target.dec) for target in batch], jd_start, jd_end,
+                                       session=session)
+            if len(request_ids) != len(batch):   # the ids are found on the status page instead
+                request_ids = [None] * len(batch)
+            ztf_requests += ZTFRequest.objects.bulk_create([
+                ZTFRequest(target=target, user=user, ra=target.ra, dec=target.dec, jd_start=jd_start,
+                           jd_end=jd_end, request_id=request_id)
+                for target, request_id in zip(batch, request_ids)])
+            if on_progress:
+                on_progress(len(ztf_requests), len(targets))
+
+    return ztf_requests
+
+
+def ztf_target_list_forced_photometry(job):
+    """
+    ``QueryJob`` task that runs ``batch_forced_photometry`` for every target in the ``target_list`` parameter
+    between the ``start_jd`` and ``end_jd`` parameters.
+    """
+    target_list = TargetList.objects.get(pk=job.parameters['target_list'])
+
+    def report(submitted, total):
+        publish_progress(job, stage=f'{submitted} of {total} requests submitted', submitted=submitted, total=total)
+
+    publish_progress(job, stage='Submitting ZTF forced-photometry requests')
+    ztf_requests = batch_forced_photometry(target_list.targets.all(), job.parameters['start_jd'],
+                                           job.parameters['end_jd'], user=job.user, on_progress=report)
+    return (f'ZTF forced photometry requested for {len(ztf_requests)} targets of {target_list.name}; their light '
+            f'curves are ingested when they are ready')
+
+
+def process_data_product(job):
+    """
+    ``QueryJob`` task that ingests an uploaded ``DataProduct`` (the ``data_product`` parameter) with
+    ``run_data_processor``. A file that cannot be processed is deleted with its data, and the job fails with the
+    error.
+    """
+    dp = DataProduct.objects.get(pk=job.parameters['data_product'])
+    publish_progress(job, stage=f'Processing {dp}')
+    try:
+        run_hook('data_product_post_upload', dp)
+        run_data_processor(dp)
+    except Exception:
+        ReducedDatum.objects.filter(data_product=dp).delete()
+        dp.delete()
+        raise
+    return f'Successfully uploaded: {dp}'
+
+
+def grant_upload_perms(job):
+    """
+    ``QueryJob`` task queued after the ``process_data_product`` jobs of an upload batch (the ``batch`` parameter). It
+    waits for the jobs of the batch that other workers are still running, then gives the ``groups`` parameter access
+    to the batch's data products that were ingested, in one transaction for the whole batch.
+    """
+    file_jobs = QueryJob.objects.filter(task=f'{__name__}.process_data_product',
+                                        parameters__batch=job.parameters['batch'])
+    publish_progress(job, stage='Waiting for the files of the batch to be processed')
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while file_jobs.filter(status__in=(QueryJob.PENDING, QueryJob.RUNNING)).exists():
+        if time.monotonic() > deadline:
+            raise RuntimeError(f'The files of batch {job.parameters["batch"]} were not processed in time')
+        time.sleep(UPLOAD_POLL_INTERVAL)
+
+    # the data products of files that could not be processed have been deleted
+    data_products = DataProduct.objects.filter(pk__in=job.parameters['data_products'])
+    publish_progress(job, stage='Giving the groups access to the uploaded data')
+    assign_data_product_perms(Group.objects.filter(pk__in=job.parameters['groups']), data_products)
+    return f'Access given to {data_products.count()} uploaded file(s)'
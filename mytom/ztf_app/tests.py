@@ -1,3 +1,296 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from guardian.shortcuts import get_objects_for_group
+
+from tom_dataproducts.exceptions import InvalidFileFormatException
+from tom_dataproducts.models import ReducedDatum
+from tom_observations.tests.factories import SiderealTargetFactory
+
+from jobs_app.jobs import claim_next_job, run_job
+from jobs_app.models import QueryJob
+from mytom.permissions import assign_data_product_perms
+
+from .models import ZTFRequest
+from .retrieval import retrieve_results
+from .tasks import batch_forced_photometry
+from .views import DataProductUploadView, ztf_main_func
+from .ztf_data_processor import parse_ztf_result, ztf_magnitudes, ztf_photometry, ztf_quality_mask
+
+SAMPLE_DATA = os.path.join(settings.BASE_DIR, 'data', 'BD+222716b', 'none', 'sample_ztf_data.txt')
+
+
+class TestParseZTFResult(SimpleTestCase):
+    def setUp(self):
+        with open(SAMPLE_DATA) as f:
+            self.textdata = f.read()
+
+    def test_columns_are_found_by_name(self):
+        data = parse_ztf_result(self.textdata)
+
+        self.assertEqual(len(data), 23)
+        self.assertEqual(data['filter'][0], 'ZTF_r')
+        self.assertAlmostEqual(data['jd'][0], 2458246.9171181)
+        self.assertAlmostEqual(data['forcediffimflux'][0], -5.37000043327596)
+        self.assertAlmostEqual(data['diffmaglim'][-1], 19.9149)
+
+    def test_header_without_comments(self):
+        body = self.textdata[self.textdata.index(' index,'):]
+
+        np.testing.assert_array_equal(parse_ztf_result(body), parse_ztf_result(self.textdata))
+
+    def test_null_values_are_nan(self):
+        data = parse_ztf_result(self.textdata.replace('-5.37000043327596', 'null'))
+
+        self.assertTrue(np.isnan(data['forcediffimflux'][0]))
+
+    def test_missing_column(self):
+        with self.assertRaises(InvalidFileFormatException):
+            parse_ztf_result(self.textdata.replace(' zpdiff,', ' zp,'))
+
+
+class TestZTFPhotometry(SimpleTestCase):
+    def setUp(self):
+        self.data = np.array(
+            [(1000.0, 10.0, 26.0, 20.0, '0', 0, 2.0),    # detection
+             (-5.0, 10.0, 26.0, 20.0, '0', 0, 2.0),      # negative flux
+             (20.0, 10.0, 26.0, 20.0, '0', 0, 2.0),      # SNR of 2
+             (1000.0, 10.0, 26.0, 20.0, '56', 0, 2.0),   # processing error
+             (1000.0, 10.0, 26.0, 20.0, '0', 2 ** 25, 2.0),
+             (1000.0, 10.0, 26.0, 20.0, '0', 0, 4.5),
+             (np.nan, np.nan, 26.0, 20.0, '0', 0, 2.0)],
+            dtype=[('forcediffimflux', 'f8'), ('forcediffimfluxunc', 'f8'), ('zpdiff', 'f8'), ('diffmaglim', 'f8'),
+                   ('procstatus', 'U32'), ('infobitssci', 'i8'), ('sciinpseeing', 'f8')])
+
+    def test_low_snr_epochs_become_limits(self):
+        magnitude, magnitude_error, limit = ztf_magnitudes(self.data[:3], snr_limit=3)
+
+        np.testing.assert_allclose(magnitude, [18.5, np.nan, np.nan])
+        self.assertAlmostEqual(magnitude_error[0], 0.0108574, places=7)
+        np.testing.assert_allclose(limit, [np.nan, 20.0, 20.0])
+
+    def test_quality_cuts(self):
+        np.testing.assert_array_equal(ztf_quality_mask(self.data), [True, True, True, False, False, False, False])
+        np.testing.assert_array_equal(ztf_quality_mask(self.data, procstatus=[0, 56], max_seeing=5)[3:6],
+                                      [True, False, True])
+
+    def test_one_value_per_epoch_kept(self):
+        with open(SAMPLE_DATA) as f:
+            timestamps, values = ztf_photometry(parse_ztf_result(f.read()))
+
+        self.assertEqual(len(timestamps), len(values))
+        self.assertEqual(len(values), 21)   # two epochs have a seeing above 4 pixels
+        self.assertEqual(timestamps[0].strftime('%Y-%m-%d %H:%M'), '2018-05-08 10:00')
+        self.assertEqual(values[0], {'limit': 19.4995, 'filter': 'ZTF_r'})
+
+
+STATUS_PAGE = """<html><body><table border=1>
+<tr><th>reqId</th><th>ra</th><th>dec</th><th>startJD</th><th>endJD</th><th>created</th><th>started</th><th>ended</th>
+<th>exitcode</th><th>lightcurve</th></tr>
+<tr><td>101</td><td>262.75616</td><td>-21.40123</td><td>2458231.891227</td><td>2458345.025359</td>
+<td>2023-08-04 15:50:00</td><td>2023-08-04 15:55:00</td><td>2023-08-04 15:59:31</td><td>0</td>
+<td>/lc/forcedphotometry_req00000101_lc.txt</td></tr>
+<tr><td>102</td><td>10.0</td><td>20.0</td><td>2458231.5</td><td>2458345.5</td>
+<td>2023-08-04 15:51:00</td><td></td><td></td><td></td><td></td></tr>
+<tr><td>103</td><td>30.0</td><td>40.0</td><td>2458231.5</td><td>2458345.5</td>
+<td>2023-08-04 15:52:00</td><td>2023-08-04 15:56:00</td><td>2023-08-04 15:57:00</td><td>56</td><td></td></tr>
+</table></body></html>"""
+
+
+class StubZTFHandler(BaseHTTPRequestHandler):
+    """
+    Answers like the ZTF forced-photometry service: accepts every request and serves ``STATUS_PAGE`` and the sample
+    light curve.
+    """
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/cgi-bin/requestForcedPhotometry.cgi':
+            body = 'Your request has been submitted.'
+        elif path == '/cgi-bin/getForcedPhotometryRequests.cgi':
+            body = STATUS_PAGE
+        elif path == '/lc/forcedphotometry_req00000101_lc.txt':
+            with open(SAMPLE_DATA) as f:
+                body = f.read()
+        else:
+            self.send_error(404)
+            return
+        self.server.paths.append(path)
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/cgi-bin/batchfp.py/submit':
+            self.send_error(404)
+            return
+        form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        if self.server.throttle:
+            self.server.throttle = False
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        ra = json.loads(form['ra'][0])
+        self.server.batches.append((ra, form['email'][0]))
+        first_id = 200 + sum(len(batch) for batch, _ in self.server.batches[:-1])
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write('\n'.join(f'reqId: {first_id + i}' for i in range(len(ra))).encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubZTFServiceMixin:
+    def setUp(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubZTFHandler)
+        server.paths = []
+        server.batches = []
+        server.throttle = False
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.server = server
+
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        brokers = dict(settings.BROKERS, ztf={'USER': 'user@example.com', 'PASS': 'secret',
+                                             'BASEURL': f'http://127.0.0.1:{server.server_port}'})
+        overrides = override_settings(BROKERS=brokers, MEDIA_ROOT=media_root.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.target = SiderealTargetFactory.create(ra=262.75616, dec=-21.40123)
+
+
+class TestRetrieveResults(StubZTFServiceMixin, TestCase):
+    def test_finished_request_is_ingested(self):
+        ztf_request = ztf_main_func(None, self.target, StartJD=2458231.891227, EndJD=2458345.025359)
+        pending = ZTFRequest.objects.create(target=SiderealTargetFactory.create(), ra=10.0, dec=20.0,
+                                            jd_start=2458231.5, jd_end=2458345.5)
+        failed = ZTFRequest.objects.create(target=SiderealTargetFactory.create(), ra=30.0, dec=40.0,
+                                           jd_start=2458231.5, jd_end=2458345.5)
+
+        finished = retrieve_results()
+
+        self.assertEqual(sorted(request.pk for request in finished), sorted([ztf_request.pk, failed.pk]))
+        ztf_request.refresh_from_db()
+        self.assertEqual(ztf_request.status, ZTFRequest.COMPLETED)
+        self.assertEqual(ztf_request.request_id, 101)
+        self.assertEqual(ReducedDatum.objects.filter(target=self.target, data_product=ztf_request.data_product,
+                                                     source_name='ZTF').count(), 21)
+        pending.refresh_from_db()
+        self.assertEqual((pending.status, pending.request_id), (ZTFRequest.SUBMITTED, 102))
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, ZTFRequest.FAILED)
+        self.assertIn('exit code 56', failed.message)
+
+    def test_nothing_outstanding(self):
+        self.assertEqual(retrieve_results(), [])
+        self.assertEqual(self.server.paths, [])
+
+
+class TestBatchForcedPhotometry(StubZTFServiceMixin, TestCase):
+    def test_targets_are_submitted_in_batches(self):
+        targets = [self.target] + [SiderealTargetFactory.create(ra=10.0 + i) for i in range(4)]
+        self.server.throttle = True
+
+        ztf_requests = batch_forced_photometry(targets, 2458231.5, 2458345.5, batch_size=2, interval=0)
+
+        self.assertEqual([len(ra) for ra, _ in self.server.batches], [2, 2, 1])
+        self.assertEqual({email for _, email in self.server.batches}, {'user@example.com'})
+        self.assertEqual([ztf_request.request_id for ztf_request in ztf_requests], [200, 201, 202, 203, 204])
+        self.assertEqual([ztf_request.target for ztf_request in ztf_requests], targets)
+        self.assertEqual(ZTFRequest.objects.filter(status=ZTFRequest.SUBMITTED).count(), 5)
+
+
+class TestDataProductUpload(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        overrides = override_settings(MEDIA_ROOT=media_root.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.target = SiderealTargetFactory.create()
+        self.user = User.objects.create(username='uploader')
+
+    def upload(self, *files, groups=()):
+        request = RequestFactory().post('/', {
+            'target': self.target.pk, 'data_product_type': 'text_file', 'referrer': '/', 'files': list(files),
+            'groups': [group.pk for group in groups],
+        }, HTTP_ACCEPT='application/json')
+        request.user = self.user
+        return DataProductUploadView.as_view()(request)
+
+    def test_files_are_processed_in_the_background(self):
+        with open(SAMPLE_DATA, 'rb') as f:
+            sample = f.read()
+
+        response = self.upload(SimpleUploadedFile('night1.txt', sample), SimpleUploadedFile('night2.txt', sample),
+                               SimpleUploadedFile('broken.txt', b'no photometry here'))
+
+        self.assertEqual(response.status_code, 202)
+        batch = json.loads(response.content)
+        self.assertEqual([upload['status'] for upload in batch['files']], [QueryJob.PENDING] * 3)
+        self.assertEqual(ReducedDatum.objects.count(), 0)
+
+        while (job := claim_next_job()) is not None:
+            run_job(job)
+
+        self.client.force_login(self.user)
+        jobs = self.client.get(reverse('jobs_app:list'), {'batch': batch['batch']}).json()['jobs']
+        self.assertEqual(sorted(job['status'] for job in jobs),
+                         [QueryJob.COMPLETED, QueryJob.COMPLETED, QueryJob.FAILED])
+        self.assertEqual(ReducedDatum.objects.filter(target=self.target, source_name='ZTF').count(), 42)
+        self.assertEqual(self.target.dataproduct_set.count(), 2)
+
+    @override_settings(TARGET_PERMISSIONS_ONLY=False)
+    def test_groups_are_given_access_to_the_ingested_data(self):
+        groups = [Group.objects.create(name='observers'), Group.objects.create(name='students')]
+        self.user.groups.add(*groups)
+        with open(SAMPLE_DATA, 'rb') as f:
+            sample = f.read()
+        self.upload(SimpleUploadedFile('night1.txt', sample), SimpleUploadedFile('night2.txt', sample),
+                    SimpleUploadedFile('broken.txt', b'no photometry here'), groups=groups)
+
+        with mock.patch('ztf_app.tasks.assign_data_product_perms', wraps=assign_data_product_perms) as assign:
+            while (job := claim_next_job()) is not None:
+                run_job(job)
+
+        # one grant for the whole batch, after its files were processed
+        self.assertEqual(assign.call_count, 1)
+        self.assertEqual(QueryJob.objects.get(task='ztf_app.tasks.grant_upload_perms').status, QueryJob.COMPLETED)
+        data_products = set(self.target.dataproduct_set.all())
+        self.assertEqual(len(data_products), 2)
+        for group in groups:
+            self.assertEqual(set(get_objects_for_group(group, 'tom_dataproducts.delete_dataproduct')), data_products)
+            self.assertEqual(get_objects_for_group(group, 'tom_dataproducts.view_reduceddatum').count(), 42)
+
+    @override_settings(TARGET_PERMISSIONS_ONLY=False)
+    def test_access_is_given_once_files_another_worker_runs_are_processed(self):
+        group = Group.objects.create(name='observers')
+        self.user.groups.add(group)
+        with open(SAMPLE_DATA, 'rb') as f:
+            self.upload(SimpleUploadedFile('night1.txt', f.read()), groups=[group])
+        file_job, grant_job = claim_next_job(), claim_next_job()
+
+        # the file job runs while the grant job waits for it
+        with mock.patch('ztf_app.tasks.time.sleep', side_effect=lambda _: run_job(file_job)) as sleep:
+            run_job(grant_job)
+
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(grant_job.status, QueryJob.COMPLETED)
+        self.assertEqual(get_objects_for_group(group, 'tom_dataproducts.view_reduceddatum').count(), 21)
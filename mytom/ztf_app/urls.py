@@ -9,5 +9,6 @@ app_name = 'ztf_app'
 urlpatterns = [
 	path('', views.DataProductUploadView.as_view(), name='upload'),
 	path("<int:pk>/ztfquery/",views.ZTFQueryView.as_view(),name='ztfquery'),
+	path('targetlist/<int:pk>/ztfquery/', views.ZTFTargetListQueryView.as_view(), name='targetlist-ztfquery'),
 	path('<int:pk>/', views.TargetDetailView.as_view(),name='detail'),
 ]
@@ -3,6 +3,7 @@ from requests.auth import HTTPBasicAuth
 
 import io
 import os
+import uuid
 import subprocess
 import time
 import csv
@@ -13,7 +14,7 @@ import logging
 from urllib.parse import urlencode, urlparse
 
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 
 from django.forms import HiddenInput
 from django.template import loader
@@ -60,9 +61,15 @@ from tom_dataproducts.serializers import DataProductSerializer
 #from tom_dataproducts.data_processor import run_data_processor
 
 
+from jobs_app.jobs import enqueue
+
 from .forms import ZTFQueryForm
+from .models import ZTFRequest
+from .ztf_client import submit_request
 from .ztf_data_processor import run_data_processor
 
+logger = logging.getLogger(__name__)
+
 # Create your views here.
 
 class TargetDetailView(Raise403PermissionRequiredMixin, DetailView):
@@ -145,8 +152,11 @@ class DataProductUploadView(LoginRequiredMixin, FormView):
 
     def form_valid(self, form):
         """
-        Runs after ``DataProductUploadForm`` is validated. Saves each ``DataProduct`` and calls ``run_data_processor``
-        on each saved file. Redirects to the previous page.
+        Runs after ``DataProductUploadForm`` is validated. Saves each ``DataProduct`` and queues a job per saved file
+        that runs ``run_data_processor`` on it, so the response does not wait for the files to be processed, then one
+        job that gives the selected groups access to all the files at once. The jobs share a batch id; their status is
+        listed at ``/jobs/?batch=<id>``. Requests accepting JSON get the batch id and per-file status as JSON, others
+        are redirected to the previous page.
         """
         target = form.cleaned_data['target']
         if not target:
@@ -156,7 +166,9 @@ class DataProductUploadView(LoginRequiredMixin, FormView):
             observation_record = None
         dp_type = form.cleaned_data['data_product_type']
         data_product_files = self.request.FILES.getlist('files')
-        successful_uploads = []
+        groups = [] if settings.TARGET_PERMISSIONS_ONLY else [group.pk for group in form.cleaned_data['groups']]
+        batch = uuid.uuid4().hex
+        uploads = []
         for f in data_product_files:
             dp = DataProduct(
                 target=target,
@@ -166,30 +178,20 @@ class DataProductUploadView(LoginRequiredMixin, FormView):
                 data_product_type=dp_type
             )
             dp.save()
-            try:
-                run_hook('data_product_post_upload', dp)
-                reduced_data = run_data_processor(dp)
-                if not settings.TARGET_PERMISSIONS_ONLY:
-                    for group in form.cleaned_data['groups']:
-                        assign_perm('tom_dataproducts.view_dataproduct', group, dp)
-                        assign_perm('tom_dataproducts.delete_dataproduct', group, dp)
-                        assign_perm('tom_dataproducts.view_reduceddatum', group, reduced_data)
-                successful_uploads.append(str(dp))
-            except InvalidFileFormatException as iffe:
-                ReducedDatum.objects.filter(data_product=dp).delete()
-                dp.delete()
-                messages.error(
-                    self.request,
-                    'File format invalid for file {0} -- error was {1}'.format(str(dp), iffe)
-                )
-            except Exception:
-                ReducedDatum.objects.filter(data_product=dp).delete()
-                dp.delete()
-                messages.error(self.request, 'There was a problem processing your file: {0}'.format(str(dp)))
-        if successful_uploads:
-            messages.success(
+            job = enqueue('ztf_app.tasks.process_data_product', target=target, user=self.request.user,
+                          data_product=dp.pk, batch=batch)
+            uploads.append({'file': str(dp), 'data_product': dp.pk, 'job': job.pk, 'status': job.status})
+        if groups and uploads:
+            enqueue('ztf_app.tasks.grant_upload_perms', target=target, user=self.request.user,
+                    data_products=[upload['data_product'] for upload in uploads], groups=groups, batch=batch)
+
+        if 'application/json' in self.request.headers.get('Accept', ''):
+            return JsonResponse({'batch': batch, 'files': uploads}, status=202)
+        if uploads:
+            messages.info(
                 self.request,
-                'Successfully uploaded: {0}'.format('\n'.join([p for p in successful_uploads]))
+                'Processing {0} file(s) in the background as batch {1}: {2}'.format(
+                    len(uploads), batch, ', '.join(upload['file'] for upload in uploads))
             )
 
         return redirect(form.cleaned_data.get('referrer', '/'))
@@ -220,32 +222,53 @@ class ZTFQueryView(View):
         target = Target.objects.get(pk=pk)
 
         if form.is_valid():
-            print(f"This is the StartMJD: {form.cleaned_data['StartMJD']}")
-            print(f"This is the EndMJD: {form.cleaned_data['EndMJD']}")
-            ztf_main_func(self, target, StartJD=form.cleaned_data['StartMJD'], EndJD=form.cleaned_data['EndMJD'])
-            messages.info(request, "ZTF Query was successful! Please check your email address for data files to be inserted into 'Manage Data' tab of your TOM toolkit.")
+            job = enqueue('ztf_app.tasks.ztf_forced_photometry', target=target, user=request.user,
+                          start_jd=form.cleaned_data['StartMJD'], end_jd=form.cleaned_data['EndMJD'])
+            messages.info(request, f"ZTF Query was queued as job {job.pk}. The light curve will be added to the target once ZTF has produced it.")
             return HttpResponseRedirect(reverse('tom_targets:detail', args=[pk]))
-        else:
-            form = ZTFQueryForm()
 
-        return render('ztf_query.html', {
+        return render(request, 'ztf_query.html', {
+            'target': target,
             'form': form,
         })
 
-def ztf_main_func(self, target, StartJD, EndJD):
+class ZTFTargetListQueryView(View):
+
+    def get(self, request, pk, *args, **kwargs):
+        target_list = get_object_or_404(TargetList, pk=pk)
+        context = {
+            'target_list': target_list,
+            'form': ZTFQueryForm,
+        }
+        return render(request, 'ztf_targetlist_query.html', context)
 
-    USER = settings.BROKERS['ztf']['USER']
-    PWD = settings.BROKERS['ztf']['PASS']
+    def post(self, request, pk, *args, **kwargs):
 
-    print(f"This is the target RA: {target.ra}")
-    print(f"This is the target Dec: {target.dec}")
+        form = ZTFQueryForm(request.POST)
+        target_list = get_object_or_404(TargetList, pk=pk)
 
-    url = f"https://ztfweb.ipac.caltech.edu/cgi-bin/requestForcedPhotometry.cgi?ra={target.ra}&dec={target.dec}&jdstart={StartJD}&jdend={EndJD}&email={USER}&userpass={PWD}"
+        if form.is_valid():
+            job = enqueue('ztf_app.tasks.ztf_target_list_forced_photometry', user=request.user,
+                          target_list=target_list.pk, start_jd=form.cleaned_data['StartMJD'],
+                          end_jd=form.cleaned_data['EndMJD'])
+            messages.info(request, f"ZTF query for the {target_list.targets.count()} targets in {target_list.name} "
+                                   f"was queued as job {job.pk}.")
+            return HttpResponseRedirect(reverse('tom_targets:targetgrouping'))
+
+        return render(request, 'ztf_targetlist_query.html', {
+            'target_list': target_list,
+            'form': form,
+        })
 
-    x = requests.get(url, auth=HTTPBasicAuth('ztffps', 'dontgocrazy!'))
 
-    textdata = x.text   # this is not the actual data set - just log form
+def ztf_main_func(self, target, StartJD, EndJD, user=None):
+    """
+    Submits a ZTF forced-photometry request for the target and records it as a ``ZTFRequest``, whose light curve the
+    ``ztf_retrieve`` worker ingests once ZTF has produced it.
+    """
+    log = submit_request(target.ra, target.dec, StartJD, EndJD)   # this is not the actual data set - just log form
 
-    print(f"This is the log: {textdata}")
+    logger.debug('ZTF forced photometry request for %s submitted: %s', target, log)
 
-    return print("Please check your email address for data files to be inserted into 'Manage Data' tab of TOM toolkit for further data processing.")
\ No newline at end of file
+    return ZTFRequest.objects.create(target=target, user=user, ra=target.ra, dec=target.dec,
+                                     jd_start=StartJD, jd_end=EndJD)
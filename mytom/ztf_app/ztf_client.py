@@ -0,0 +1,150 @@
+"""
+Client for the ZTF forced-photometry service (https://ztfweb.ipac.caltech.edu/cgi-bin/requestForcedPhotometry.cgi).
+"""
+import json
+import re
+import time
+from html.parser import HTMLParser
+
+import requests
+from requests.auth import HTTPBasicAuth
+from django.conf import settings
+
+# credentials shared by every user of the service; each user's own email and password are sent as parameters
+SERVICE_AUTH = HTTPBasicAuth('ztffps', 'dontgocrazy!')
+DEFAULT_BASE_URL = 'https://ztfweb.ipac.caltech.edu'
+TIMEOUT = 60
+
+# most positions the service accepts in one batch request
+BATCH_SIZE = 1500
+# HTTP statuses after which a batch is submitted again
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+def get_base_url():
+    return settings.BROKERS['ztf'].get('BASEURL', DEFAULT_BASE_URL).rstrip('/')
+
+
+def get_user_parameters():
+    return {'email': settings.BROKERS['ztf']['USER'], 'userpass': settings.BROKERS['ztf']['PASS']}
+
+
+class TableParser(HTMLParser):
+    """
+    Collects the text of the cells of every row of the tables in an HTML page.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._row = []
+        elif tag in ('td', 'th') and self._row is not None:
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th') and self._cell is not None:
+            self._row.append(''.join(self._cell).strip())
+            self._cell = None
+        elif tag == 'tr' and self._row is not None:
+            if self._row:
+                self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def parse_request_table(html):
+    """
+    Parses the table of requests returned by ``getForcedPhotometryRequests.cgi``.
+
+    :returns: one dict per request, keyed by the column names of the table, e.g. ``reqId``, ``ra``, ``startJD``,
+        ``ended``, ``exitcode`` and ``lightcurve``
+    :rtype: list
+    """
+    parser = TableParser()
+    parser.feed(html)
+    if not parser.rows:
+        return []
+    header, *rows = parser.rows
+    return [dict(zip(header, row)) for row in rows if len(row) == len(header)]
+
+
+def submit_request(ra, dec, jd_start, jd_end, session=None):
+    """
+    Submits a forced-photometry request for one position to the ZTF service.
+
+    :returns: text of the service's response
+    :rtype: str
+    """
+    session = session or requests
+    response = session.get(f'{get_base_url()}/cgi-bin/requestForcedPhotometry.cgi', auth=SERVICE_AUTH,
+                           params={'ra': ra, 'dec': dec, 'jdstart': jd_start, 'jdend': jd_end,
+                                   **get_user_parameters()},
+                           timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.text
+
+
+def parse_request_ids(text):
+    """
+    Returns the ``reqId`` numbers listed in a response of the service, in order.
+    """
+    return [int(request_id) for request_id in re.findall(r'reqId\W{0,3}(\d+)', text)]
+
+
+def submit_batch(positions, jd_start, jd_end, session=None, retries=3, retry_wait=30.0):
+    """
+    Submits forced-photometry requests for up to ``BATCH_SIZE`` positions in one POST to the service's batch
+    endpoint. The credentials are sent in the body rather than the URL. A throttled or unavailable service is retried
+    up to ``retries`` times, after its ``Retry-After`` header or ``retry_wait`` seconds.
+
+    :param positions: ``(ra, dec)`` of each request
+    :type positions: list
+
+    :returns: the ``reqId`` of each request, if the service listed them, otherwise an empty list
+    :rtype: list
+    """
+    session = session or requests
+    data = {'ra': json.dumps([ra for ra, _ in positions]), 'dec': json.dumps([dec for _, dec in positions]),
+            'jdstart': jd_start, 'jdend': jd_end, **get_user_parameters()}
+    for attempt in range(retries + 1):
+        response = session.post(f'{get_base_url()}/cgi-bin/batchfp.py/submit', auth=SERVICE_AUTH, data=data,
+                                timeout=TIMEOUT)
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            break
+        time.sleep(float(response.headers.get('Retry-After', retry_wait)))
+    response.raise_for_status()
+    return parse_request_ids(response.text)
+
+
+def get_recent_requests(session=None):
+    """
+    Returns the recent requests of the user, with their status, from the ZTF service's status page (see
+    ``parse_request_table``).
+    """
+    session = session or requests
+    response = session.get(f'{get_base_url()}/cgi-bin/getForcedPhotometryRequests.cgi', auth=SERVICE_AUTH,
+                           params={'option': 'All recent jobs', 'action': 'Query Database', **get_user_parameters()},
+                           timeout=TIMEOUT)
+    response.raise_for_status()
+    return parse_request_table(response.text)
+
+
+def download_lightcurve(path, session=None):
+    """
+    Downloads the light curve of a finished request, given the ``lightcurve`` path in the status table.
+
+    :returns: contents of the forced-photometry file
+    :rtype: str
+    """
+    session = session or requests
+    response = session.get(f'{get_base_url()}/{path.lstrip("/")}', auth=SERVICE_AUTH, timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.text
@@ -1,4 +1,5 @@
 import mimetypes
+import re
 
 from django.conf import settings
 from importlib import import_module
@@ -10,13 +11,150 @@ from astropy import units
 from astropy.io import ascii
 from astropy.time import Time, TimezoneInfo
 from datetime import datetime
+from io import StringIO
 import numpy as np
 
 from tom_dataproducts.data_processor import DataProcessor
 from tom_dataproducts.exceptions import InvalidFileFormatException
 
+from mytom.ingestion import bulk_ingest, times_to_datetimes
+
 DEFAULT_DATA_PROCESSOR_CLASS = 'ztf_app.ztf_data_processor.MyDataProcessor'
 
+# dtypes of the columns of a ZTF forced-photometry file that are read, keyed by their header names
+ZTF_COLUMN_DTYPES = {
+    'filter': 'U5', 'jd': 'f8', 'diffmaglim': 'f8', 'zpdiff': 'f8', 'forcediffimflux': 'f8',
+    'forcediffimfluxunc': 'f8', 'procstatus': 'U32', 'infobitssci': 'i8', 'sciinpseeing': 'f8',
+}
+
+# quality cuts recommended by the ZTF forced-photometry documentation, used unless overridden in settings.BROKERS['ztf']
+DEFAULT_PROCSTATUS = ['0']
+DEFAULT_INFOBITS_MASK = ~(2 ** 25 - 1)   # every bit from 2**25 up, i.e. infobitssci >= 33554432
+DEFAULT_MAX_SEEING = 4.0   # pixels
+
+# the ``index, field, ccdid, ...`` line naming the columns, which may or may not be commented out
+ZTF_HEADER = re.compile(r'^[#\s]*index\s*,.*$', re.MULTILINE)
+
+
+def parse_ztf_result(textdata, columns=ZTF_COLUMN_DTYPES):
+    """
+    Parses the text of a ZTF forced-photometry file into a NumPy structured array. The columns are found by their
+    names in the ``index, field, ccdid, ...`` header, so comment lines added or removed above it do not matter, and
+    only the ``columns`` needed are read, by one ``np.loadtxt`` call. ``null`` values are read as NaN.
+
+    :param textdata: contents of the forced-photometry file
+    :type textdata: str
+
+    :param columns: dtypes of the columns to read, keyed by their header names
+    :type columns: dict
+
+    :returns: structured array, e.g. ``data['jd']``, ``data['forcediffimflux']``
+    :rtype: numpy.ndarray
+    """
+    header = ZTF_HEADER.search(textdata)
+    if header is None:
+        raise InvalidFileFormatException('No column names found in the ZTF forced-photometry file')
+    names = [name.strip() for name in header.group().lstrip('#').split(',')]
+
+    missing = [name for name in columns if name not in names]
+    if missing:
+        raise InvalidFileFormatException('ZTF forced-photometry file has no {} column'.format(', '.join(missing)))
+
+    dtype = np.dtype([(name, dtype) for name, dtype in columns.items()])
+    body = textdata[header.end():].replace('null', 'nan')
+    if not body.strip('#-END \n'):
+        return np.empty(0, dtype=dtype)
+
+    return np.loadtxt(StringIO(body), dtype=dtype, comments='#', usecols=[names.index(name) for name in columns],
+                      ndmin=1)
+
+
+def ztf_quality_mask(data, procstatus=None, infobits_mask=None, max_seeing=None):
+    """
+    Returns which epochs of a parsed ZTF file pass the quality cuts: a ``procstatus`` in the whitelist, no
+    ``infobitssci`` bit in the mask set, a seeing of at most ``max_seeing`` and a measured flux and flux error.
+
+    The cuts default to ``PROCSTATUS``, ``INFOBITS_MASK`` and ``MAX_SEEING`` in ``settings.BROKERS['ztf']``, or to
+    the ZTF recommendations: ``procstatus`` 0, ``infobitssci`` below 33554432 and a seeing of at most 4 pixels.
+
+    :param procstatus: Accepted ``procstatus`` codes
+    :type procstatus: list
+
+    :param infobits_mask: Bits of ``infobitssci`` that reject an epoch
+    :type infobits_mask: int
+
+    :param max_seeing: Largest accepted ``sciinpseeing``, in pixels
+    :type max_seeing: float
+
+    :returns: boolean array, True for the epochs to keep
+    :rtype: numpy.ndarray
+    """
+    broker = settings.BROKERS['ztf']
+    if procstatus is None:
+        procstatus = broker.get('PROCSTATUS', DEFAULT_PROCSTATUS)
+    if infobits_mask is None:
+        infobits_mask = broker.get('INFOBITS_MASK', DEFAULT_INFOBITS_MASK)
+    if max_seeing is None:
+        max_seeing = broker.get('MAX_SEEING', DEFAULT_MAX_SEEING)
+
+    return (np.isin(np.char.strip(data['procstatus']), [str(code) for code in procstatus])
+            & (data['infobitssci'] & infobits_mask == 0)
+            & (data['sciinpseeing'] <= max_seeing)
+            & np.isfinite(data['forcediffimflux'])
+            & np.isfinite(data['forcediffimfluxunc']))
+
+
+def ztf_magnitudes(data, snr_limit=None):
+    """
+    Converts the forced difference-image fluxes of a parsed ZTF file to magnitudes with the difference-image zero
+    point. Epochs with a signal-to-noise ratio below ``snr_limit`` (including every zero or negative flux) are
+    non-detections: their magnitude and error are NaN and their limit is the difference image's ``diffmaglim``.
+    Detections have a NaN limit.
+
+    :param snr_limit: Minimum ``forcediffimflux / forcediffimfluxunc`` of a detection. Defaults to ``SNR_LIMIT`` in
+        ``settings.BROKERS['ztf']``, or 3.
+    :type snr_limit: float
+
+    :returns: magnitude, magnitude error and limit arrays
+    :rtype: tuple
+    """
+    if snr_limit is None:
+        snr_limit = settings.BROKERS['ztf'].get('SNR_LIMIT', 3.0)
+    flux = data['forcediffimflux']
+    flux_error = data['forcediffimfluxunc']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        detected = (flux > 0) & (flux > snr_limit * flux_error)
+        magnitude = np.where(detected, data['zpdiff'] - 2.5 * np.log10(flux), np.nan)
+        magnitude_error = np.where(detected, (2.5 / np.log(10.0)) * flux_error / flux, np.nan)
+    limit = np.where(detected, np.nan, data['diffmaglim'])
+
+    return magnitude, magnitude_error, limit
+
+
+def ztf_photometry(data):
+    """
+    Turns the rows of a parsed ZTF file (see ``parse_ztf_result``) into the timestamps and values of their photometry
+    ``ReducedDatum`` objects. Epochs failing the quality cuts of ``ztf_quality_mask`` are dropped, and epochs below
+    the signal-to-noise limit are stored as a ``limit`` (see ``ztf_magnitudes``).
+
+    :returns: list of UTC datetimes and list of value dicts, one of each per epoch kept
+    :rtype: tuple
+    """
+    data = data[ztf_quality_mask(data)]
+    magnitude, magnitude_error, limit = ztf_magnitudes(data)
+    detected = ~np.isnan(magnitude)
+    timestamps = times_to_datetimes(data['jd'], format='jd')
+
+    values = []
+    for is_detection, mag, mag_error, lim, filter in zip(
+            detected.tolist(), magnitude.tolist(), magnitude_error.tolist(), limit.tolist(), data['filter'].tolist()):
+        if is_detection:
+            values.append({'magnitude': mag, 'error': mag_error, 'filter': filter})
+        else:   # non-detection, stored as an upper limit
+            values.append({'limit': lim, 'filter': filter})
+    return timestamps, values
+
 
 def run_data_processor(dp):
 
@@ -34,13 +172,8 @@ def run_data_processor(dp):
     data_processor = clazz()
     data = data_processor.process_data(dp)   # MAIN FUNC, returns variables time and data
     try:
-
-        target = Target.objects.filter(target = dp.target)
-
-        reduced_datums = [ReducedDatum(target=target, data_product = dp, data_type='photometry',
-                             timestamp=datum[0], value=datum[1], source_name = datum[2]) for datum in data]
-
-        ReducedDatum.objects.bulk_create(reduced_datums)
+        bulk_ingest(dp.target, (datum[0] for datum in data), (datum[1] for datum in data),
+                    source_name='ZTF', data_product=dp)
 
         return ReducedDatum.objects.filter(data_product=dp)
 
@@ -67,81 +200,29 @@ class MyDataProcessor(DataProcessor):
         ingestion
         :type data_product: DataProduct
 
-        :returns: python list of 2-tuples, each with a timestamp and corresponding data
+        :returns: python list of 3-tuples, each with a timestamp, the corresponding data and the source name
         :rtype: list
         """
 
         mimetype = mimetypes.guess_type(data_product.data.path)[0]
         if mimetype in self.PLAINTEXT_MIMETYPES:
-            photometry = self._process_photometry_from_plaintext(data_product)   # should this be where all data reduction occurs from text file
-            return [(datum.pop('timestamp'), datum, datum.pop('source', 'ZTF')) for datum in photometry]
+            timestamps, values = self._process_photometry_from_plaintext(data_product)
+            return [(timestamp, value, 'ZTF') for timestamp, value in zip(timestamps, values)]
         else:
             raise InvalidFileFormatException('Unsupported file type')
 
     def _process_photometry_from_plaintext(self, data_product):
         """
-        Processes the photometric data from a plaintext file into a list of dicts. File is read using astropy as
-        specified in the below documentation. The file is expected to be a multi-column delimited file, with headers for
-        time, magnitude, filter, and error.
-        # http://docs.astropy.org/en/stable/io/ascii/read.html
+        Processes the photometric data from a ZTF forced-photometry file into timestamps and value dicts. The file is
+        read by ``parse_ztf_result`` and the epochs are converted by ``ztf_photometry``, in a single pass over arrays.
 
-        :param data_product: Photometric DataProduct which will be processed into a list of dicts
+        :param data_product: Photometric DataProduct which will be processed
         :type data_product: DataProduct
 
-        :returns: python list containing the photometric data from the DataProduct
-        :rtype: list
+        :returns: list of UTC datetimes and list of value dicts, one of each per epoch
+        :rtype: tuple
         """
+        with open(data_product.data.path, 'rt') as fin:
+            data = parse_ztf_result(fin.read())
 
-        fin = open(data_product.data.path, 'rt')
-
-        JD = []
-        filter = []
-
-        flux = []
-        flux_err = []
-        zpdiff = []
-        diffmaglim = []
-
-        for index, line in enumerate(fin):  # dp is the text file
-            entries = line.replace("\n", "").split()
-
-            if index > 55:  # index at start of actual and onwards
-
-                for idx, x in enumerate(entries):
-                    if idx == 4:
-                        filter.append(str(x))  # filter code + JD == string
-                    elif idx == 22:
-                        JD.append(str(x))
-                    elif idx == 19 or idx == 20 or idx == 24 or idx == 25:
-                        if idx == 19:
-                            diffmaglim.append(float(x))  # diffmaglim
-                        elif idx == 20:
-                            zpdiff.append(float(x))  # zpdiff
-                        elif idx == 24:
-                            flux.append(float(x))  # forcediffimflux
-                        elif idx == 25:
-                            flux_err.append(float(x))  # forcediffimfluxunc (i.e. uncertainty)
-
-        mag = [i - 2.5 * np.log10(j) for i, j in zip(zpdiff, flux)]
-        mag_err = [(2.5 / np.log(10.0)) * i / j for i, j in zip(flux_err, flux)]  # mag_err
-
-        final_mag = [j if i > j or np.isnan(i) else i for i, j in zip(mag, diffmaglim)]  # final mag
-
-        photometry = []
-
-        for i in range(len(JD)):
-
-            t = Time(float(JD[i]), format='jd')
-            utc = TimezoneInfo(utc_offset=0*units.hour)
-            t.format = 'datetime'
-        #    time.append(t.to_datetime(timezone=utc))
-            value = {
-                'timestamp': t.to_datetime(timezone=utc),
-            }
-            for x in range(len(final_mag)):
-                value['magnitude'] = final_mag[i]
-                value['error'] = mag_err[i]
-                value['filter'] = filter[i]
-            photometry.append(value)
-
-        return photometry
\ No newline at end of file
+        return ztf_photometry(data)